@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Generates a synthetic auth.log with attacks described by the filters of the profiles and ordinary system noise
+Usage: generate_log.py OUTPUT [--lines N] [--attack-ratio R] [--attackers N] [--seed S] [--profiles FILE]
+                       [--start-time T]
+"""
+import argparse
+import json
+import os
+import random
+import re
+from datetime import datetime
+from typing import Dict, List
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir))
+DEFAULT_PROFILES = os.path.join(REPO_DIR, 'data', 'profiles', 'default.json')
+
+# lines that are written into auth.log but are not attacks
+NOISE_LINES = [
+    'CRON[%PID%]: pam_unix(cron:session): session opened for user root by (uid=0)',
+    'CRON[%PID%]: pam_unix(cron:session): session closed for user root',
+    'sshd[%PID%]: Accepted publickey for %USER% from %IP% port %PORT% ssh2: RSA SHA256:%HASH%',
+    'sshd[%PID%]: pam_unix(sshd:session): session opened for user %USER% by (uid=0)',
+    'sshd[%PID%]: Received disconnect from %IP% port %PORT%:11: disconnected by user',
+    'systemd-logind[%PID%]: New session %PID% of user %USER%.',
+    'sudo: %USER% : TTY=pts/0 ; PWD=/home/%USER% ; USER=root ; COMMAND=/usr/bin/apt update',
+]
+USERS = ['root', 'admin', 'test', 'oracle', 'ubuntu', 'git', 'postgres', 'user', 'pi', 'deploy']
+# the logs start at this time shifted by whole days by the seed, so the same seed always generates the same log. It is
+# in a year that is not a leap one, as the dates of syslog have no year and the parser dates them to the current year
+DEFAULT_EPOCH = 1609459200  # 2021-01-01 00:00:00 UTC
+
+
+class LogGenerator:
+    """
+    Generates the lines of the synthetic log. The same seed always generates the same log
+    """
+
+    def __init__(self, filters, attack_ratio=0.1, attackers=1000, seed=0, start_time=None):
+        # type: (List[str], float, int, int, float or None) -> None
+        """
+        Initializes the generator
+        :param filters: filters of the profiles, the attack lines are generated from them
+        :param attack_ratio: share of the lines that are attacks, from 0 to 1
+        :param attackers: number of distinct attacking IPs
+        :param seed: seed of the random generator
+        :param start_time: timestamp of the first line. If None, then it is DEFAULT_EPOCH shifted by the seed
+        """
+        self.filters = filters
+        self.attack_ratio = attack_ratio
+        self.random = random.Random(seed)
+        self.attacker_ips = ['%d.%d.%d.%d' % (self.random.randint(1, 223), self.random.randint(0, 255),
+                                              self.random.randint(0, 255), self.random.randint(1, 254))
+                             for _ in range(attackers)]
+        self.start_time = start_time if start_time is not None else DEFAULT_EPOCH + seed % 28 * 24 * 60 * 60
+
+    def _fill(self, template, ip, timestamp):  # type: (str, str, datetime) -> str
+        """
+        Replaces the variables of the filter with generated values
+        :param template: the filter or noise line with variables stated as %VAR_NAME%
+        :param ip: IP used for the variable IP
+        :param timestamp: time used for the date and time variables
+        :return: the line without variables
+        """
+        values = {
+            'D:M': timestamp.strftime('%b'),
+            'D:D': '%2d' % timestamp.day,
+            'TIME': timestamp.strftime('%H:%M:%S'),
+            'IP': ip,
+            'USER': self.random.choice(USERS),
+            'PID': str(self.random.randint(100, 65000)),
+            'PORT': str(self.random.randint(1024, 65535)),
+            'HOSTNAME': 'server',
+            'HASH': '%032x' % self.random.getrandbits(128),
+        }
+        return re.sub('%([A-Z:]+?)%', lambda match: values.get(match.group(1), match.group(1).lower()), template)
+
+    def lines(self, count):  # type: (int) -> iter
+        """
+        Generates the lines of the log, one line per second
+        :param count: number of lines to generate
+        :return: generator of the lines without the line separator
+        """
+        for i in range(count):
+            timestamp = datetime.fromtimestamp(self.start_time + i)
+            if self.random.random() < self.attack_ratio:
+                yield self._fill(self.random.choice(self.filters), self.random.choice(self.attacker_ips), timestamp)
+            else:
+                ip = '10.0.%d.%d' % (self.random.randint(0, 255), self.random.randint(1, 254))
+                yield self._fill('%D:M% %D:D% %TIME% %HOSTNAME% ' + self.random.choice(NOISE_LINES), ip, timestamp)
+
+
+def load_filters(profiles_file=DEFAULT_PROFILES):  # type: (str) -> Dict[str, List[str]]
+    """
+    Loads the filters of all profiles in the profiles file
+    :param profiles_file: path to the JSON file with profiles
+    :return: dictionary where key is the name of the profile and value is the list of its filters
+    """
+    with open(profiles_file, 'r') as f:
+        return {profile: profile_data['filters'] for profile, profile_data in json.load(f).items()}
+
+
+def generate_log(file_path, lines, attack_ratio=0.1, attackers=1000, seed=0, profiles_file=DEFAULT_PROFILES,
+                 start_time=None):
+    # type: (str, int, float, int, int, str, float or None) -> None
+    """
+    Writes the synthetic log into the file
+    :param file_path: path to the generated log file
+    :param lines: number of generated lines
+    :param attack_ratio: share of the lines that are attacks, from 0 to 1
+    :param attackers: number of distinct attacking IPs
+    :param seed: seed of the random generator
+    :param profiles_file: path to the JSON file with profiles whose filters are used for the attacks
+    :param start_time: timestamp of the first line. If None, then it is DEFAULT_EPOCH shifted by the seed
+    :return: None
+    """
+    filters = [log_filter for profile_filters in load_filters(profiles_file).values() for log_filter in profile_filters]
+    generator = LogGenerator(filters, attack_ratio, attackers, seed, start_time)
+    with open(file_path, 'w') as f:
+        for line in generator.lines(lines):
+            f.write(line + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates a synthetic auth.log with attacks')
+    parser.add_argument('output', help='path to the generated log file')
+    parser.add_argument('--lines', type=int, default=100000, help='number of generated lines')
+    parser.add_argument('--attack-ratio', type=float, default=0.1, help='share of the lines that are attacks')
+    parser.add_argument('--attackers', type=int, default=1000, help='number of distinct attacking IPs')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    parser.add_argument('--profiles', default=DEFAULT_PROFILES, help='JSON file with profiles used for the attacks')
+    parser.add_argument('--start-time', type=float, help='timestamp of the first line, eg. the current time minus '
+                                                         'the number of lines for a log ending now')
+    args = parser.parse_args()
+    generate_log(args.output, args.lines, args.attack_ratio, args.attackers, args.seed, args.profiles, args.start_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Runs the benchmarks of the parsing, cold start, offender detection, database ingest and time-to-ban on a synthetic log
+Usage: run.py [--lines N] [--attack-ratio R] [--seed S] [--output FILE] [--compare FILE]
+The results can be saved as JSON and compared with the results of another release
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sqlite3
+import stat
+import sys
+import time
+from tempfile import TemporaryDirectory
+from types import ModuleType
+from typing import Callable, Dict, List
+
+from generate_log import REPO_DIR, LogGenerator, generate_log, load_filters
+
+sys.path.insert(0, REPO_DIR)
+
+import database  # noqa: E402
+import log_manipulator  # noqa: E402
+
+SCAN_RANGE = 600  # scanRange and maxAttempts of the default profile
+MAX_ATTEMPTS = 5
+NETWORK_MODULES = ['requests']  # modules needed by simple-guardian.py only to talk to the server or GitHub
+
+
+def best_of(repeat, function):  # type: (int, Callable[[], float]) -> float
+    """
+    Runs the measurement multiple times and returns the best result, which is the least affected by noise
+    :param repeat: number of runs
+    :param function: function performing one run and returning the measured time in seconds
+    :return: the shortest measured time in seconds
+    """
+    return min(function() for _ in range(repeat))
+
+
+def bench_parse(log_file, filters, repeat):  # type: (str, Dict[str, List[str]], int) -> Dict[str, float]
+    """
+    Measures how fast are the lines of the whole log parsed by all profiles
+    :param log_file: path to the log file
+    :param filters: dictionary where key is the name of the profile and value is the list of its filters
+    :param repeat: number of runs
+    :return: dictionary with the results
+    """
+    with open(log_file, 'rb') as f:
+        lines = sum(1 for _ in f)
+
+    def run():  # type: () -> float
+        parsers = [log_manipulator.LogParser(log_file, profile_filters, backfill_workers=1)
+                   for profile_filters in filters.values()]
+        start = time.perf_counter()
+        for parser in parsers:
+            parser.parse_attacks()
+        duration = time.perf_counter() - start
+        for parser in parsers:
+            parser.close()
+        return duration
+
+    duration = best_of(repeat, run)
+    return {'parse_lines_per_second': lines * len(filters) / duration, 'parse_seconds': duration}
+
+
+def scan_max_age(log_file):  # type: (str) -> float
+    """
+    Computes the max age of the attacks that lets a scan of the generated log see the same lines as a scan of a log
+    ending now, so the results do not depend on when the benchmarks run
+    :param log_file: path to the log file
+    :return: twice the scan range, the max age used by the scanner, extended by the age of the last line of the log
+    """
+    with open(log_file, 'rb') as f:
+        last_line, _ = next(log_manipulator.read_log_lines_reversed(f, os.path.getsize(log_file)))
+    return SCAN_RANGE * 2 + time.time() - log_manipulator.parse_log_time(last_line)
+
+
+def bench_cold_start(log_file, filters, repeat):  # type: (str, Dict[str, List[str]], int) -> Dict[str, float]
+    """
+    Measures the first scan of the log by new parsers, which read only the lines younger than the scan window
+    :param log_file: path to the log file
+    :param filters: dictionary where key is the name of the profile and value is the list of its filters
+    :param repeat: number of runs
+    :return: dictionary with the results
+    """
+    def run():  # type: () -> float
+        parsers = [log_manipulator.LogParser(log_file, profile_filters, backfill_workers=1)
+                   for profile_filters in filters.values()]
+        max_age = scan_max_age(log_file)
+        start = time.perf_counter()
+        for parser in parsers:
+            parser.parse_attacks(max_age=max_age)
+        duration = time.perf_counter() - start
+        for parser in parsers:
+            parser.close()
+        return duration
+
+    return {'cold_start_seconds': best_of(repeat, run)}
+
+
+def bench_offenders(log_file, filters, repeat):  # type: (str, Dict[str, List[str]], int) -> Dict[str, float]
+    """
+    Measures the latency of finding the habitual offenders among the parsed attacks
+    :param log_file: path to the log file
+    :param filters: dictionary where key is the name of the profile and value is the list of its filters
+    :param repeat: number of runs
+    :return: dictionary with the results
+    """
+    parsers = [log_manipulator.LogParser(log_file, profile_filters, backfill_workers=1)
+               for profile_filters in filters.values()]
+    max_age = scan_max_age(log_file)
+    parsed = [(parser, parser.parse_attacks(max_age=max_age)) for parser in parsers]
+
+    def run():  # type: () -> float
+        start = time.perf_counter()
+        for parser, attacks in parsed:
+            parser.get_habitual_offenders(MAX_ATTEMPTS, SCAN_RANGE, attacks=attacks)
+        return time.perf_counter() - start
+
+    duration = best_of(repeat, run)
+    for parser in parsers:
+        parser.close()
+    return {'offenders_seconds': duration}
+
+
+def bench_ingest(log_file, filters, directory):  # type: (str, Dict[str, List[str]], str) -> Dict[str, float]
+    """
+    Measures how fast are the parsed attacks saved into the database
+    :param log_file: path to the log file
+    :param filters: dictionary where key is the name of the profile and value is the list of its filters
+    :param directory: directory where the database is created
+    :return: dictionary with the results
+    """
+    rows = []
+    for profile, profile_filters in filters.items():
+        parser = log_manipulator.LogParser(log_file, profile_filters, backfill_workers=1)
+        for ip, ip_attacks in parser.parse_attacks().items():
+            rows += [(ip, attack, profile) for attack in ip_attacks]
+        parser.close()
+
+    connection = sqlite3.connect(os.path.join(directory, 'bench.db'))
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    storage = database.AttackStorage(connection)
+    start = time.perf_counter()
+    for ip, attack, profile in rows:
+        if not storage.contains(ip, attack.timestamp, profile):
+            storage.insert(ip, attack.as_dict(), profile)
+    connection.commit()
+    duration = time.perf_counter() - start
+    connection.close()
+    return {'ingest_rows_per_second': len(rows) / duration if duration > 0 else 0.0, 'ingest_rows': len(rows)}
+
+
+class OfflineModule(ModuleType):
+    """
+    Stands for a missing module that Simple Guardian uses only to talk to the server or GitHub, which the benchmarks
+    never do
+    """
+
+    def __getattr__(self, name):
+        raise RuntimeError('module %s is not installed, the benchmarks cannot use the network' % self.__name__)
+
+
+def load_simple_guardian():  # type: () -> ModuleType
+    """
+    Loads simple-guardian.py as a module, so the benchmarks can drive its classes. Only the file executed as the main
+    script runs the program, loading it just defines the classes. The missing network modules are replaced by
+    OfflineModule, so the benchmarks run without them
+    :return: the loaded module
+    """
+    for network_module in NETWORK_MODULES:
+        if network_module not in sys.modules and importlib.util.find_spec(network_module) is None:
+            sys.modules[network_module] = OfflineModule(network_module)
+    spec = importlib.util.spec_from_file_location('simple_guardian', os.path.join(REPO_DIR, 'simple-guardian.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_time_to_ban(filters, directory, seed):  # type: (Dict[str, List[str]], str, int) -> Dict[str, float]
+    """
+    Measures the time from writing the attack that makes the IP a habitual offender into the followed log to its ban.
+    The log is scanned by the scanner of Simple Guardian, the offender is blocked by its ThreadBlocker and IPBlocker
+    and the attacks are saved by its ThreadPersister. Only the blocker is a fake script that records the blocked IP
+    :param filters: dictionary where key is the name of the profile and value is the list of its filters
+    :param directory: directory where the log, the database and the blocker are created
+    :param seed: seed of the random generator
+    :return: dictionary with the results
+    """
+    log_file = os.path.join(directory, 'live.log')
+    blocked_file = os.path.join(directory, 'blocked')
+    blocker = os.path.join(directory, 'blocker')
+    with open(blocker, 'w') as f:
+        f.write('#!/bin/sh\nif [ "$1" = block ]; then echo "$2" >> "%s"; fi\n' % blocked_file)
+    os.chmod(blocker, os.stat(blocker).st_mode | stat.S_IEXEC)
+
+    simple_guardian = load_simple_guardian()
+    simple_guardian.CONFIG['blockerCommand'] = blocker
+    simple_guardian.CONFIG['blockerDaemon'] = False
+    simple_guardian.CONFIG['firewall']['backend'] = 'blocker'
+    simple_guardian.Database.init(os.path.join(directory, 'ban.db'))
+    simple_guardian.IPBlocker.init()
+    simple_guardian.ThreadBlocker().start()
+    simple_guardian.ThreadPersister().start()
+    scanner = simple_guardian.ThreadScanner
+
+    profile, profile_filters = next(iter(filters.items()))
+    # the live log is scanned with the scan window ending now, so the attacks are made now
+    generator = LogGenerator(profile_filters[:1], attack_ratio=1.0, attackers=1, seed=seed,
+                             start_time=time.time() - MAX_ATTEMPTS)
+    with open(log_file, 'w'):
+        pass
+    parser = log_manipulator.LogParser(log_file, profile_filters, backfill_workers=1)
+    profiles = {profile: {'parser': parser, 'maxAttempts': MAX_ATTEMPTS, 'scanRange': SCAN_RANGE}}
+    scanner.scan_log_file(profiles)
+
+    attack_lines = list(generator.lines(MAX_ATTEMPTS))
+    with open(log_file, 'a') as f:
+        f.write('\n'.join(attack_lines[:-1]) + '\n')
+    scanner.scan_log_file(profiles)
+
+    start = time.perf_counter()
+    with open(log_file, 'a') as f:
+        f.write(attack_lines[-1] + '\n')
+    for profile, (_, new_attacks) in scanner.scan_log_file(profiles).items():
+        simple_guardian.ThreadPersister.submit([(ip, attack.as_dict(), profile) for ip, ip_attacks in
+                                                new_attacks.items() for attack in ip_attacks])
+    # the offender is banned by the blocker thread once its last attack is parsed
+    deadline = time.monotonic() + 10
+    while len(simple_guardian.IPBlocker.banned_ips) == 0 and time.monotonic() < deadline:
+        time.sleep(0.0005)
+    duration = time.perf_counter() - start
+    simple_guardian.AppRunning.set_running(False)
+    parser.close()
+
+    if len(simple_guardian.IPBlocker.banned_ips) == 0 or not os.path.isfile(blocked_file):
+        raise RuntimeError('the attacker was not blocked')
+    return {'time_to_ban_seconds': duration}
+
+
+def compare(results, baseline):  # type: (Dict[str, float], Dict[str, float]) -> None
+    """
+    Prints the results next to the baseline results with the relative change
+    :param results: results of this run
+    :param baseline: results of the run to compare with
+    :return: None
+    """
+    for name, value in results.items():
+        if name not in baseline or not baseline[name]:
+            print('%-26s %14.4f' % (name, value))
+            continue
+        print('%-26s %14.4f %14.4f %+8.1f%%' % (name, value, baseline[name], (value / baseline[name] - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of Simple Guardian')
+    parser.add_argument('--lines', type=int, default=20000, help='number of lines of the generated log')
+    parser.add_argument('--attack-ratio', type=float, default=0.1, help='share of the lines that are attacks')
+    parser.add_argument('--attackers', type=int, default=1000, help='number of distinct attacking IPs')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each benchmark, the best is taken')
+    parser.add_argument('--output', help='save the results as JSON into this file')
+    parser.add_argument('--compare', help='JSON file with results of another run to compare with')
+    args = parser.parse_args()
+
+    filters = load_filters()
+    results = {}  # type: Dict[str, float]
+    with TemporaryDirectory() as directory:
+        log_file = os.path.join(directory, 'auth.log')
+        generate_log(log_file, args.lines, args.attack_ratio, args.attackers, args.seed)
+        results.update(bench_parse(log_file, filters, args.repeat))
+        results.update(bench_cold_start(log_file, filters, args.repeat))
+        results.update(bench_offenders(log_file, filters, args.repeat))
+        results.update(bench_ingest(log_file, filters, directory))
+        results.update(bench_time_to_ban(filters, directory, args.seed))
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+    else:
+        for name, value in results.items():
+            print('%-26s %14.4f' % (name, value))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,25 @@
+#define _GNU_SOURCE
 #include <stdio.h>
 #include <string.h>
 #include <stdlib.h>
 #include <sys/types.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/un.h>
 #include <unistd.h>
+#include <poll.h>
 #include <pwd.h>
+#include <signal.h>
 
 #define iptables /sbin/iptables
 #define ipset /sbin/ipset
 #define username "simpleguardian"
 #define indexCommand 1
 #define indexIp 2
+#define indexSocket 2
+#define maxClients 16
+#define maxIpLength 64
+#define clientBufferSize 65536
 
 /**
  ____  _            _
@@ -21,6 +31,14 @@
 Program that uses iptables to block or unblock IP
 Usage: first init with ./blocker init
 then proceed with blocker block/unblock IP
+or start the daemon with blocker serve SOCKET_PATH
+
+The daemon checks the requirements once and then takes the commands over the Unix socket, one command per line:
+block IP, unblock IP or test IP. Every command gets one reply line: ok, failed or invalid (yes or no for test).
+Multiple commands can be sent at once, the blocks and unblocks are then applied together by one ipset restore.
+The socket is created with the permissions of the user who started the daemon
+and only this user or root can use it.
+The daemon exits when its standard input is closed, so it ends together with the program that started it.
 
 Is supposed to be executed with root privileges, so as protection from executing by unauthorized user
 the program checks if you are user simpleguardian or root.
@@ -35,6 +53,7 @@ chmod u+s blocker
 void help(int exitStatus){
     printf("usage: init with: blocker init\n");
     printf("then usage: blocker block/unblock ip\n");
+    printf("or: blocker serve socket_path\n");
     exit(exitStatus);
 }
 
@@ -88,6 +107,227 @@ int is_already_blocked(char **argv) {
     return system(command_check_if_blocked_formatted) == 0;
 }
 
+typedef struct {
+    int fd;
+    size_t length;
+    char buffer[clientBufferSize];
+} client_t;
+
+void apply_changes(char **commands, char **ips, const int *lines, int count, const char **replies) {
+    /*
+    Applies the blocks and unblocks of the listed lines by one ipset restore
+    If the restore fails, the changes are applied one by one to find out which of them failed
+    */
+    if (count == 0) {
+        return;
+    }
+    FILE *restore = popen("ipset restore -exist > /dev/null 2>&1", "w");
+    if (restore != NULL) {
+        for (int i = 0; i < count; i++) {
+            fprintf(restore, "%s simpleguardian %s\n", strcmp("block", commands[lines[i]]) ? "del" : "add",
+                    ips[lines[i]]);
+        }
+        if (pclose(restore) == 0) {
+            for (int i = 0; i < count; i++) {
+                replies[lines[i]] = "ok\n";
+            }
+            return;
+        }
+    }
+    for (int i = 0; i < count; i++) {
+        char command[maxIpLength + 64];
+        snprintf(command, sizeof(command), "ipset -exist %s simpleguardian '%s' > /dev/null 2>&1",
+                 strcmp("block", commands[lines[i]]) ? "del" : "add", ips[lines[i]]);
+        replies[lines[i]] = system(command) == 0 ? "ok\n" : "failed\n";
+    }
+}
+
+int serve_commands(client_t *client) {
+    /*
+    Executes all complete command lines in the buffer of the client and sends the replies
+    Returns 0 if the client should be disconnected, 1 otherwise
+    */
+    int count = 0;
+    for (size_t i = 0; i < client->length; i++) {
+        count += client->buffer[i] == '\n';
+    }
+    if (count == 0) {
+        return client->length < clientBufferSize;  // too long line without the end is not a command
+    }
+
+    char **commands = (char**)malloc(count * sizeof(char*));
+    char **ips = (char**)malloc(count * sizeof(char*));
+    const char **replies = (const char**)malloc(count * sizeof(char*));
+    int *changes = (int*)malloc(count * sizeof(int));
+    int changes_count = 0;
+    char *line = client->buffer;
+    for (int i = 0; i < count; i++) {
+        char *line_end = (char*)memchr(line, '\n', client->buffer + client->length - line);
+        *line_end = '\0';
+        commands[i] = line;
+        ips[i] = strchr(line, ' ');
+        line = line_end + 1;
+        if (ips[i] == NULL) {
+            replies[i] = "invalid\n";
+            continue;
+        }
+        *ips[i]++ = '\0';
+        if (strlen(ips[i]) == 0 || strlen(ips[i]) > maxIpLength || !check_ip_valid(ips[i])) {
+            replies[i] = "invalid\n";
+        } else if (!strcmp("block", commands[i]) || !strcmp("unblock", commands[i])) {
+            changes[changes_count++] = i;
+        } else if (!strcmp("test", commands[i])) {
+            // the changes sent before the test must be visible to it
+            apply_changes(commands, ips, changes, changes_count, replies);
+            changes_count = 0;
+            char command[maxIpLength + 64];
+            snprintf(command, sizeof(command), "ipset test simpleguardian '%s' > /dev/null 2>&1", ips[i]);
+            replies[i] = system(command) == 0 ? "yes\n" : "no\n";
+        } else {
+            replies[i] = "invalid\n";
+        }
+    }
+    apply_changes(commands, ips, changes, changes_count, replies);
+
+    size_t reply_length = 0;
+    for (int i = 0; i < count; i++) {
+        reply_length += strlen(replies[i]);
+    }
+    char *reply = (char*)malloc(reply_length + 1);
+    reply[0] = '\0';
+    char *reply_end = reply;
+    for (int i = 0; i < count; i++) {
+        reply_end = stpcpy(reply_end, replies[i]);
+    }
+    int connected = 1;
+    for (size_t sent = 0; sent < reply_length && connected;) {
+        const ssize_t written = send(client->fd, reply + sent, reply_length - sent, MSG_NOSIGNAL);
+        connected = written > 0;
+        sent += written > 0 ? (size_t)written : 0;
+    }
+
+    client->length -= line - client->buffer;
+    memmove(client->buffer, line, client->length);
+    free(commands);
+    free(ips);
+    free(replies);
+    free(changes);
+    free(reply);
+    return connected;
+}
+
+int create_socket(const char *socket_path) {
+    /*
+    Creates the listening Unix socket with the permissions of the user who executed this program, so the user
+    cannot make root overwrite or delete other files by the path
+    Returns the socket or -1 on error
+    */
+    const uid_t effective_uid = geteuid();
+    struct sockaddr_un address;
+    if (strlen(socket_path) >= sizeof(address.sun_path)) {
+        printf("the socket path is too long\n");
+        return -1;
+    }
+    memset(&address, 0, sizeof(address));
+    address.sun_family = AF_UNIX;
+    strcpy(address.sun_path, socket_path);
+
+    if (seteuid(getuid()) != 0) {
+        return -1;
+    }
+    struct stat socket_stat;
+    if (lstat(socket_path, &socket_stat) == 0 && S_ISSOCK(socket_stat.st_mode)) {
+        unlink(socket_path);  // left by the previous daemon
+    }
+    const mode_t previous_umask = umask(0177);
+    int server = socket(AF_UNIX, SOCK_STREAM, 0);
+    if (server < 0 || bind(server, (struct sockaddr*)&address, sizeof(address)) != 0 || listen(server, 16) != 0) {
+        perror("cannot listen on the socket");
+        if (server >= 0) {
+            close(server);
+        }
+        server = -1;
+    }
+    umask(previous_umask);
+    if (seteuid(effective_uid) != 0) {
+        exit(1);
+    }
+    return server;
+}
+
+int serve(const char *socket_path) {
+    /*
+    Serves the commands sent over the socket until the standard input is closed
+    */
+    const uid_t owner_uid = getuid();
+    const int server = create_socket(socket_path);
+    if (server < 0) {
+        return 1;
+    }
+    setuid(0);
+    signal(SIGPIPE, SIG_IGN);
+    printf("serving on %s\n", socket_path);
+    fflush(stdout);
+
+    client_t *clients[maxClients] = {NULL};
+    struct pollfd fds[maxClients + 2];
+    while (1) {
+        fds[0].fd = 0;
+        fds[0].events = POLLIN;
+        fds[1].fd = server;
+        fds[1].events = POLLIN;
+        for (int i = 0; i < maxClients; i++) {
+            fds[i + 2].fd = clients[i] != NULL ? clients[i]->fd : -1;
+            fds[i + 2].events = POLLIN;
+        }
+        if (poll(fds, maxClients + 2, -1) < 0) {
+            continue;
+        }
+
+        if (fds[0].revents) {
+            char ignored[256];
+            if (read(0, ignored, sizeof(ignored)) <= 0) {
+                return 0;
+            }
+        }
+
+        if (fds[1].revents & POLLIN) {
+            const int fd = accept(server, NULL, NULL);
+            struct ucred credentials;
+            socklen_t credentials_length = sizeof(credentials);
+            int slot = -1;
+            for (int i = 0; i < maxClients && slot < 0; i++) {
+                slot = clients[i] == NULL ? i : -1;
+            }
+            if (fd >= 0 && (slot < 0 || getsockopt(fd, SOL_SOCKET, SO_PEERCRED, &credentials, &credentials_length)
+                            || (credentials.uid != 0 && credentials.uid != owner_uid))) {
+                close(fd);
+            } else if (fd >= 0) {
+                clients[slot] = (client_t*)malloc(sizeof(client_t));
+                clients[slot]->fd = fd;
+                clients[slot]->length = 0;
+            }
+        }
+
+        for (int i = 0; i < maxClients; i++) {
+            if (clients[i] == NULL || !fds[i + 2].revents) {
+                continue;
+            }
+            client_t *client = clients[i];
+            const ssize_t received = recv(client->fd, client->buffer + client->length,
+                                          clientBufferSize - client->length, 0);
+            if (received > 0) {
+                client->length += received;
+            }
+            if (received <= 0 || !serve_commands(client)) {
+                close(client->fd);
+                free(client);
+                clients[i] = NULL;
+            }
+        }
+    }
+}
+
 int main(int argc, char **argv){
     check_requirements();
 
@@ -99,6 +339,13 @@ int main(int argc, char **argv){
         help(0);
     }
 
+    if (!strcmp("serve", argv[indexCommand])){
+        if (argc < indexSocket + 1){
+            help(1);
+        }
+        exit(serve(argv[indexSocket]));
+    }
+
     setuid(0);
 
     if (!strcmp("init", argv[indexCommand])){
@@ -13,10 +13,15 @@ BUILD_OUTPUT_DIR = 'builds/out'
 
 WANTED_FILES = [
     'blocker',
+    'database.py',
+    'firewall.py',
     'github_updater.py',
     'requirements.txt',
     'http_socket_client.py',
     'log_manipulator.py',
+    'metrics.py',
+    'profiling.py',
+    'replay.py',
     'simple-guardian.py',
     'data/profiles/.gitkeep',
     'data/config.json',
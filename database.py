@@ -0,0 +1,207 @@
+import json
+import sqlite3
+from queue import Queue, Empty
+from threading import Lock
+from typing import Dict, List, Tuple
+
+# variables of an attack that have their own column in the database and so are not saved among the residual data
+STORED_VARIABLES = ('IP', 'IP-RAW', 'USER', 'HOSTNAME', 'SERVICE', 'TIMESTAMP')
+
+
+class AttackStorage:
+    """
+    Normalised storage of attacks inside the SQLite database
+    Repeated values (profile, service, hostname, user) are interned into the table `strings` and only the residual
+    variables are saved with each record. The view `attacks` reconstructs the original shape of the rows
+    """
+
+    def __init__(self, connection):  # type: (sqlite3.Connection) -> None
+        """
+        Initializes the storage, creating the schema and migrating the legacy table if needed
+        :param connection: connection to the database. All operations are performed with this connection
+        """
+        self.connection = connection
+        self._interned = {}  # type: Dict[str, int]  # value: id in table strings
+        self.create_schema()
+
+    def create_schema(self):  # type: () -> None
+        """
+        Creates the database schema if not exists yet and migrates attacks saved in the legacy format
+        :return: None
+        """
+        connection = self.connection
+        connection.execute('CREATE TABLE IF NOT EXISTS "bans" ('
+                           '`id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,'
+                           '`time` INTEGER NOT NULL,'
+                           '`ip` TEXT NOT NULL);')
+        connection.execute('CREATE TABLE IF NOT EXISTS "strings" ('
+                           '`id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,'
+                           '`value` TEXT NOT NULL UNIQUE);')
+        connection.execute('CREATE TABLE IF NOT EXISTS "attack_records" ('
+                           '`id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,'
+                           '`time` INTEGER NOT NULL,'
+                           '`ip` TEXT NOT NULL,'
+                           '`profile` INTEGER NOT NULL,'
+                           '`service` INTEGER,'
+                           '`hostname` INTEGER,'
+                           '`user` INTEGER,'
+                           '`extra` TEXT);')
+        connection.execute('CREATE INDEX IF NOT EXISTS "attack_records_ip_time" ON "attack_records" (`ip`, `time`);')
+        connection.execute('CREATE INDEX IF NOT EXISTS "attack_records_time" ON "attack_records" (`time`);')
+
+        legacy_table = connection.execute('SELECT COUNT(*) FROM sqlite_master WHERE type = ? AND name = ?',
+                                          ('table', 'attacks')).fetchone()[0] != 0
+        if legacy_table:
+            self.migrate_legacy_attacks()
+
+        # the view returns the same columns as the legacy table did, so the API consumers will not notice the change
+        connection.execute('CREATE VIEW IF NOT EXISTS "attacks" AS SELECT '
+                           'r.`id` AS `id`, r.`time` AS `time`, r.`ip` AS `ip`, p.`value` AS `profile`, '
+                           'u.`value` AS `user`, '
+                           'json_patch(COALESCE(r.`extra`, \'{}\'), json_object(\'USER\', u.`value`, '
+                           '\'HOSTNAME\', h.`value`, \'SERVICE\', s.`value`, \'TIMESTAMP\', r.`time`)) AS `data` '
+                           'FROM attack_records r '
+                           'JOIN strings p ON p.`id` = r.`profile` '
+                           'LEFT JOIN strings u ON u.`id` = r.`user` '
+                           'LEFT JOIN strings h ON h.`id` = r.`hostname` '
+                           'LEFT JOIN strings s ON s.`id` = r.`service`;')
+        connection.commit()
+
+    def migrate_legacy_attacks(self):  # type: () -> None
+        """
+        Moves all attacks from the legacy table `attacks`, which held a JSON of all variables in every row, into
+        the normalised table `attack_records` and drops the legacy table
+        :return: None
+        """
+        rows = self.connection.execute('SELECT `id`, `time`, `ip`, `profile`, `user`, `data` FROM attacks')
+        for attack_id, attack_time, ip, profile, user, data in list(rows):
+            try:
+                attack_data = json.loads(data)
+            except (TypeError, ValueError):
+                attack_data = {}
+            if user is not None:
+                attack_data['USER'] = user
+            attack_data['TIMESTAMP'] = attack_time
+            self.insert(ip, attack_data, profile, attack_id)
+        self.connection.execute('DROP TABLE attacks')
+
+    def intern(self, value):  # type: (str or None) -> int or None
+        """
+        Gets the id of the string inside table strings, inserting it there if it is not there yet
+        :param value: the string to intern
+        :return: id of the string or None if the value is None
+        """
+        if value is None:
+            return None
+        value_id = self._interned.get(value)
+        if value_id is None:
+            self.connection.execute('INSERT OR IGNORE INTO strings(`value`) VALUES (?);', (value,))
+            value_id = self.connection.execute('SELECT `id` FROM strings WHERE `value` = ?', (value,)).fetchone()[0]
+            self._interned[value] = value_id
+        return value_id
+
+    def contains(self, ip, timestamp, profile):  # type: (str, float, str) -> bool
+        """
+        Tests if the attack is already saved
+        :param ip: IP of the attacker
+        :param timestamp: timestamp of the attack
+        :param profile: name of the profile that detected the attack
+        :return: True if the attack is already saved, False otherwise
+        """
+        profile_id = self._interned.get(profile)
+        if profile_id is None:
+            row = self.connection.execute('SELECT `id` FROM strings WHERE `value` = ?', (profile,)).fetchone()
+            if row is None:  # the profile was never stored so neither was this attack
+                return False
+            profile_id = self._interned[profile] = row[0]
+        return self.connection.execute('SELECT COUNT(*) FROM attack_records WHERE ip = ? AND time = ? AND profile = ?',
+                                       (ip, timestamp, profile_id)).fetchone()[0] != 0
+
+    def insert(self, ip, attack_data, profile, attack_id=None):  # type: (str, dict, str, int or None) -> None
+        """
+        Saves the attack
+        :param ip: IP of the attacker
+        :param attack_data: dictionary with all variables parsed from the attack
+        :param profile: name of the profile that detected the attack
+        :param attack_id: optional id of the record. If None, then the next free id is used
+        :return: None
+        """
+        extra = {variable: value for variable, value in attack_data.items() if variable not in STORED_VARIABLES}
+        self.connection.execute('INSERT INTO `attack_records`(`id`,`time`,`ip`,`profile`,`service`,`hostname`,'
+                                '`user`,`extra`) VALUES (?,?,?,?,?,?,?,?);',
+                                (attack_id, attack_data['TIMESTAMP'], ip, self.intern(profile),
+                                 self.intern(attack_data.get('SERVICE')), self.intern(attack_data.get('HOSTNAME')),
+                                 self.intern(attack_data.get('USER')),
+                                 json.dumps(extra, separators=(',', ':')) if extra else None))
+
+    def insert_new(self, records):  # type: (List[Tuple[str, dict, str]]) -> int
+        """
+        Saves the attacks that are not saved yet, so a whole batch is saved by a single call
+        :param records: list of tuples (IP of the attacker, dictionary with all variables parsed from the attack, name
+        of the profile that detected the attack)
+        :return: number of newly saved attacks
+        """
+        inserted = 0
+        for ip, attack_data, profile in records:
+            if not self.contains(ip, attack_data['TIMESTAMP'], profile):
+                self.insert(ip, attack_data, profile)
+                inserted += 1
+        return inserted
+
+
+class ReaderPool:
+    """
+    Small pool of read-only connections to the database
+    With the database in the WAL mode, readers from the pool do not wait for the writer and vice versa
+    """
+
+    def __init__(self, file_path, size=4):  # type: (str, int) -> None
+        """
+        Initializes the pool. Connections are opened lazily when they are needed for the first time
+        :param file_path: path to the saved file with database
+        :param size: maximum number of opened connections
+        """
+        self.file_path = file_path
+        self.size = size
+        self._connections = Queue()  # type: Queue  # idle connections
+        self._opened = 0  # number of connections opened so far
+        self._lock = Lock()
+
+    def _acquire(self):  # type: () -> sqlite3.Connection
+        """
+        Gets an idle connection from the pool, opening a new one if none is idle and the pool is not full yet.
+        Waits for the connection to be returned to the pool otherwise
+        :return: the connection. It must be returned by calling self._release after the usage
+        """
+        try:
+            return self._connections.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                connection = sqlite3.connect(self.file_path, check_same_thread=False)
+                connection.execute('PRAGMA query_only = ON')
+                return connection
+        return self._connections.get()
+
+    def _release(self, connection):  # type: (sqlite3.Connection) -> None
+        """
+        Returns the connection back into the pool
+        :param connection: connection obtained by self._acquire
+        :return: None
+        """
+        self._connections.put(connection)
+
+    def execute(self, command, data=()):  # type: (str, tuple) -> list
+        """
+        Executes the read-only command on database
+        :param command: SQL command to be executed
+        :param data: tuple of data that are safely entered into the SQL command to prevent SQL injection
+        :return: list of returned rows
+        """
+        connection = self._acquire()
+        try:
+            return list(connection.execute(command, data))
+        finally:
+            self._release(connection)
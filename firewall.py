@@ -0,0 +1,319 @@
+import ipaddress
+import logging
+import shlex
+import socket
+import subprocess
+import time
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+class BlockerDaemon:
+    """
+    Client of the blocker running as a long-running helper. The helper checks its requirements only once when started
+    and then takes the commands over a Unix socket, so blocking an IP does not execute any new process
+    """
+
+    def __init__(self, command_path, socket_path, timeout=10.0, batch_size=1000):
+        # type: (str, str, float, int) -> None
+        """
+        Initializes the client. The helper itself must be then started by using .start()
+        :param command_path: path to the blocker executable
+        :param socket_path: path to the Unix socket the helper listens on
+        :param timeout: how long in seconds to wait for the start of the helper and for its replies
+        :param batch_size: at most this many commands are sent before their replies are read
+        """
+        self.command_path = command_path
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self._process = None  # type: subprocess.Popen or None
+        self._socket = None  # type: socket.socket or None
+        self._replies = None  # file reading the replies from the socket
+        self._lock = Lock()
+
+    def start(self):  # type: () -> bool
+        """
+        Starts the helper and connects to it. The helper ends when this program closes its standard input
+        :return: True if the helper is ready, False if it could not be started
+        """
+        with self._lock:
+            return self._start()
+
+    def _start(self):  # type: () -> bool
+        """
+        Starts the helper and waits until it accepts the connection. The lock must be held by the caller
+        :return: True if the helper is ready, False if it could not be started
+        """
+        self._close()
+        try:
+            self._process = subprocess.Popen([self.command_path, 'serve', self.socket_path], stdin=subprocess.PIPE,
+                                             stdout=subprocess.DEVNULL)
+        except OSError:
+            return False
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline and self._process.poll() is None:
+            try:
+                self._connect()
+                return True
+            except OSError:
+                time.sleep(0.05)
+        self._close()
+        return False
+
+    def _connect(self):  # type: () -> None
+        """
+        Connects to the socket of the running helper
+        :return: None
+        """
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+        except OSError:
+            connection.close()
+            raise
+        self._socket = connection
+        self._replies = connection.makefile('rb')
+
+    def _disconnect(self):  # type: () -> None
+        """
+        Closes the connection to the helper
+        :return: None
+        """
+        if self._replies is not None:
+            self._replies.close()
+            self._replies = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _close(self):  # type: () -> None
+        """
+        Disconnects and stops the helper
+        :return: None
+        """
+        self._disconnect()
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+                self._process.wait(self.timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            self._process = None
+
+    def close(self):  # type: () -> None
+        """
+        Disconnects and stops the helper
+        :return: None
+        """
+        with self._lock:
+            self._close()
+
+    def request(self, commands):  # type: (List[Tuple[str, str]]) -> List[str]
+        """
+        Sends the commands to the helper. The commands are pipelined, a batch of them is sent before any reply is read
+        If the connection is broken, the helper is restarted and the commands are sent once more
+        :param commands: list of tuples (command, IP). Command is block, unblock or test
+        :return: replies in the order of the commands: ok, failed or invalid (yes or no for test)
+        :raise OSError: if the helper does not respond
+        """
+        with self._lock:
+            try:
+                return self._request(commands)
+            except OSError:
+                if not self._start():  # the block and unblock commands can be safely repeated
+                    raise
+                return self._request(commands)
+
+    def _request(self, commands):  # type: (List[Tuple[str, str]]) -> List[str]
+        """
+        Sends the commands to the helper. The lock must be held by the caller
+        :param commands: list of tuples (command, IP)
+        :return: replies in the order of the commands
+        :raise OSError: if the helper does not respond
+        """
+        if self._socket is None:
+            raise ConnectionError('not connected to the blocker')
+        replies = []  # type: List[str]
+        try:
+            for start in range(0, len(commands), self.batch_size):
+                batch = commands[start:start + self.batch_size]
+                # the helper rejects IPs with spaces, the new line would break the pairing of the replies instead
+                self._socket.sendall(''.join('%s %s\n' % (command, ip.replace('\n', ' '))
+                                             for command, ip in batch).encode('utf8'))
+                for _ in batch:
+                    reply = self._replies.readline()
+                    if not reply.endswith(b'\n'):
+                        raise ConnectionError('the blocker closed the connection')
+                    replies.append(reply.decode('utf8').strip())
+        except OSError:
+            self._disconnect()
+            raise
+        return replies
+
+
+class FirewallBackend(ABC):
+    """
+    Blocks the IPs in the firewall. The backends differ by the tool used to change the firewall
+    """
+
+    @abstractmethod
+    def init(self):  # type: () -> bool
+        """
+        Prepares the firewall for blocking and removes the IPs blocked before
+        :return: True if the firewall is ready, False otherwise
+        """
+        pass
+
+    @abstractmethod
+    def apply(self, block_ips, unblock_ips, timeouts=None):
+        # type: (Iterable[str], Iterable[str], Dict[str, float] or None) -> Tuple[Set[str], Set[str]]
+        """
+        Blocks and unblocks the IPs at once
+        :param block_ips: IPs to block
+        :param unblock_ips: IPs to unblock
+        :param timeouts: optional dictionary where key is the blocked IP and value is the time in seconds after which
+        the firewall unblocks it itself, if the backend supports it
+        :return: tuple (set of the blocked IPs, set of the unblocked IPs) without the IPs that failed
+        """
+        pass
+
+    def close(self):  # type: () -> None
+        """
+        Releases the resources held by the backend, the blocked IPs stay blocked
+        :return: None
+        """
+        pass
+
+
+class BlockerBackend(FirewallBackend):
+    """
+    Blocks the IPs by ipset and iptables through the setuid blocker executable. The blocker runs as a helper daemon if
+    the socket is given, otherwise it is executed for every IP
+    """
+
+    def __init__(self, command_path, socket_path=None, logger=None):
+        # type: (str, str or None, logging.Logger or None) -> None
+        """
+        Initializes the backend
+        :param command_path: path to the blocker executable
+        :param socket_path: path to the Unix socket of the helper daemon started by .init(), None disables the daemon
+        :param logger: logger used for the errors
+        """
+        self.command_path = command_path
+        self.logger = logger if logger is not None else logging.getLogger()
+        self.daemon = BlockerDaemon(command_path, socket_path) if socket_path is not None else None
+
+    def init(self):  # type: () -> bool
+        if self.daemon is not None and not self.daemon.start():
+            self.logger.warning('the blocker daemon could not be started, the blocker will be executed for every IP')
+            self.daemon = None
+        return subprocess.run([self.command_path, 'init']).returncode == 0
+
+    def apply(self, block_ips, unblock_ips, timeouts=None):
+        # type: (Iterable[str], Iterable[str], Dict[str, float] or None) -> Tuple[Set[str], Set[str]]
+        commands = [('unblock', ip) for ip in unblock_ips] + [('block', ip) for ip in block_ips]
+        done = None  # type: Set[Tuple[str, str]] or None
+        if self.daemon is not None:
+            try:
+                done = {command for command, reply in zip(commands, self.daemon.request(commands)) if reply == 'ok'}
+            except OSError as e:
+                self.logger.error('the blocker daemon does not respond (%s), the blocker will be executed for every '
+                                  'IP' % e)
+                self.daemon.close()
+                self.daemon = None
+        if done is None:
+            done = {(action, ip) for action, ip in commands
+                    if subprocess.run([self.command_path, action, ip]).returncode == 0}
+        return {ip for action, ip in done if action == 'block'}, {ip for action, ip in done if action == 'unblock'}
+
+    def close(self):  # type: () -> None
+        if self.daemon is not None:
+            self.daemon.close()
+
+
+class NftablesBackend(FirewallBackend):
+    """
+    Blocks the IPs by nftables. The IPs are elements of the named sets of its own table, one set for IPv4 and one for
+    IPv6. The sets accept whole networks and the elements can expire by their own timeouts. All changes of one call are
+    applied as one atomic transaction of nft -f, so either all of them are applied or none
+    """
+
+    def __init__(self, command='nft', table='simpleguardian', logger=None):
+        # type: (str, str, logging.Logger or None) -> None
+        """
+        Initializes the backend
+        :param command: command line executing nft, eg. "sudo -n nft". nft needs the CAP_NET_ADMIN capability
+        :param table: name of the table with the sets of the blocked IPs and the chain dropping them
+        :param logger: logger used for the errors
+        """
+        self.command = shlex.split(command)
+        self.table = table
+        self.logger = logger if logger is not None else logging.getLogger()
+
+    def run(self, script):  # type: (str) -> bool
+        """
+        Executes the nft commands as one transaction
+        :param script: the commands, one per line
+        :return: True if the transaction was applied, False if it was rolled back
+        """
+        try:
+            result = subprocess.run(self.command + ['-f', '-'], input=script.encode('utf8'),
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError as e:
+            self.logger.error('nft cannot be executed: %s' % e)
+            return False
+        if result.returncode != 0:
+            self.logger.error('nft failed: %s' % result.stderr.decode('utf8', 'replace').strip())
+        return result.returncode == 0
+
+    def init(self):  # type: () -> bool
+        table = 'inet %s' % self.table
+        return self.run('add table {0}\n'
+                        'add set {0} blocked4 {{ type ipv4_addr; flags interval, timeout; }}\n'
+                        'add set {0} blocked6 {{ type ipv6_addr; flags interval, timeout; }}\n'
+                        'add chain {0} input {{ type filter hook input priority -10; policy accept; }}\n'
+                        'flush chain {0} input\n'
+                        'add rule {0} input ip saddr @blocked4 drop\n'
+                        'add rule {0} input ip6 saddr @blocked6 drop\n'
+                        'flush set {0} blocked4\n'
+                        'flush set {0} blocked6\n'.format(table))
+
+    def element(self, ip):  # type: (str) -> Tuple[str, str] or None
+        """
+        Finds the set of the IP and formats it as its element
+        :param ip: IP or network in the CIDR notation
+        :return: tuple (name of the set, the element) or None if the IP is not valid
+        """
+        try:
+            network = ipaddress.ip_network(ip.strip().strip('[]'), strict=False)
+        except ValueError:
+            return None
+        return ('blocked4' if network.version == 4 else 'blocked6',
+                str(network.network_address) if network.num_addresses == 1 else str(network))
+
+    def apply(self, block_ips, unblock_ips, timeouts=None):
+        # type: (Iterable[str], Iterable[str], Dict[str, float] or None) -> Tuple[Set[str], Set[str]]
+        changes = []  # type: List[Tuple[str, str, str]]  # (action, IP, nft commands)
+        for ip in unblock_ips:
+            element = self.element(ip)
+            if element is None:
+                continue
+            # deleting a missing element would fail the whole transaction, so it is added first
+            changes.append(('unblock', ip, 'add element inet {0} {1} {{ {2} }}\n'
+                                           'delete element inet {0} {1} {{ {2} }}\n'.format(self.table, *element)))
+        for ip in block_ips:
+            element = self.element(ip)
+            if element is None:
+                continue
+            # IPs without their own timeout stay blocked until they are unblocked, eg. the IPs of the federation
+            timeout = timeouts.get(ip) if timeouts is not None else None
+            changes.append(('block', ip, 'add element inet {0} {1} {{ {2}{3} }}\n'.format(
+                self.table, *element, ' timeout %ds' % max(timeout, 1) if timeout is not None else '')))
+        if len(changes) > 0 and not self.run(''.join(commands for _, _, commands in changes)):
+            # the transaction was rolled back, the changes are applied one by one to find the failing ones
+            changes = [change for change in changes if self.run(change[2])]
+        return ({ip for action, ip, _ in changes if action == 'block'},
+                {ip for action, ip, _ in changes if action == 'unblock'})
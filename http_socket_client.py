@@ -30,6 +30,7 @@ class HSocket:
 
         self._last_message_time = time.time()  # time of last message we got from the server
         self._fetch_msg_max_time = 10.0  # maximum time between fetching new messages from the server
+        self.on_poll_finished = None  # optional function called with the duration of every poll in seconds
 
         if auto_connect:
             self.connect()
@@ -165,8 +166,11 @@ class HSocket:
         """
         try:
             while True:
+                poll_start = time.perf_counter()
                 request = requests.get(self.host + '/hsocket/', params=None if self.sid is None else {'sid': self.sid},
                                        timeout=10)
+                if self.on_poll_finished is not None:
+                    self.on_poll_finished(time.perf_counter() - poll_start)
                 if request.status_code not in [200, 404]:
                     self.disconnect(reconnect=True)
                     return
@@ -1,13 +1,34 @@
+import glob
+import gzip
+import ipaddress
 import json
+import multiprocessing
+import os
 import re
+import struct
+import subprocess
 import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from hashlib import md5
 from logging import Logger
-from os.path import getmtime, getsize
+from queue import Queue, Empty
 from tempfile import TemporaryFile
-from threading import Lock
-from typing import List
+from threading import Lock, Thread
+from typing import BinaryIO, Callable, Dict, Iterator, List, Set, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstd compressed rotated logs are skipped when the module is missing
+    zstandard = None
+
+try:
+    from systemd import journal as systemd_journal
+except ImportError:  # the journal is read by journalctl when the module is missing
+    systemd_journal = None
 
 
 class LogParser:
@@ -15,117 +36,339 @@ class LogParser:
     Class for parsing information about attacks from log files
     """
 
-    def __init__(self, file_log, rules, service_name=None, logger=None):  # type: (str, List[str], str, Logger) -> None
+    def __init__(self, file_log, rules, service_name=None, logger=None, backfill_workers=None,
+                 backfill_chunk_size=64 * 1024 * 1024, buffer_size=1024 * 1024, reorder_interval=10000,
+                 max_open_files=256, keep_variables=()):
+        # type: (str or LogSource, List[str], str, Logger, int, int, int, int or None, int, Tuple[str, ...]) -> None
         """
         Initialize the log parser
-        :param file_log: path to the file with logs
+        :param file_log: path to the file with logs, glob pattern or directory matching multiple log files or other
+        source of the log lines
         :param rules: list of string filters/rules
         :param service_name: optional name of the service. If not specified then found attacks are not assigned to any
         service
         :param logger: optional logger. If specified, LogParsers fires messages into him
+        :param backfill_workers: number of processes that parse the log file when it is read whole from the beginning.
+        If None, then the number of CPUs is used. If 1, then the log file is always parsed by the calling thread
+        :param backfill_chunk_size: size in bytes of one part of the log file parsed by one process. Files smaller
+        than two chunks are always parsed by the calling thread
+        :param buffer_size: size in bytes of the blocks in which is the log file read. Together with the longest line it
+        bounds the memory used for reading the file regardless of how much new content there is
+        :param reorder_interval: after how many read lines are the rules reordered by the number of their hits, so the
+        most hit rules are tested first. If None, then the rules are always tested in the given order
+        :param max_open_files: how many files matched by the glob pattern or directory are kept open between the scans
+        :param keep_variables: names of the variables kept with the attacks besides their time and user, eg. HOSTNAME
         """
-        self.file_log = file_log
-        self.rules = [rule if type(rule) == Rule else Rule(rule, service_name) for rule in rules]
+        if isinstance(file_log, LogSource):
+            self.source = file_log
+        elif is_log_pattern(file_log):
+            self.source = MultiFileSource(file_log, buffer_size, logger, FileHandlePool(max_open_files))
+        else:
+            self.source = FileSource(file_log, buffer_size, logger)
+        self.file_log = self.source.name
+        self.rules = [rule if type(rule) == Rule else compile_rule(rule, service_name, keep_variables)
+                      for rule in rules]
         self.logger = logger
+        self.backfill_workers = (os.cpu_count() or 1) if backfill_workers is None else backfill_workers
+        self.backfill_chunk_size = backfill_chunk_size
+        self.buffer_size = buffer_size
+        self.reorder_interval = reorder_interval
 
-        self._last_file_size = 0
-        self._last_file_modification_date = None
+        self._rule_order = list(self.rules)  # rules in the order in which they are tested
+        self._lines_at_reorder = 0  # value of self.lines_read when the rules were reordered last time
+        # pairs of indexes (earlier, later) of overlapping rules. Their order is kept, so the earlier one wins
+        self._overlapping_rules = {(i, j) for j, later in enumerate(self.rules) for i, earlier in
+                                   enumerate(self.rules[:j]) if earlier.overlaps(later)}
 
         self._attack_cache_file = TemporaryFile()  # here will all attacks stay cached
         self._attack_cache_file_lock = Lock()
+        self._cache_changed = False  # set when attacks were added into the cache outside of self.parse_attacks
+        self._backfilled_attacks = {}  # type: Dict[str, List[Attack]]  # attacks of the backfill not cached yet
+        self._backfill_chunks = []  # type: List[Tuple[str, int, int]]  # chunks left for self.backfill_chunks
 
-        # if this last bytes are same then we are sure the file was not modified
-        self._last_bytes = {'hash': None, 'len': 0}
+        self.lines_read = 0  # number of lines tested against the rules
+        self.rule_hits = {}  # type: Dict[Rule, int]  # rule: number of lines that matched the rule
+        self.banned_lines = 0  # number of matched lines dropped because their IP was already banned
+        self._counters_lock = Lock()  # the counters above are updated also by the backfill running in another thread
+        self.detector = None  # type: OffenderDetector or None  # finds the offenders while the lines are parsed
 
         self.force_rescan()
 
-    def parse_attacks(self, max_age=None, skip_scanning=False):  # type: (float, bool) -> dict
+    def parse_attacks(self, max_age=None, skip_scanning=False, banned_ips=None, new_attacks=None, defer_backfill=False):
+        # type: (float, bool, Set[str] or None, Dict[str, List[Attack]] or None, bool) -> dict
         """
         Parses the attacks from log file and returns them
-        :param max_age: optional, in seconds. If attack is older as this then it is ignored
+        :param max_age: optional, in seconds. If attack is older as this then it is ignored and also dropped from the
+        attacks cached from the previous scans
         :param skip_scanning: if set to true then the read content is not analyzed for attacks
-        :return: dictionary. Key is the IP that attacked and value is list of dictionaries with data about every attack
+        :param banned_ips: optional set of already banned IPs. Lines of these IPs are only counted in
+        self.banned_lines, no attacks are created from them
+        :param new_attacks: optional dictionary. Only the attacks that were not returned by any previous call are put
+        here, eg. so they can be saved without saving the older ones again
+        :param defer_backfill: if set to true, the chunks of a big source read from the beginning are not parsed by
+        this call but left for self.backfill_chunks, eg. run by another thread, so only the rest of the source is read
+        :return: dictionary. Key is the IP that attacked and value is list of its attacks
         """
         if self.logger is not None:
             self.logger.debug('parsing attacks for %s' % self.file_log)
 
         attacks = {}
 
-        curr_file_size = getsize(self.file_log)
-        curr_file_modification_time = getmtime(self.file_log)
-
-        if self._last_file_size == curr_file_size and curr_file_modification_time == self._last_file_modification_date:
+        if not self.source.poll():
             if self.logger is not None:
                 self.logger.debug('nothing changed, nothing new to parse')
-            # it seems that the files has not changed so skip analyzing it
-            return attacks
+            # it seems that the source has not changed so skip analyzing it
+            return attacks if not self._cache_changed else self._cache_attacks(attacks, max_age, new_attacks)
 
-        continue_in_scanning = True  # when set to True, only new content in file is analyzed
+        if self.source.rescanned:
+            # the source is read again from the beginning, so the cached attacks would be duplicated
+            self.source.rescanned = False
+            self._clear_cache()
 
-        if self._last_file_size > curr_file_size:
-            # when the current file is smaller, something has happened to it. We will rescan it to be sure
-            if self.logger is not None:
-                self.logger.debug('file went smaller since las scan, rescan it')
-            continue_in_scanning = False
-            self.force_rescan()
+        if not skip_scanning and max_age is not None:
+            # on a cold start only the tail of the source that can contain attacks younger than max_age is read
+            skipped_size = self.source.skip_older(max_age)
+            if skipped_size > 0 and self.logger is not None:
+                self.logger.debug('skipped %d bytes of %s older than %d seconds' % (skipped_size, self.file_log,
+                                                                                   max_age))
 
-        if self._last_file_size == curr_file_size and self._last_file_modification_date != curr_file_modification_time:
-            # the file has the same size but was still modified, we better rescan it
-            if self.logger is not None:
-                self.logger.debug('file is the same size but it was modified,rescan it')
-            continue_in_scanning = False
-            self.force_rescan()
-
-        with open(self.file_log, 'r') as f:
-            if continue_in_scanning and self._last_bytes['hash'] is not None:
-                # check last few bytes if they are same
-                f.seek(self._last_file_size - self._last_bytes['len'] - 5)
-                if md5(f.read(self._last_bytes['len']).encode('utf8')).hexdigest() != self._last_bytes['hash']:
-                    # nope, last few bytes differ, something seems really odd about this file. Better rescan it
-                    if self.logger is not None:
-                        self.logger.debug('last few scanned bytes differ, rescan it')
-                    self.force_rescan()
-
-            f.seek(self._last_file_size)  # skip all already analyzed content
-            new_content = f.read()
-
-        # save last ten bytes so we can know if the file is still the same during new analyze
-        content_end = new_content[-256:-5]
-        self._last_bytes['hash'] = md5(content_end.encode('utf8')).hexdigest()
-        self._last_bytes['len'] = len(content_end)
+        if not skip_scanning and self.backfill_workers > 1:
+            chunks = self.source.take_chunks(self.backfill_chunk_size)
+            if len(chunks) > 0 and defer_backfill:
+                if self.logger is not None:
+                    self.logger.debug('%d chunks of %s left for the backfill' % (len(chunks), self.file_log))
+                self._attack_cache_file_lock.acquire()
+                self._backfill_chunks = chunks
+                self._attack_cache_file_lock.release()
+            elif len(chunks) > 0:
+                # the big file is read from the beginning, parse most of it in parallel
+                if self.logger is not None:
+                    self.logger.debug('backfilling %s in %d processes' % (self.file_log, self.backfill_workers))
+                self._backfill(chunks, attacks, max_age, banned_ips)
 
-        log_lines = new_content.splitlines()
-        del new_content, content_end
+        if self.reorder_interval is not None and self.lines_read - self._lines_at_reorder >= self.reorder_interval:
+            self.reorder_rules()
 
-        if not skip_scanning:
-            for log_line in log_lines:
-                if self.logger is not None:
-                    self.logger.debug('log line "%s"' % log_line.replace('\n', '\\n'))
-                for rule in self.rules:
-                    variables = rule.get_variables(log_line)
-                    if variables is not None:
-                        if max_age is not None and time.time() - max_age > variables['TIMESTAMP']:
-                            break
-                        attacker_ip = variables['IP']
-                        del variables['IP']
-                        item = attacks.get(attacker_ip, [])
-                        item.append(variables)
-                        attacks[attacker_ip] = item
-                        break
+        lines_read = 0
+        rule_hits = {}  # type: Dict[Rule, int]
+        rule_order = self._rule_order
+        banned_hits = {}  # type: Dict[str, int]
+        on_attack = self.detector.add if self.detector is not None else None
+        for log_line in self.source.read_lines(skip_scanning):
+            if self.logger is not None:
+                self.logger.debug('log line "%s"' % log_line)
+            lines_read += 1
+            rule = parse_log_line(log_line, rule_order, attacks, max_age, banned_ips, banned_hits, on_attack)
+            if rule is not None:
+                rule_hits[rule] = rule_hits.get(rule, 0) + 1
+        self._count_lines(lines_read, rule_hits, sum(banned_hits.values()))
+        if self.detector is not None:
+            self.detector.prune()
 
-        self._last_file_modification_date = curr_file_modification_time
-        self._last_file_size = curr_file_size
+        return self._cache_attacks(attacks, max_age, new_attacks)
 
+    def _cache_attacks(self, attacks, max_age=None, new_attacks=None):
+        # type: (Dict[str, List[Attack]], float or None, Dict[str, List[Attack]] or None) -> Dict[str, List[Attack]]
+        """
+        Adds the new attacks and the attacks loaded by the backfill to the attacks cached from the previous scans.
+        Every time is unique identification key of the attack, if two attacks were made at the same timestamp, then
+        a second is added to the new one. The cache holds the attacks as lists, so every call returns new Attack
+        objects that can be modified by the caller
+        :param attacks: dictionary. Key is the IP that attacked and value is list of its new attacks
+        :param max_age: optional, in seconds. Cached attacks older as this are dropped
+        :param new_attacks: optional dictionary. The attacks added into the cache by this call are put here too
+        :return: dictionary with all cached attacks including the new ones
+        """
         self._attack_cache_file_lock.acquire()
         self._attack_cache_file.seek(0)
-        attacks.update(json.loads(self._attack_cache_file.read().decode('utf8')))
+        cached_attacks = json.loads(self._attack_cache_file.read().decode('utf8'))
+        if max_age is not None:
+            min_timestamp = time.time() - max_age
+            cached_attacks = {attacker_ip: [attack for attack in attacker_attacks if attack[0] >= min_timestamp]
+                              for attacker_ip, attacker_attacks in cached_attacks.items()}
+            cached_attacks = {attacker_ip: attacker_attacks for attacker_ip, attacker_attacks in cached_attacks.items()
+                              if len(attacker_attacks) > 0}
+        known_timestamps = {attack[0] for attacker_attacks in cached_attacks.values() for attack in attacker_attacks}
+        # timestamp: where to look for a free timestamp for the next attack made at it, so the many attacks made at the
+        # same second do not test all the timestamps taken by the previous ones again
+        next_timestamps = {}  # type: Dict[float, float]
+        for added_attacks in (self._backfilled_attacks, attacks):
+            for attacker_ip, attacker_attacks in added_attacks.items():
+                cached_attacker_attacks = cached_attacks.setdefault(attacker_ip, [])
+                for attack in attacker_attacks:
+                    timestamp = attack.timestamp
+                    attack.timestamp = next_timestamps.get(timestamp, timestamp)
+                    while attack.timestamp in known_timestamps:
+                        attack.timestamp += 1
+                    next_timestamps[timestamp] = attack.timestamp + 1
+                    known_timestamps.add(attack.timestamp)
+                    cached_attacker_attacks.append(attack.as_list())
+                if new_attacks is not None:
+                    new_attacks.setdefault(attacker_ip, []).extend(attacker_attacks)
+        self._backfilled_attacks = {}
+        self._attack_cache_file.seek(0)
+        self._attack_cache_file.truncate(0)
+        self._attack_cache_file.write(json.dumps(cached_attacks, separators=(',', ':')).encode('utf8'))
+        self._attack_cache_file.flush()
+        self._cache_changed = False
+        self._attack_cache_file_lock.release()
+        return {attacker_ip: [Attack.from_list(attack) for attack in attacker_attacks]
+                for attacker_ip, attacker_attacks in cached_attacks.items()}
+
+    def _clear_cache(self):  # type: () -> None
+        """
+        Removes all cached attacks, including the backfilled attacks not cached yet and the chunks left for the backfill
+        :return: None
+        """
+        self._attack_cache_file_lock.acquire()
+        self._backfilled_attacks = {}
+        self._backfill_chunks = []
         self._attack_cache_file.seek(0)
         self._attack_cache_file.truncate(0)
-        self._attack_cache_file.write(json.dumps(attacks).encode('utf8'))
+        self._attack_cache_file.write(json.dumps({}).encode('utf8'))
         self._attack_cache_file.flush()
         self._attack_cache_file_lock.release()
 
-        return attacks
+    def backfill_history(self, max_age, banned_ips=None, running=None):
+        # type: (float, Set[str] or None, Callable[[], bool]) -> None
+        """
+        Parses the attacks from the history of the source, like the rotated log files (also gzip or zstd compressed)
+        and the content of the followed file that was skipped without scanning. Found attacks are added into the cache
+        by the next self.parse_attacks, which returns them also as new attacks. Safe to be run in another thread
+        :param max_age: in seconds. Attacks older as this are ignored and rotated files last modified before are not read
+        :param banned_ips: optional set of already banned IPs whose lines are only counted
+        :param running: optional function. When it returns False, the backfill is stopped
+        :return: None
+        """
+        attacks = {}
+        lines_read = 0
+        rule_hits = {}  # type: Dict[Rule, int]
+        rule_order = self._rule_order
+        banned_hits = {}  # type: Dict[str, int]
+        for log_line in self.source.history(max_age):
+            rule = parse_log_line(log_line, rule_order, attacks, max_age, banned_ips, banned_hits)
+            if rule is not None:
+                rule_hits[rule] = rule_hits.get(rule, 0) + 1
+            lines_read += 1
+            if lines_read % 10000 == 0 and running is not None and not running():
+                break
+        self._count_lines(lines_read, rule_hits, sum(banned_hits.values()))
+        if running is not None and not running():
+            return
+        if len(attacks) > 0:
+            self._attack_cache_file_lock.acquire()
+            for attacker_ip, attacker_attacks in attacks.items():
+                self._backfilled_attacks.setdefault(attacker_ip, []).extend(attacker_attacks)
+            self._cache_changed = True  # let the next scan return the cache even if the source did not change
+            self._attack_cache_file_lock.release()
+
+    def backfill_chunks(self, max_age=None, banned_ips=None):  # type: (float, Set[str] or None) -> None
+        """
+        Parses the chunks of the source left by self.parse_attacks called with defer_backfill in a pool of processes.
+        Found attacks are added into the cache by the next self.parse_attacks, which returns them also as new attacks.
+        Safe to be run in another thread
+        :param max_age: optional, in seconds. If attack is older as this then it is ignored
+        :param banned_ips: optional set of already banned IPs whose lines are only counted
+        :return: None
+        """
+        chunks = self._backfill_chunks
+        if len(chunks) == 0:
+            return
+        if self.logger is not None:
+            self.logger.debug('backfilling %s in %d processes' % (self.file_log, self.backfill_workers))
+        attacks = {}
+        self._backfill(chunks, attacks, max_age, banned_ips)
+        self._attack_cache_file_lock.acquire()
+        if chunks is self._backfill_chunks:  # the cache was not cleared meanwhile
+            for attacker_ip, attacker_attacks in attacks.items():
+                self._backfilled_attacks.setdefault(attacker_ip, []).extend(attacker_attacks)
+            self._backfill_chunks = []
+            self._cache_changed = True  # let the next scan return the cache even if the source did not change
+        self._attack_cache_file_lock.release()
+
+    def watch_offenders(self, min_attack_attempts, attack_attempts_time, callback):
+        # type: (int, int, Callable[[str], None]) -> None
+        """
+        Lets the parser find the habitual offenders already while the lines are parsed by self.parse_attacks, so they
+        can be blocked without waiting for the rest of the new lines. The attacks seen so far are kept when called
+        again with other limits
+        :param min_attack_attempts: minimum allowed number of attacks in time range to be reported
+        :param attack_attempts_time: the time range in which all of the attacks must have occurred in seconds
+        :param callback: function called with the IP of the offender as soon as it reaches the limit
+        :return: None
+        """
+        if self.detector is None:
+            self.detector = OffenderDetector(min_attack_attempts, attack_attempts_time, callback)
+        else:
+            self.detector.set_limits(min_attack_attempts, attack_attempts_time)
+            self.detector.callback = callback
+
+    def reorder_rules(self):  # type: () -> None
+        """
+        Orders the rules by the number of their hits, so the most hit rules are tested first. Overlapping rules keep
+        their order from the profile, so a line that fits both is still parsed by the one listed first
+        :return: None
+        """
+        with self._counters_lock:
+            rule_hits = dict(self.rule_hits)
+            lines_read = self.lines_read
+        remaining = list(range(len(self.rules)))
+        rule_order = []  # type: List[Rule]
+        while len(remaining) > 0:
+            # only rules that do not have to wait for some earlier overlapping rule can be placed now
+            available = [j for j in remaining if not any((i, j) in self._overlapping_rules for i in remaining if i < j)]
+            best = max(available, key=lambda j: (rule_hits.get(self.rules[j], 0), -j))
+            rule_order.append(self.rules[best])
+            remaining.remove(best)
+        if rule_order != self._rule_order and self.logger is not None:
+            self.logger.debug('rules of %s reordered by their hits' % self.file_log)
+        self._rule_order = rule_order
+        self._lines_at_reorder = lines_read
+
+    def close(self):  # type: () -> None
+        """
+        Closes the source of the log lines. The parser can be still used, the source will be opened again by the next
+        scan
+        :return: None
+        """
+        self.source.close()
+
+    def _backfill(self, chunks, attacks, max_age=None, banned_ips=None):
+        # type: (List[Tuple[str, int, int]], dict, float, Set[str] or None) -> None
+        """
+        Parses the chunks of the log file in a pool of processes. Every chunk is parsed by one process
+        :param chunks: list of tuples (path to the file, start offset, end offset). Chunks are aligned on line ends
+        :param attacks: dictionary. Key is the IP that attacked and value is list of dictionaries with data about every
+        attack. Found attacks are appended here
+        :param max_age: optional, in seconds. If attack is older as this then it is ignored
+        :param banned_ips: optional set of already banned IPs whose lines are only counted
+        :return: None
+        """
+        with ProcessPoolExecutor(max_workers=min(self.backfill_workers, len(chunks)),
+                                 mp_context=get_backfill_context()) as executor:
+            for chunk_attacks, _, lines_read, chunk_rule_hits, banned_lines in executor.map(
+                    parse_log_chunk, [chunk[0] for chunk in chunks], [chunk[1:] for chunk in chunks],
+                    [self.rules] * len(chunks), [max_age] * len(chunks), [self.buffer_size] * len(chunks),
+                    [banned_ips] * len(chunks)):
+                # the processes count the hits by the index of the rule, they got only copies of the rules
+                self._count_lines(lines_read, {rule: hits for rule, hits in zip(self.rules, chunk_rule_hits)
+                                               if hits > 0}, banned_lines)
+                for attacker_ip, attacker_attacks in chunk_attacks.items():
+                    attacks.setdefault(attacker_ip, []).extend(attacker_attacks)
+
+    def _count_lines(self, lines_read, rule_hits, banned_lines):  # type: (int, Dict[Rule, int], int) -> None
+        """
+        Adds the numbers of the lines parsed by one call to the counters of the parser
+        :param lines_read: number of lines tested against the rules
+        :param rule_hits: dictionary. Key is the rule and value is the number of lines that matched it
+        :param banned_lines: number of matched lines dropped because their IP was already banned
+        :return: None
+        """
+        with self._counters_lock:
+            self.lines_read += lines_read
+            self.banned_lines += banned_lines
+            for rule, hits in rule_hits.items():
+                self.rule_hits[rule] = self.rule_hits.get(rule, 0) + hits
 
     def get_habitual_offenders(self, min_attack_attempts, attack_attempts_time, max_age=None, attacks=None,
                                first_load=False):
@@ -138,7 +381,7 @@ class LogParser:
         :param attacks: optional. If None, then the value of self.parse_attacks(max_age) is used
         :param first_load: If true, then the log file is read only, not scanned for attacks
         :return: dictionary. Key is the IP that attacked more or equal than min_attack_attempts times and
-        value is list of dictionaries with data about every attack in specified time range
+        value is list of its attacks
         """
         attacks = self.parse_attacks(max_age, first_load) if attacks is None else attacks
         habitual_offenders = {}
@@ -147,7 +390,7 @@ class LogParser:
             for attack in attack_list:
                 attacks_in_time_range = []
                 for attack2 in attack_list:
-                    attack_time_delta = attack2['TIMESTAMP'] - attack['TIMESTAMP']
+                    attack_time_delta = attack2.timestamp - attack.timestamp
                     if 0 <= attack_time_delta <= attack_attempts_time:
                         attacks_in_time_range.append(attack2)
                         if len(attacks_in_time_range) > min_attack_attempts:
@@ -159,17 +402,1035 @@ class LogParser:
 
     def force_rescan(self):  # type: () -> None
         """
-        Resets progress info about log file, forcing program to perform the next scan from the beginning
+        Resets progress info about the source and forgets all cached attacks, forcing program to perform the next scan
+        from the beginning
+        :return: None
+        """
+        self.source.rewind()
+        self._clear_cache()
+
+
+class OffenderDetector:
+    """
+    Finds the habitual offenders one attack at a time. Only the times of the last few attacks of every IP are kept,
+    so the attacks are expected to come in the order in which they were logged
+    """
+
+    def __init__(self, min_attack_attempts, attack_attempts_time, callback):
+        # type: (int, int, Callable[[str], None]) -> None
+        """
+        Initializes the detector
+        :param min_attack_attempts: minimum allowed number of attacks in time range to be reported
+        :param attack_attempts_time: the time range in which all of the attacks must have occurred in seconds
+        :param callback: function called with the IP of the offender as soon as it reaches the limit
+        """
+        self.min_attack_attempts = min_attack_attempts
+        self.attack_attempts_time = attack_attempts_time
+        self.callback = callback
+        self._recent_attacks = {}  # type: Dict[str, deque]  # IP: times of its last min_attack_attempts attacks
+        self._reported = set()  # type: Set[str]  # offenders already passed to the callback
+
+    def set_limits(self, min_attack_attempts, attack_attempts_time):  # type: (int, int) -> None
+        """
+        Changes the limits. The times of the attacks seen so far are kept if the number of attacks did not change
+        :param min_attack_attempts: minimum allowed number of attacks in time range to be reported
+        :param attack_attempts_time: the time range in which all of the attacks must have occurred in seconds
+        :return: None
+        """
+        if min_attack_attempts != self.min_attack_attempts:
+            self._recent_attacks = {}
+        self.min_attack_attempts = min_attack_attempts
+        self.attack_attempts_time = attack_attempts_time
+
+    def add(self, ip, attack):  # type: (str, Attack) -> None
+        """
+        Counts the attack and calls the callback if its IP has just become a habitual offender
+        :param ip: IP of the attacker
+        :param attack: the attack
+        :return: None
+        """
+        if ip in self._reported or ip == 'NO VALID IP FOUND':
+            return
+        times = self._recent_attacks.get(ip)
+        if times is None:
+            times = self._recent_attacks[ip] = deque(maxlen=self.min_attack_attempts)
+        times.append(attack.timestamp)
+        if len(times) == self.min_attack_attempts and 0 <= times[-1] - times[0] <= self.attack_attempts_time:
+            self._reported.add(ip)
+            del self._recent_attacks[ip]
+            self.callback(ip)
+
+    def prune(self):  # type: () -> None
+        """
+        Forgets the IPs whose last attack is out of the time range and the reported offenders, so they can be reported
+        again if they are not blocked
+        :return: None
+        """
+        min_time = time.time() - self.attack_attempts_time
+        self._recent_attacks = {ip: times for ip, times in self._recent_attacks.items() if times[-1] >= min_time}
+        self._reported = set()
+
+
+class LogSource(ABC):
+    """
+    Source of the log lines read by the LogParser
+    """
+
+    def __init__(self, name):  # type: (str) -> None
+        """
+        Initializes the source
+        :param name: human readable name of the source used in logs
+        """
+        self.name = name
+        self.rescanned = False  # set when the source starts again from the beginning and older lines must be forgotten
+        self.bytes_read = 0  # number of bytes of the lines read from this source
+
+    @abstractmethod
+    def poll(self):  # type: () -> bool
+        """
+        Checks if there are new lines in the source since the last read and prepares them for reading
+        :return: True if there may be new lines, False if the source did not change
+        """
+        pass
+
+    @abstractmethod
+    def read_lines(self, skip_scanning=False):  # type: (bool) -> Iterator[str]
+        """
+        Reads the lines prepared by the last self.poll. The progress is moved after the read lines
+        :param skip_scanning: if set to true then the lines are just skipped and not returned
+        :return: generator of the new lines
+        """
+        pass
+
+    def take_chunks(self, chunk_size):  # type: (int) -> List[Tuple[str, int, int]]
+        """
+        Takes the prepared content that can be parsed by other processes in chunks and moves the progress after it
+        :param chunk_size: size of one chunk in bytes
+        :return: list of tuples (path to the file, start offset, end offset). Empty if the content can be read only by
+        self.read_lines
+        """
+        return []
+
+    def skip_older(self, max_age):  # type: (float) -> int
+        """
+        Moves the progress of the source that has not been read yet after the lines older than max_age, so they are
+        not read at all
+        :param max_age: in seconds
+        :return: number of skipped bytes
+        """
+        return 0
+
+    def history(self, max_age):  # type: (float) -> Iterator[str]
+        """
+        Reads the lines written before this source was read for the first time
+        :param max_age: in seconds. Parts of history older as this may be left out
+        :return: generator of the old lines
+        """
+        return iter(())
+
+    def rewind(self):  # type: () -> None
+        """
+        Resets the progress, so the next read starts from the beginning of the source if possible
+        :return: None
+        """
+        pass
+
+    def close(self):  # type: () -> None
+        """
+        Releases all resources held by the source. It will be opened again by the next self.poll
         :return: None
         """
+        pass
+
+
+class FileSource(LogSource):
+    """
+    Plain text log file followed across rotations: when the file at the path is replaced by a new one, the rest of the
+    rotated file is read first and then the new file is read from its beginning
+    """
+    MAX_UNTIMED_LINES = 1000  # self.skip_older gives up after so many lines in a row without a parseable time
+
+    def __init__(self, file_log, buffer_size=1024 * 1024, logger=None, handle_pool=None):
+        # type: (str, int, Logger, FileHandlePool or None) -> None
+        """
+        Initializes the source
+        :param file_log: path to the file with logs
+        :param buffer_size: size in bytes of the blocks in which is the log file read
+        :param logger: optional logger. If specified, the source fires messages into him
+        :param handle_pool: optional pool that bounds the number of open files. If None, the file is kept open
+        """
+        LogSource.__init__(self, file_log)
+        self.file_log = file_log
+        self.buffer_size = buffer_size
+        self.logger = logger
+        self.handle_pool = handle_pool
+
         self._last_file_size = 0
         self._last_file_modification_date = None
-        self._attack_cache_file_lock.acquire()
-        self._attack_cache_file.seek(0)
-        self._attack_cache_file.truncate(0)
-        self._attack_cache_file.write(json.dumps({}).encode('utf8'))
-        self._attack_cache_file.flush()
-        self._attack_cache_file_lock.release()
+
+        self._file = None  # type: BinaryIO or None  # followed log file, kept open so it can be read after rotation
+        self._file_id = None  # type: (int, int) or None  # device and inode of the followed log file
+        self._skipped_size = 0  # number of bytes from the beginning of the followed file skipped without scanning
+
+        # if this last bytes before the already analyzed content ends are same then we are sure the file was not modified
+        self._last_bytes = {'hash': None, 'len': 0}
+
+        self._rotated_file = None  # type: (BinaryIO, int) or None  # rotated file and its analyzed size, read next
+        self._polled_stat = None  # type: os.stat_result or None  # stat of the followed file from the last poll
+
+    def poll(self):  # type: () -> bool
+        try:
+            curr_file_stat = os.stat(self.file_log)
+        except FileNotFoundError:
+            curr_file_stat = None
+
+        if self._file is not None and (curr_file_stat is None or
+                                       (curr_file_stat.st_dev, curr_file_stat.st_ino) != self._file_id):
+            # the file was rotated, finish reading the rotated file from the last offset and continue with the new one
+            if self.logger is not None:
+                self.logger.debug('file was rotated, reading rest of the rotated file')
+            if self._rotated_file is not None:
+                self._rotated_file[0].close()
+            self._rotated_file = (self._file, self._last_file_size)
+            self._file = None
+            self._file_id = None
+            self.rewind()
+
+        if curr_file_stat is None:
+            self._polled_stat = None
+            if self._rotated_file is None:
+                raise FileNotFoundError('log file %s does not exist' % self.file_log)
+            return True
+
+        if self._file is None:
+            self._file = open(self.file_log, 'rb')
+            curr_file_stat = os.fstat(self._file.fileno())  # the path could have been replaced meanwhile
+            file_id = (curr_file_stat.st_dev, curr_file_stat.st_ino)
+            if self._file_id is not None and file_id != self._file_id:
+                # the file was replaced while its handle was released, the rest of the old file cannot be read anymore
+                if self.logger is not None:
+                    self.logger.debug('file was rotated while closed, reading the new one from the beginning')
+                self.rewind()
+            self._file_id = file_id
+        if self.handle_pool is not None:
+            self.handle_pool.use(self)
+        self._polled_stat = curr_file_stat
+        curr_file_size = curr_file_stat.st_size
+
+        if self._last_file_size == curr_file_size and \
+                curr_file_stat.st_mtime == self._last_file_modification_date:
+            return self._rotated_file is not None
+
+        if self._last_file_size > curr_file_size:
+            # the file was truncated in place (eg. logrotate's copytruncate), new content starts at its beginning
+            if self.logger is not None:
+                self.logger.debug('file went smaller since last scan, reading it from the beginning')
+            self.rewind()
+
+        if self._last_bytes['hash'] is not None:
+            # check last few bytes if they are same
+            self._file.seek(self._last_file_size - self._last_bytes['len'])
+            if md5(self._file.read(self._last_bytes['len'])).hexdigest() != self._last_bytes['hash']:
+                # nope, last few bytes differ, something seems really odd about this file. Better rescan it
+                if self.logger is not None:
+                    self.logger.debug('last few scanned bytes differ, rescan it')
+                self.rewind()
+                self.rescanned = True
+
+        return True
+
+    def read_lines(self, skip_scanning=False):  # type: (bool) -> Iterator[str]
+        if self._rotated_file is not None:
+            rotated_file, analyzed_size = self._rotated_file
+            if not skip_scanning:
+                rotated_file.seek(analyzed_size)
+                rotated_size = analyzed_size
+                for log_line, rotated_size in read_log_lines(rotated_file, None, self.buffer_size):
+                    yield log_line
+                self.bytes_read += rotated_size - analyzed_size
+            rotated_file.close()
+            self._rotated_file = None
+
+        if self._polled_stat is None:
+            return
+        file_size = self._polled_stat.st_size
+
+        if skip_scanning:
+            # the content is not analyzed, so just skip it
+            if self._last_file_size == 0:
+                self._skipped_size = file_size
+            analyzed_size = file_size
+        else:
+            self._file.seek(self._last_file_size)  # skip all already analyzed content
+            analyzed_size = self._last_file_size
+            # only complete lines are analyzed, unterminated last line is left for the next scan
+            for log_line, analyzed_size in read_log_lines(self._file, file_size, self.buffer_size):
+                yield log_line
+            self.bytes_read += analyzed_size - self._last_file_size
+
+        self._remember_last_bytes(analyzed_size)
+        self._last_file_size = analyzed_size
+        self._last_file_modification_date = self._polled_stat.st_mtime
+
+    def take_chunks(self, chunk_size):  # type: (int) -> List[Tuple[str, int, int]]
+        if self._rotated_file is not None or self._polled_stat is None or self._last_file_size != 0 or \
+                self._polled_stat.st_size < 2 * chunk_size:
+            # only the whole big followed file can be parsed in chunks, the processes open it by its path
+            return []
+        chunks = []  # type: List[Tuple[str, int, int]]
+        chunk_start = 0
+        while chunk_start + chunk_size < self._polled_stat.st_size:
+            self._file.seek(chunk_start + chunk_size)
+            # move the end of the chunk to the end of the line, unterminated last line is left for self.read_lines
+            if not self._file.readline().endswith(b'\n') or self._file.tell() > self._polled_stat.st_size:
+                break
+            chunk_end = self._file.tell()
+            chunks.append((self.file_log, chunk_start, chunk_end))
+            chunk_start = chunk_end
+        # the rest of the file is read by self.read_lines
+        self._last_file_size = chunk_start
+        self.bytes_read += chunk_start
+        return chunks
+
+    def skip_older(self, max_age):  # type: (float) -> int
+        if self._rotated_file is not None or self._polled_stat is None or self._last_file_size != 0 or \
+                self._polled_stat.st_size <= self.buffer_size:
+            # only the followed file read from its beginning is worth to be skipped, small files are read whole
+            return 0
+        min_time = time.time() - max_age
+        start = 0
+        untimed_lines = 0
+        # the lines are read from the end until the first one dated before min_time, the following lines are scanned
+        for log_line, line_end in read_log_lines_reversed(self._file, self._polled_stat.st_size, self.buffer_size):
+            line_time = parse_log_time(log_line)
+            if line_time is None:
+                untimed_lines += 1
+                if untimed_lines >= self.MAX_UNTIMED_LINES:
+                    break  # the time of this log cannot be parsed, it would be read backwards whole for nothing
+                continue
+            untimed_lines = 0
+            if line_time < min_time:
+                start = line_end
+                break
+        self._last_file_size = start
+        return start
+
+    def history(self, max_age):  # type: (float) -> Iterator[str]
+        min_modification_time = time.time() - max_age
+        sources = [(file_path, None) for file_path in find_rotated_logs(self.file_log)
+                   if os.path.getmtime(file_path) >= min_modification_time]
+        if self._skipped_size > 0:
+            sources.append((self.file_log, self._skipped_size))
+            self._skipped_size = 0
+
+        for file_path, file_size in sources:
+            if self.logger is not None:
+                self.logger.debug('reading history from %s' % file_path)
+            try:
+                with open_log_file(file_path) as f:
+                    for log_line, _ in read_log_lines(f, file_size, self.buffer_size):
+                        yield log_line
+            except (OSError, EOFError, ValueError) as e:
+                if self.logger is not None:
+                    self.logger.warning('cannot read history from %s: %s' % (file_path, e))
+
+    def rewind(self):  # type: () -> None
+        self._last_file_size = 0
+        self._last_file_modification_date = None
+        self._last_bytes = {'hash': None, 'len': 0}
+
+    def close(self):  # type: () -> None
+        if self._file is not None:
+            self._file.close()
+        if self._rotated_file is not None:
+            self._rotated_file[0].close()
+        if self.handle_pool is not None:
+            self.handle_pool.forget(self)
+        self._file = None
+        self._file_id = None
+        self._rotated_file = None
+        self.rewind()
+
+    def changed(self):  # type: () -> bool
+        """
+        Cheaply checks by the stat of the path if the file may have changed since the last read, without opening it
+        :return: True if the file should be polled, False if it has surely not changed
+        """
+        if self._rotated_file is not None or self._file_id is None:
+            return True
+        try:
+            curr_file_stat = os.stat(self.file_log)
+        except FileNotFoundError:
+            return True
+        return (curr_file_stat.st_dev, curr_file_stat.st_ino) != self._file_id or \
+            curr_file_stat.st_size != self._last_file_size or \
+            curr_file_stat.st_mtime != self._last_file_modification_date
+
+    def release_handle(self):  # type: () -> None
+        """
+        Closes the followed file but keeps the progress, so the file is reopened and read from the same offset by the
+        next self.poll
+        :return: None
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _remember_last_bytes(self, analyzed_size):  # type: (int) -> None
+        """
+        Saves the hash of last few analyzed bytes so we can know if the file is still the same during new analyze
+        :param analyzed_size: number of bytes from the beginning of the file that were already analyzed
+        :return: None
+        """
+        self._file.seek(max(0, analyzed_size - 256))
+        content_end = self._file.read(analyzed_size - self._file.tell())
+        self._last_bytes['hash'] = md5(content_end).hexdigest()
+        self._last_bytes['len'] = len(content_end)
+
+
+class MultiFileSource(LogSource):
+    """
+    All log files matched by a glob pattern or found in a directory, eg. logs of many containers. Every file is followed
+    by its own FileSource, new files are picked up when they appear and removed files are forgotten. Rotated versions
+    of the files, like auth.log.1 or auth.log.2.gz, are left out
+    """
+
+    def __init__(self, pattern, buffer_size=1024 * 1024, logger=None, handle_pool=None):
+        # type: (str, int, Logger, FileHandlePool or None) -> None
+        """
+        Initializes the source
+        :param pattern: glob pattern, eg. /var/log/containers/*.log, or path to the directory with log files
+        :param buffer_size: size in bytes of the blocks in which are the log files read
+        :param logger: optional logger. If specified, the source fires messages into him
+        :param handle_pool: pool that bounds the number of open files. If None, at most 256 files are kept open
+        """
+        LogSource.__init__(self, pattern)
+        self.pattern = pattern
+        self.buffer_size = buffer_size
+        self.logger = logger
+        self.handle_pool = handle_pool if handle_pool is not None else FileHandlePool()
+        self._sources = {}  # type: Dict[str, FileSource]  # path of the matched file: its source
+        self._changed_sources = []  # type: List[FileSource]  # sources prepared by the last poll
+
+    def poll(self):  # type: () -> bool
+        for file_path in find_log_files(self.pattern):
+            if file_path not in self._sources:
+                if self.logger is not None:
+                    self.logger.debug('new log file %s matched by %s' % (file_path, self.pattern))
+                self._sources[file_path] = FileSource(file_path, self.buffer_size, self.logger, self.handle_pool)
+
+        # only the files whose stat differs are opened, the others are not touched at all
+        self._changed_sources = self._poll_sources([source for source in self._sources.values() if source.changed()])
+        if any(source.rescanned for source in self._changed_sources):
+            # one of the files is read again from its beginning and the cached attacks of all files are forgotten,
+            # so all the files must be read again
+            self.rescanned = True
+            for source in self._sources.values():
+                source.rescanned = False
+                source.rewind()
+            self._changed_sources = self._poll_sources(list(self._sources.values()))
+        return len(self._changed_sources) > 0
+
+    def read_lines(self, skip_scanning=False):  # type: (bool) -> Iterator[str]
+        for source in self._changed_sources:
+            bytes_read = source.bytes_read
+            for log_line in source.read_lines(skip_scanning):
+                yield log_line
+            self.bytes_read += source.bytes_read - bytes_read
+        self._changed_sources = []
+        self.handle_pool.trim()  # close the least recently read files over the limit
+
+    def skip_older(self, max_age):  # type: (float) -> int
+        return sum(source.skip_older(max_age) for source in self._changed_sources)
+
+    def history(self, max_age):  # type: (float) -> Iterator[str]
+        for source in list(self._sources.values()):
+            for log_line in source.history(max_age):
+                yield log_line
+
+    def rewind(self):  # type: () -> None
+        for source in self._sources.values():
+            source.rewind()
+
+    def close(self):  # type: () -> None
+        for source in self._sources.values():
+            source.close()
+        self._sources = {}
+        self._changed_sources = []
+
+    def _poll_sources(self, sources):  # type: (List[FileSource]) -> List[FileSource]
+        """
+        Polls the sources of the files and forgets the sources of the files that do not exist anymore
+        :param sources: sources to poll
+        :return: sources that may have new lines
+        """
+        changed_sources = []  # type: List[FileSource]
+        for source in sources:
+            try:
+                if source.poll():
+                    changed_sources.append(source)
+            except FileNotFoundError:
+                if self.logger is not None:
+                    self.logger.debug('log file %s was removed' % source.file_log)
+                source.close()
+                del self._sources[source.file_log]
+        return changed_sources
+
+
+class FileHandlePool:
+    """
+    Bounds the number of the open log files. When there are more of them, the least recently read ones are closed and
+    their sources reopen them when they change again
+    """
+
+    def __init__(self, max_open_files=256):  # type: (int) -> None
+        """
+        Initializes the pool
+        :param max_open_files: maximum number of files left open by self.trim
+        """
+        self.max_open_files = max_open_files
+        self._sources = OrderedDict()  # type: OrderedDict  # sources with an open file, the least recently used first
+        self._lock = Lock()
+
+    def use(self, source):  # type: (FileSource) -> None
+        """
+        Marks the file of the source as open and the most recently used
+        :param source: source whose file was opened or polled
+        :return: None
+        """
+        with self._lock:
+            self._sources[source] = True
+            self._sources.move_to_end(source)
+
+    def forget(self, source):  # type: (FileSource) -> None
+        """
+        Removes the closed source from the pool
+        :param source: the closed source
+        :return: None
+        """
+        with self._lock:
+            self._sources.pop(source, None)
+
+    def trim(self):  # type: () -> None
+        """
+        Closes the files of the least recently used sources until at most max_open_files are open. Must not be
+        called while some of the sources is being read
+        :return: None
+        """
+        with self._lock:
+            while len(self._sources) > self.max_open_files:
+                source, _ = self._sources.popitem(last=False)
+                source.release_handle()
+
+
+class JournalSource(LogSource):
+    """
+    Entries of the systemd journal formatted as lines of the syslog file, eg.
+    "Aug 10 16:52:08 hostname sshd[123]: Failed password for root from 1.2.3.4 port 22 ssh2"
+    The journal is read by the systemd module if installed, otherwise by "journalctl -o export --follow". The cursor
+    of the last read entry can be saved into a checkpoint file, so the reading continues there after restart
+    """
+
+    def __init__(self, matches=None, checkpoint_file=None, logger=None, journalctl='journalctl'):
+        # type: (Dict[str, str], str, Logger, str) -> None
+        """
+        Initializes the source
+        :param matches: optional dictionary of journal fields and their values the entries must match,
+        eg. {"_SYSTEMD_UNIT": "ssh.service"}
+        :param checkpoint_file: optional path to the file where the cursor of the last read entry is saved
+        :param logger: optional logger. If specified, the source fires messages into him
+        :param journalctl: path to the journalctl executable used when the systemd module is not installed
+        """
+        self.matches = matches if matches is not None else {}
+        LogSource.__init__(self, 'journal' + ''.join(' %s=%s' % match for match in sorted(self.matches.items())))
+        self.checkpoint_file = checkpoint_file
+        self.logger = logger
+        self.journalctl = journalctl
+
+        self.cursor = None  # type: str or None  # cursor of the last read entry
+        if checkpoint_file is not None and os.path.isfile(checkpoint_file):
+            with open(checkpoint_file, 'r') as f:
+                self.cursor = f.read().strip() or None
+        self._saved_cursor = self.cursor  # type: str or None  # cursor saved in the checkpoint file
+        # entries after the saved cursor were written while the program was not running, so they are always scanned
+        self._resumed = self.cursor is not None
+
+        self._reader = None  # systemd.journal.Reader if the systemd module is installed
+        self._process = None  # type: subprocess.Popen or None  # journalctl following the journal
+        self._entries = Queue()  # type: Queue  # entries read by journalctl
+        self._next_entry = None  # type: dict or None  # entry read by self.poll from the reader
+
+    def poll(self):  # type: () -> bool
+        if self._reader is None and self._process is None:
+            self._open()
+        if self._reader is not None:
+            if self._next_entry is None:
+                self._next_entry = self._reader.get_next() or None
+            return self._next_entry is not None
+        if self._process.poll() is not None and self._entries.empty():
+            # journalctl has ended, start it again by the next poll
+            self.close()
+            return False
+        return not self._entries.empty()
+
+    def read_lines(self, skip_scanning=False):  # type: (bool) -> Iterator[str]
+        while True:
+            if self._reader is not None:
+                entry = self._next_entry if self._next_entry is not None else self._reader.get_next()
+                self._next_entry = None
+                if not entry:
+                    break
+            else:
+                try:
+                    entry = self._entries.get_nowait()
+                except Empty:
+                    break
+            self.cursor = entry.get('__CURSOR', self.cursor)
+            if not skip_scanning or self._resumed:
+                log_line = format_journal_entry(entry)
+                self.bytes_read += len(log_line) + 1
+                yield log_line
+        self._resumed = False
+        self._save_checkpoint()
+
+    def close(self):  # type: () -> None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+            self._next_entry = None
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+            self._entries = Queue()  # entries not read yet are printed again by the next journalctl after the cursor
+
+    def _open(self):  # type: () -> None
+        """
+        Starts reading the journal after the saved cursor or after the last entry if there is no cursor
+        :return: None
+        """
+        if systemd_journal is not None:
+            self._reader = systemd_journal.Reader()
+            for field, value in self.matches.items():
+                self._reader.add_match(**{field: value})
+            if self.cursor is not None:
+                self._reader.seek_cursor(self.cursor)
+                self._reader.get_next()  # the entry at the cursor was already read
+            else:
+                self._reader.seek_tail()
+                self._reader.get_previous()
+            return
+
+        command = [self.journalctl, '-o', 'export', '--follow', '--no-pager']
+        command.append('--after-cursor=%s' % self.cursor if self.cursor is not None else '--lines=0')
+        command += ['%s=%s' % match for match in self.matches.items()]
+        if self.logger is not None:
+            self.logger.debug('systemd module is missing, following the journal by %s' % ' '.join(command))
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        ThreadJournalExport(self._process.stdout, self._entries).start()
+
+    def _save_checkpoint(self):  # type: () -> None
+        """
+        Saves the cursor of the last read entry into the checkpoint file if enabled and the cursor has changed
+        :return: None
+        """
+        if self.checkpoint_file is None or self.cursor is None or self.cursor == self._saved_cursor:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_file)), exist_ok=True)
+        with open(self.checkpoint_file + '.tmp', 'w') as f:
+            f.write(self.cursor)
+        os.replace(self.checkpoint_file + '.tmp', self.checkpoint_file)
+        self._saved_cursor = self.cursor
+
+
+class ThreadJournalExport(Thread):
+    """
+    Reads the journal entries printed by journalctl in the export format until journalctl ends
+    """
+
+    def __init__(self, stream, entries):  # type: (BinaryIO, Queue) -> None
+        """
+        Initializes the thread
+        :param stream: standard output of journalctl
+        :param entries: queue into which are the read entries put
+        """
+        Thread.__init__(self, daemon=True)
+        self.stream = stream
+        self.entries = entries
+
+    def run(self):
+        for entry in read_journal_export(self.stream):
+            self.entries.put(entry)
+
+
+def parse_log_line(log_line, rules, attacks, max_age=None, banned_ips=None, banned_hits=None, on_attack=None):
+    # type: (str, List[Rule], dict, float, Set[str], Dict[str, int], Callable[[str, Attack], None]) -> Rule or None
+    """
+    Tests the rules against the line from log file and saves the attack if some rule fits
+    :param log_line: line from a log file
+    :param rules: list of rules. The first rule that fits is used
+    :param attacks: dictionary. Key is the IP that attacked and value is list of its attacks. The found attack is
+    appended here
+    :param max_age: optional, in seconds. If attack is older as this then it is ignored
+    :param banned_ips: optional set of already banned IPs. If the line is from one of them, then only its IP is parsed
+    and no attack is saved
+    :param banned_hits: optional dictionary. Key is the banned IP and value is the number of its lines, the line from
+    the banned IP is counted here
+    :param on_attack: optional function called with the IP and the attack when the attack is saved
+    :return: the rule that fits the line or None if no rule fits
+    """
+    for rule in rules:
+        match = rule.match(log_line)
+        if match is None:
+            continue
+        if banned_ips is not None:
+            ip = rule.get_ip(match)
+            if ip in banned_ips:
+                if banned_hits is not None:
+                    banned_hits[ip] = banned_hits.get(ip, 0) + 1
+                return rule
+        attacker_ip, attack = rule.get_attack(match)
+        if max_age is not None and time.time() - max_age > attack.timestamp:
+            return rule
+        item = attacks.get(attacker_ip)
+        if item is None:
+            item = attacks[attacker_ip] = []
+        item.append(attack)
+        if on_attack is not None:
+            on_attack(attacker_ip, attack)
+        return rule
+    return None
+
+
+def get_backfill_context():  # type: () -> multiprocessing.context.BaseContext
+    """
+    Gets the context starting the processes that parse the chunks of the log files. Forking the program itself is not
+    safe, as a lock held by one of its threads would stay locked in the child forever. The processes are forked from
+    a fork server that has imported only this module instead, or spawned where the fork server is not available
+    :return: the multiprocessing context
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def parse_log_chunk(file_log, chunk, rules, max_age=None, buffer_size=1024 * 1024, banned_ips=None):
+    # type: (str, Tuple[int, int], List[Rule], float, int, Set[str] or None) -> (dict, int, int, List[int], int)
+    """
+    Parses the attacks from a part of the log file. Used by worker processes of LogParser
+    :param file_log: path to the file with logs
+    :param chunk: tuple (start, end) with byte offsets of the part. Both should be aligned on the start of the line
+    :param rules: list of rules
+    :param max_age: optional, in seconds. If attack is older as this then it is ignored
+    :param buffer_size: size in bytes of the blocks in which is the log file read
+    :param banned_ips: optional set of already banned IPs whose lines are only counted
+    :return: tuple (attacks, analyzed size, lines read, rule hits, banned lines). Attacks are a dictionary where key is
+    the IP that attacked and value is list of its attacks. Analyzed size is the offset of
+    the end of the last parsed line. Rule hits are numbers of lines that matched each rule, in the same order as the
+    rules. Banned lines is the number of lines of the banned IPs
+    """
+    attacks = {}
+    lines_read = 0
+    rule_hits = {}  # type: Dict[Rule, int]
+    banned_hits = {}  # type: Dict[str, int]
+    with open(file_log, 'rb') as f:
+        f.seek(chunk[0])
+        analyzed_size = chunk[0]
+        for log_line, analyzed_size in read_log_lines(f, chunk[1], buffer_size):
+            lines_read += 1
+            rule = parse_log_line(log_line, rules, attacks, max_age, banned_ips, banned_hits)
+            if rule is not None:
+                rule_hits[rule] = rule_hits.get(rule, 0) + 1
+    return attacks, analyzed_size, lines_read, [rule_hits.get(rule, 0) for rule in rules], sum(banned_hits.values())
+
+
+def find_rotated_logs(file_log):  # type: (str) -> List[str]
+    """
+    Finds the rotated versions of the log file, like auth.log.1, auth.log.2.gz or auth.log-20200101.zst
+    :param file_log: path to the file with logs
+    :return: list of paths to the rotated log files, sorted from the oldest to the newest. Zstd compressed files are
+    listed only if the zstandard module is installed
+    """
+    directory, name = os.path.split(os.path.abspath(file_log))
+    rotated_name = re.compile('^%s[.-][0-9]+(\\.gz|\\.zst)?$' % re.escape(name))
+    rotated_logs = []
+    for file_name in os.listdir(directory):
+        if not rotated_name.match(file_name):
+            continue
+        if file_name.endswith('.zst') and zstandard is None:
+            continue
+        rotated_logs.append(os.path.join(directory, file_name))
+    return sorted(rotated_logs, key=os.path.getmtime)
+
+
+def is_log_pattern(file_log):  # type: (str) -> bool
+    """
+    Tests if the logFile of the profile matches multiple log files
+    :param file_log: the logFile of the profile
+    :return: True if it is a glob pattern or a directory, False if it is a path to a single file
+    """
+    return re.search('[*?[]', file_log) is not None or os.path.isdir(file_log)
+
+
+def find_log_files(pattern):  # type: (str) -> List[str]
+    """
+    Finds the log files matched by the glob pattern or found in the directory, leaving out their rotated versions
+    :param pattern: glob pattern or path to the directory
+    :return: sorted list of paths to the log files
+    """
+    file_paths = [os.path.join(pattern, file_name) for file_name in os.listdir(pattern)] if os.path.isdir(pattern) \
+        else glob.glob(pattern)
+    rotated_name = re.compile('([.-][0-9]+(\\.gz|\\.zst)?|\\.gz|\\.zst)$')
+    return sorted(file_path for file_path in file_paths
+                  if os.path.isfile(file_path) and not rotated_name.search(os.path.basename(file_path)))
+
+
+def open_log_file(file_path):  # type: (str) -> BinaryIO
+    """
+    Opens the log file for reading in binary mode, decompressing it on the fly if it is compressed
+    :param file_path: path to the log file. Files ending with .gz are read as gzip, files ending with .zst as zstd
+    :return: file-like object with the uncompressed content
+    """
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rb')
+    if file_path.endswith('.zst'):
+        if zstandard is None:
+            raise OSError('zstandard module is not installed')
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
+    return open(file_path, 'rb')
+
+
+def read_log_lines(f, end=None, buffer_size=1024 * 1024):  # type: (BinaryIO, int, int) -> Iterator[Tuple[str, int]]
+    """
+    Reads the lines of the file from its current position in blocks of fixed size, so at most one block and one line
+    are held in the memory at once. The unterminated last line is not returned
+    :param f: file opened in binary mode
+    :param end: optional offset in bytes at which the reading stops. If None, then the file is read until its end
+    :param buffer_size: size in bytes of the read blocks
+    :return: generator of tuples (line, offset of the end of the line including the line separator)
+    """
+    offset = f.tell()  # offset of the end of the last returned line
+    remainder = b''  # start of the line that continues in the next block
+    while end is None or offset + len(remainder) < end:
+        block = f.read(buffer_size if end is None else min(buffer_size, end - offset - len(remainder)))
+        if not block:
+            break
+        lines = (remainder + block).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            offset += len(line) + 1
+            yield line.decode('utf8', errors='replace').rstrip('\r'), offset
+
+
+def read_log_lines_reversed(f, end, buffer_size=1024 * 1024):  # type: (BinaryIO, int, int) -> Iterator[Tuple[str, int]]
+    """
+    Reads the lines of the file backwards, from its end to its beginning, in blocks of fixed size. The unterminated
+    last line is not returned
+    :param f: file opened in binary mode
+    :param end: offset in bytes at which the file ends
+    :param buffer_size: size in bytes of the read blocks
+    :return: generator of tuples (line, offset of the end of the line including the line separator), the last line
+    of the file first
+    """
+    position = end  # offset of the start of the last read block
+    remainder = b''  # end of the line that started in the previous block
+    line_end = None  # type: int or None  # offset of the end of the next returned line, None until it is known
+    while position > 0:
+        block_size = min(buffer_size, position)
+        position -= block_size
+        f.seek(position)
+        lines = (f.read(block_size) + remainder).split(b'\n')
+        remainder = lines.pop(0)
+        if line_end is None:
+            if len(lines) == 0:  # still inside the unterminated last line
+                continue
+            line_end = end - len(lines.pop())  # skip the unterminated last line
+        for line in reversed(lines):
+            yield line.decode('utf8', errors='replace').rstrip('\r'), line_end
+            line_end -= len(line) + 1
+    if line_end is not None:
+        yield remainder.decode('utf8', errors='replace').rstrip('\r'), line_end
+
+
+_syslog_time_pattern = re.compile('^([A-Z][a-z]{2}) +([0-9]{1,2}) ([0-9]{2}:[0-9]{2}:[0-9]{2}) ')
+_iso_time_pattern = re.compile('^[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}:[0-9]{2}[^ ]*')
+
+
+def parse_log_time(log_line):  # type: (str) -> float or None
+    """
+    Parses the time from the beginning of the log line, which is either in the syslog format like "Aug  1 16:52:08" or
+    in the ISO 8601 format like "2020-08-01T16:52:08.123456+02:00". The syslog time is dated to the current year the
+    same way as the attacks are dated by the rules
+    :param log_line: line from a log file
+    :return: timestamp of the line or None if the line does not start with a time
+    """
+    try:
+        match = _syslog_time_pattern.match(log_line)
+        if match is not None:
+            return time.mktime(datetime.strptime('%s %s %s %s' % ((datetime.now().strftime('%Y'),) + match.groups()),
+                                                 '%Y %b %d %H:%M:%S').timetuple())
+        match = _iso_time_pattern.match(log_line)
+        if match is not None:
+            line_time = datetime.fromisoformat(match.group(0).replace('Z', '+00:00'))
+            return line_time.timestamp() if line_time.tzinfo is not None else time.mktime(line_time.timetuple())
+    except ValueError:
+        pass
+    return None
+
+
+def read_journal_export(stream):  # type: (BinaryIO) -> Iterator[Dict[str, str]]
+    """
+    Parses the journal entries from the stream in the journal export format
+    (https://systemd.io/JOURNAL_EXPORT_FORMATS/)
+    :param stream: stream opened in binary mode
+    :return: generator of entries, dictionaries where key is the name of the field and value is its value
+    """
+    entry = {}  # type: Dict[str, str]
+    while True:
+        line = stream.readline()
+        if not line:
+            break
+        if line == b'\n':  # empty line ends the entry
+            if len(entry) > 0:
+                yield entry
+            entry = {}
+            continue
+        line = line.rstrip(b'\n')
+        if b'=' in line:
+            field, value = line.split(b'=', 1)
+        else:  # binary field, its name is followed by the little endian 64 bit size and the data
+            field = line
+            size = stream.read(8)
+            if len(size) < 8:
+                break
+            value = stream.read(struct.unpack('<Q', size)[0])
+            stream.read(1)  # the data are terminated by new line
+        entry[field.decode('utf8', errors='replace')] = value.decode('utf8', errors='replace')
+    if len(entry) > 0:
+        yield entry
+
+
+def format_journal_entry(entry):  # type: (dict) -> str
+    """
+    Formats the journal entry as a line of the syslog file, eg.
+    "Aug  1 16:52:08 hostname sshd[123]: Failed password for root from 1.2.3.4 port 22 ssh2"
+    :param entry: the entry as returned by the systemd module or by read_journal_export
+    :return: the formatted line
+    """
+    timestamp = entry.get('__REALTIME_TIMESTAMP')
+    if isinstance(timestamp, datetime):
+        entry_time = timestamp
+    elif timestamp is not None:  # microseconds since the epoch
+        entry_time = datetime.fromtimestamp(int(timestamp) / 1000000)
+    else:
+        entry_time = datetime.now()
+    identifier = entry.get('SYSLOG_IDENTIFIER', entry.get('_COMM', ''))
+    pid = entry.get('_PID', entry.get('SYSLOG_PID'))
+    message = entry.get('MESSAGE', '')
+    if isinstance(message, bytes):
+        message = message.decode('utf8', errors='replace')
+    return '%s %2d %s %s %s%s: %s' % (entry_time.strftime('%b'), entry_time.day, entry_time.strftime('%H:%M:%S'),
+                                      entry.get('_HOSTNAME', ''), identifier, '' if pid is None else '[%s]' % pid,
+                                      message.replace('\n', ' '))
+
+
+@lru_cache(maxsize=65536)
+def parse_ip(text):  # type: (str) -> str or None
+    """
+    Parses the IP from the variable of the log line into its canonical form, so every IP has a single key in the
+    attacks, the bans and the database: IPv6 is compressed and lowercase and IPv4 mapped into IPv6 (::ffff:1.2.3.4)
+    is converted to plain IPv4. The repeated IPs are taken from the cache, which returns the same string object for
+    all attacks of the IP
+    :param text: the IP as written in the log line, optionally enclosed in brackets
+    :return: the canonical IP or None if the text is not a valid IP
+    """
+    try:
+        address = ipaddress.ip_address(text.strip().strip('[]'))
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return str(address)
+
+
+class Attack:
+    """
+    One attack found in the log. Only the values needed to detect the offenders are held, the other variables of the
+    line are kept only if the rule was asked to keep them
+    """
+    __slots__ = ('timestamp', 'user', 'service', 'extra')
+
+    def __init__(self, timestamp, user=None, service=None, extra=None):
+        # type: (float, str or None, str or None, Dict[str, str] or None) -> None
+        """
+        Initializes the attack
+        :param timestamp: time of the attack
+        :param user: optional user name the attacker tried to use
+        :param service: optional name of the service the attack was assigned to
+        :param extra: optional dictionary with other kept variables of the line
+        """
+        self.timestamp = timestamp
+        self.user = user
+        self.service = service
+        self.extra = extra
+
+    def as_dict(self):  # type: () -> dict
+        """
+        Converts the attack into the dictionary of variables as returned by Rule.get_variables
+        :return: dictionary where key is the name of the variable and value its value
+        """
+        data = dict(self.extra) if self.extra is not None else {}
+        data['TIMESTAMP'] = self.timestamp
+        if self.user is not None:
+            data['USER'] = self.user
+        if self.service is not None:
+            data['SERVICE'] = self.service
+        return data
+
+    def as_list(self):  # type: () -> list
+        """
+        Converts the attack into a list that can be saved as JSON
+        :return: list [timestamp, user, service, extra]
+        """
+        return [self.timestamp, self.user, self.service, self.extra]
+
+    @staticmethod
+    def from_list(data):  # type: (list) -> Attack
+        """
+        Creates the attack from the list returned by as_list
+        :param data: list [timestamp, user, service, extra]
+        :return: the attack
+        """
+        return Attack(data[0], data[1], data[2], data[3])
+
+
+def compile_rule(filter_string, service_name=None, keep_variables=()):
+    # type: (str, str or None, Tuple[str, ...]) -> Rule
+    """
+    Gets the rule for the filter, compiling it only if the same filter was not compiled recently. Rules hold no state
+    of the parsing, so the same rule is shared by all parsers and survives reloading of the profiles. Only the most
+    recently used rules are kept, so the rules of the removed or changed profiles are forgotten
+    :param filter_string: string representation of the rule/filter with all variables stated as %VAR_NAME%
+    :param service_name: optional name of the service. If not specified then found attacks are not assigned to any
+    service
+    :param keep_variables: names of the variables kept with the attacks besides their time and user
+    :return: the compiled rule
+    """
+    return _compile_rule(filter_string, service_name, tuple(keep_variables))
+
+
+@lru_cache(maxsize=1024)
+def _compile_rule(filter_string, service_name, keep_variables):  # type: (str, str or None, Tuple[str, ...]) -> Rule
+    """
+    Compiles the rule for compile_rule, the compiled rules are cached by lru_cache
+    :param filter_string: string representation of the rule/filter with all variables stated as %VAR_NAME%
+    :param service_name: name of the service or None
+    :param keep_variables: names of the variables kept with the attacks besides their time and user
+    :return: the compiled rule
+    """
+    return Rule(filter_string, service_name, keep_variables)
 
 
 class Rule:
@@ -178,27 +1439,56 @@ class Rule:
     variables from that line
     """
 
-    def __init__(self, filter_string, service_name=None):  # type: (str, str or None) -> None
+    def __init__(self, filter_string, service_name=None, keep_variables=()):
+        # type: (str, str or None, Tuple[str, ...]) -> None
         """
         Initializes this rule/filter
         :param filter_string: string representation of this rule/filter with all variables stated as %VAR_NAME%
         :param service_name: optional name of the service. If not specified then found attacks are not assigned to any
         service
+        :param keep_variables: names of the variables kept with the attacks created by self.get_attack besides their
+        time and user
         """
+        self.filter_string = filter_string
+        self.keep_variables = tuple(keep_variables)
         self.__service_name = service_name
         self.__rule_variables = re.findall("%.*?%", filter_string)
 
         # Generate regex for rule detection
-        self.__rule_regex = filter_string
-        for reserved_char in list("\\+*?^$.[]{}()|/"):  # escape reserved regex characters
-            self.__rule_regex = self.__rule_regex.replace(reserved_char, '\\' + reserved_char)
+        self.__rule_regex = self.__escape(filter_string)
         for variable in self.__rule_variables:  # replace all variables with any regex characters
             self.__rule_regex = self.__rule_regex.replace(variable, '(.+?)')
         if self.__rule_regex.endswith('?)'):  # disable lazy search for last variables so they are found whole
             self.__rule_regex = self.__rule_regex[:-2] + ')'
 
+        # When the variables are separated by literals, the lazy variables of the regex end at the first occurrence of
+        # the following literal, so the line can be split by str.find instead of backtracking. Used only when the
+        # literals give exactly the same regex, otherwise the line is matched by the regex
+        self.__literals = re.split('%.*?%', filter_string)  # type: List[str] or None
+        self.__leading_literal = self.__literals[0]  # every line fitting this rule starts with it
+        literals_regex = '(.+?)'.join(self.__escape(literal) for literal in self.__literals)
+        if literals_regex.endswith('?)'):
+            literals_regex = literals_regex[:-2] + ')'
+        if literals_regex != self.__rule_regex or '' in self.__literals[1:-1]:
+            self.__literals = None
+
         # Remove %'s from variable names
         self.__rule_variables = [var[1:-1] for var in self.__rule_variables]
+        self.__rule_pattern = re.compile(self.__rule_regex)
+        # indexes of the variables. If the variable is repeated, the last one is used the same way as in get_variables
+        self.__variable_indexes = {variable: i for i, variable in enumerate(self.__rule_variables)}
+        self.__ip_index = self.__variable_indexes.get('IP')
+
+    @staticmethod
+    def __escape(text):  # type: (str) -> str
+        """
+        Escapes the reserved characters of the regex in the text
+        :param text: part of the filter string
+        :return: the escaped text
+        """
+        for reserved_char in list("\\+*?^$.[]{}()|/"):  # escape reserved regex characters
+            text = text.replace(reserved_char, '\\' + reserved_char)
+        return text
 
     def test(self, log_line):  # type: (str) -> bool
         """
@@ -206,36 +1496,126 @@ class Rule:
         :param log_line: line from a log file
         :return: True if it fits, False if this rule cannot be applied to this line
         """
-        return True if re.match(self.__rule_regex, log_line) else False
+        return self.match(log_line) is not None
 
-    def get_variables(self, log_line):  # type: (str) -> dict or None
+    def match(self, log_line):  # type: (str) -> Tuple[str, ...] or None
+        """
+        Matches this rule against a line from log file
+        :param log_line: line from a log file
+        :return: the unstripped values of the variables that can be passed to self.get_ip and self.get_variables or
+        None if this rule does not fit
+        """
+        literals = self.__literals
+        if literals is None or '\n' in log_line:  # regex does not match new lines by the variables
+            match = self.__rule_pattern.match(log_line)
+            return match.groups() if match else None
+
+        if not log_line.startswith(literals[0]):
+            return None
+        values = []  # type: List[str]
+        position = len(literals[0])
+        last = len(literals) - 1
+        for i in range(1, last + 1):
+            literal = literals[i]
+            if i == last and literal == '':  # the last variable takes the rest of the line
+                if position >= len(log_line):
+                    return None
+                values.append(log_line[position:])
+                break
+            end = log_line.find(literal, position + 1)  # every variable has at least one character
+            if end < 0:
+                return None
+            values.append(log_line[position:end])
+            position = end + len(literal)
+        return tuple(values)
+
+    def get_ip(self, match):  # type: (Tuple[str, ...]) -> str or None
+        """
+        Gets only the IP variable from the line matched by this rule, without parsing the other variables
+        :param match: the values returned by self.match
+        :return: the IP in its canonical form (see parse_ip) or None if this rule has no IP variable or the IP is not
+        valid
+        """
+        return parse_ip(match[self.__ip_index]) if self.__ip_index is not None else None
+
+    def overlaps(self, other):  # type: (Rule) -> bool
+        """
+        Tests if this rule and the other rule may fit the same line. The variables can hold any text, so the rules
+        surely fit different lines only when their texts before the first variable differ, eg. "sshd[%PID%]" and
+        "sudo: %USER%". If one of these texts starts with the other one, some line fits both rules
+        :param other: the other rule
+        :return: True if the rules overlap, False if no line can fit both of them
+        """
+        return self.__leading_literal.startswith(other.__leading_literal) or \
+            other.__leading_literal.startswith(self.__leading_literal)
+
+    def get_attack(self, match):  # type: (Tuple[str, ...]) -> (str, Attack)
+        """
+        Creates the attack from the line matched by this rule. Unlike self.get_variables, only the time, the user and
+        the variables this rule was asked to keep are parsed
+        :param match: the values returned by self.match
+        :return: tuple (IP of the attacker, the attack). If the IP is not valid, then it is 'NO VALID IP FOUND' and
+        the original value is kept in the extra variable IP-RAW
+        """
+        indexes = self.__variable_indexes
+        extra = None  # type: Dict[str, str] or None
+        for variable in self.keep_variables:
+            if variable in indexes:
+                if extra is None:
+                    extra = {}
+                extra[variable] = match[indexes[variable]].strip()
+
+        ip = self.get_ip(match)
+        if ip is None:
+            ip = 'NO VALID IP FOUND'
+            if extra is None:
+                extra = {}
+            extra['IP-RAW'] = match[self.__ip_index].strip() if self.__ip_index is not None else ''
+
+        user_index = indexes.get('USER')
+        return ip, Attack(self.__get_timestamp({variable: match[indexes[variable]].strip()
+                                                for variable in ('D:M', 'D:D', 'TIME') if variable in indexes}),
+                          match[user_index].strip() if user_index is not None else None, self.__service_name, extra)
+
+    def get_variables(self, log_line, match=None):  # type: (str, Tuple[str, ...] or None) -> dict or None
         """
         Parses variables from log line that fits this rule
         :param log_line: line from a log file
+        :param match: optional values of the variables returned by self.match, so the line is not matched again
         :return: None if this rule cannot be applied to this line, otherwise returns a dictionary with parsed variables
         from this line
         """
         data = {}
 
         # Parse all variables from log line
-        variable_search = re.match(self.__rule_regex, log_line)
-        if not variable_search:  # this rule is not for this line
+        values = match if match is not None else self.match(log_line)
+        if values is None:  # this rule is not for this line
             return None
-        # noinspection PyTypeChecker
-        for i, variable in enumerate(self.__rule_variables):
-            data[variable] = variable_search.group(i + 1).strip()
+        for variable, value in zip(self.__rule_variables, values):
+            data[variable] = value.strip()
 
         # attempt to parse raw IP
         if 'IP' in data:
-            ip = re.findall('[0-9]{3}\\.[0-9]{3}\\.[0-9]{3}\\.[0-9]{3}', data['IP'])
-            if len(ip) == 0:
-                ip = re.findall('([0-9a-f]{1,4}|::)((:{0,2}[0-9a-f]{0,4}){0,7})', data['IP'])
-            if len(ip) == 0:
+            ip = parse_ip(data['IP'])
+            if ip is None:
                 data['IP-RAW'], data['IP'] = data['IP'], 'NO VALID IP FOUND'
+            else:
+                data['IP'] = ip
 
         if self.__service_name is not None:
             data['SERVICE'] = self.__service_name
 
+        data['TIMESTAMP'] = self.__get_timestamp(data)
+        return data
+
+    @staticmethod
+    def __get_timestamp(data):  # type: (Dict[str, str]) -> float
+        """
+        Computes the time of the attack from its date and time variables. Missing year is the current one, missing
+        date is today and if there is no time at all then the current time is used
+        :param data: dictionary with the variables D:M, D:D and TIME, all of them are optional
+        :return: the timestamp
+        """
         date_format = '%Y %b %d %H:%M:%S'
         date_string = None
         if 'D:M' in data and 'D:D' in data and 'TIME' in data:
@@ -247,9 +1627,8 @@ class Rule:
             # noinspection PyTypeChecker
             date_string = datetime.now().strftime('%Y %b %d') + ' ' + data['TIME']
 
-        data['TIMESTAMP'] = time.time() if date_string is None else \
+        return time.time() if date_string is None else \
             time.mktime(datetime.strptime(date_string, date_format).timetuple())
-        return data
 
 
 # If launched directly, perform a quick proof of work in file debug.log
@@ -0,0 +1,365 @@
+import logging
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+from typing import Callable, Dict, Iterable, List, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'  # content type of the Prometheus text format
+
+
+class Metric:
+    """
+    Named metric with samples distinguished by the values of its labels
+    """
+    type_name = 'untyped'
+
+    def __init__(self, name, description, label_names=()):  # type: (str, str, Tuple[str, ...]) -> None
+        """
+        Initializes the metric
+        :param name: name of the metric, eg. sg_scan_duration_seconds
+        :param description: human readable description of the metric
+        :param label_names: names of the labels of the samples
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}  # type: Dict[Tuple[str, ...], float]  # label values: value
+        self._lock = Lock()
+
+    def _label_values(self, labels):  # type: (Dict[str, any]) -> Tuple[str, ...]
+        """
+        Orders the values of the labels by the label names of this metric
+        :param labels: dictionary where key is the name of the label and value is its value
+        :return: tuple of values of all labels
+        """
+        return tuple(str(labels.get(label_name, '')) for label_name in self.label_names)
+
+    def samples(self):  # type: () -> Iterable[Tuple[str, Dict[str, str], float]]
+        """
+        Lists the samples of this metric
+        :return: list of tuples (name of the sample, labels of the sample, value)
+        """
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, dict(zip(self.label_names, label_values)), value) for label_values, value in values]
+
+    def render(self):  # type: () -> str
+        """
+        Renders the metric in the Prometheus text format
+        :return: the rendered metric including its HELP and TYPE lines
+        """
+        lines = ['# HELP %s %s' % (self.name, self.description.replace('\\', '\\\\').replace('\n', '\\n')),
+                 '# TYPE %s %s' % (self.name, self.type_name)]
+        for sample_name, labels, value in self.samples():
+            lines.append('%s%s %s' % (sample_name, format_labels(labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """
+    Metric that only increases, eg. number of read lines
+    """
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):  # type: (float, any) -> None
+        """
+        Increases the value of the sample
+        :param amount: how much to add
+        :param labels: values of the labels of the sample
+        :return: None
+        """
+        label_values = self._label_values(labels)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Metric that can go up and down, eg. length of a queue
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name, description, label_names=(), function=None):
+        # type: (str, str, Tuple[str, ...], Callable[[], float] or None) -> None
+        """
+        Initializes the metric
+        :param name: name of the metric
+        :param description: human readable description of the metric
+        :param label_names: names of the labels of the samples
+        :param function: optional function without labels. If set, the gauge has a single sample with the value
+        returned by this function at the time of rendering
+        """
+        Metric.__init__(self, name, description, label_names)
+        self.function = function
+
+    def set(self, value, **labels):  # type: (float, any) -> None
+        """
+        Sets the value of the sample
+        :param value: the new value
+        :param labels: values of the labels of the sample
+        :return: None
+        """
+        label_values = self._label_values(labels)
+        with self._lock:
+            self._values[label_values] = value
+
+    def samples(self):  # type: () -> Iterable[Tuple[str, Dict[str, str], float]]
+        if self.function is not None:
+            return [(self.name, {}, self.function())]
+        return Metric.samples(self)
+
+
+class Histogram(Metric):
+    """
+    Metric counting the observed values in buckets, eg. durations of scans
+    """
+    type_name = 'histogram'
+    default_buckets = (.001, .005, .01, .05, .1, .5, 1, 5, 10, 30, 60)
+
+    def __init__(self, name, description, label_names=(), buckets=default_buckets):
+        # type: (str, str, Tuple[str, ...], Tuple[float, ...]) -> None
+        """
+        Initializes the metric
+        :param name: name of the metric
+        :param description: human readable description of the metric
+        :param label_names: names of the labels of the samples
+        :param buckets: sorted upper bounds of the buckets. The bucket +Inf is added automatically
+        """
+        Metric.__init__(self, name, description, label_names)
+        self.buckets = tuple(buckets)
+        self._observations = {}  # type: Dict[Tuple[str, ...], List[float]]  # label values: bucket counts, sum, count
+
+    def observe(self, value, **labels):  # type: (float, any) -> None
+        """
+        Records the observed value
+        :param value: the observed value
+        :param labels: values of the labels of the sample
+        :return: None
+        """
+        label_values = self._label_values(labels)
+        with self._lock:
+            observations = self._observations.get(label_values)
+            if observations is None:
+                observations = self._observations[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    observations[i] += 1
+            observations[-2] += value
+            observations[-1] += 1
+
+    def time(self, **labels):  # type: (any) -> Timer
+        """
+        Measures the duration of the with block and records it in seconds
+        :param labels: values of the labels of the sample
+        :return: context manager measuring the time
+        """
+        return Timer(lambda duration: self.observe(duration, **labels))
+
+    def samples(self):  # type: () -> Iterable[Tuple[str, Dict[str, str], float]]
+        with self._lock:
+            all_observations = [(label_values, list(observations))
+                                for label_values, observations in self._observations.items()]
+        samples = []
+        for label_values, observations in all_observations:
+            labels = dict(zip(self.label_names, label_values))
+            for bound, count in zip(self.buckets, observations):
+                samples.append((self.name + '_bucket', dict(labels, le=format_value(bound)), count))
+            samples.append((self.name + '_bucket', dict(labels, le='+Inf'), observations[-1]))
+            samples.append((self.name + '_sum', labels, observations[-2]))
+            samples.append((self.name + '_count', labels, observations[-1]))
+        return samples
+
+
+class Timer:
+    """
+    Context manager that measures the duration of the with block
+    """
+
+    def __init__(self, callback):  # type: (Callable[[float], None]) -> None
+        """
+        Initializes the timer
+        :param callback: function called with the duration in seconds when the with block ends
+        """
+        self.callback = callback
+        self._start = None  # type: float or None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.callback(time.perf_counter() - self._start)
+
+
+class Registry:
+    """
+    Collection of all metrics that are exported
+    """
+
+    def __init__(self):
+        self._metrics = []  # type: List[Metric]
+        self._collectors = []  # type: List[Callable[[], Iterable[Metric]]]
+        self._lock = Lock()
+
+    def register(self, metric):  # type: (Metric) -> Metric
+        """
+        Adds the metric into this registry
+        :param metric: the metric to add
+        :return: the added metric
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):  # type: (Callable[[], Iterable[Metric]]) -> None
+        """
+        Adds the function that creates metrics at the time of rendering, eg. from the counters held by other objects
+        :param collector: function returning the created metrics
+        :return: None
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):  # type: () -> str
+        """
+        Renders all metrics in the Prometheus text format
+        :return: the rendered metrics
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for collector in collectors:
+            metrics += list(collector())
+        return ''.join(metric.render() for metric in metrics)
+
+
+class MetricsServer(Thread):
+    """
+    This thread serves the rendered metrics over HTTP, so they can be scraped by Prometheus
+    """
+
+    def __init__(self, registry, host='127.0.0.1', port=9737, running=None):
+        # type: (Registry, str, int, Callable[[], bool]) -> None
+        """
+        Initializes the server. The serving itself must be then started by using .start()
+        :param registry: registry with the served metrics
+        :param host: address to listen on
+        :param port: port to listen on
+        :param running: optional function. When it returns False, the serving is stopped and the server closed
+        """
+        Thread.__init__(self, daemon=True)
+        self.running = running if running is not None else lambda: True
+        self._stopped = False
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            """
+            Responds with the metrics to every GET request
+            """
+
+            def do_GET(self):
+                body = registry.render().encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # do not print every scrape
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.timeout = 0.5  # how often is checked if the serving should stop
+
+    def run(self):
+        while self.running() and not self._stopped:
+            self.server.handle_request()
+        self.server.server_close()
+
+    def stop(self):  # type: () -> None
+        """
+        Stops the serving, the server is closed by its thread within its timeout
+        :return: None
+        """
+        self._stopped = True
+
+
+class TextfileExporter(Thread):
+    """
+    This thread periodically writes the rendered metrics into a file, eg. for the textfile collector of node_exporter
+    """
+
+    def __init__(self, registry, file_path, interval=15.0, running=None, logger=None):
+        # type: (Registry, str, float, Callable[[], bool], logging.Logger or None) -> None
+        """
+        Initializes the exporter. The exporting itself must be then started by using .start()
+        :param registry: registry with the exported metrics
+        :param file_path: path to the file the metrics are written into
+        :param interval: how often in seconds are the metrics written
+        :param running: optional function. When it returns False, the exporting is stopped
+        :param logger: logger used for the errors
+        """
+        Thread.__init__(self, daemon=True)
+        self.registry = registry
+        self.file_path = file_path
+        self.interval = interval
+        self.running = running if running is not None else lambda: True
+        self.logger = logger if logger is not None else logging.getLogger()
+
+    def run(self):
+        while self.running():
+            try:
+                self.export()
+            except OSError as e:  # eg. the directory is missing or the disk is full, try again by the next interval
+                self.logger.error('cannot write the metrics into %s: %s' % (self.file_path, e))
+            time.sleep(self.interval)
+
+    def export(self):  # type: () -> None
+        """
+        Writes the metrics into the file. The file is replaced at once, so the readers never see it half written
+        :return: None
+        """
+        with open(self.file_path + '.tmp', 'w') as f:
+            f.write(self.registry.render())
+        os.replace(self.file_path + '.tmp', self.file_path)
+
+
+def format_labels(labels):  # type: (Dict[str, str]) -> str
+    """
+    Formats the labels of the sample in the Prometheus text format
+    :param labels: dictionary where key is the name of the label and value is its value
+    :return: formatted labels, eg. {profile="ssh",rule="..."}, or empty string if there are no labels
+    """
+    if len(labels) == 0:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('\n', '\\n')
+                                           .replace('"', '\\"')) for name, value in labels.items())
+
+
+def format_value(value):  # type: (float) -> str
+    """
+    Formats the value of the sample in the Prometheus text format
+    :param value: the value
+    :return: formatted value
+    """
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = Registry()  # registry of all metrics of this program
+
+SCAN_DURATION = REGISTRY.register(Histogram('sg_scan_duration_seconds', 'Duration of the whole scan cycle'))
+DB_QUEUE_DEPTH = REGISTRY.register(Gauge('sg_db_queue_depth', 'Number of operations waiting for the database writer'))
+DB_QUERY_DURATION = REGISTRY.register(Histogram('sg_db_query_duration_seconds',
+                                                'Duration of the database operations including the wait in the queue',
+                                                ('kind',)))
+BLOCKER_DURATION = REGISTRY.register(Histogram('sg_blocker_duration_seconds', 'Duration of the calls of the blocker',
+                                               ('action',)))
+BLOCKER_FAILURES = REGISTRY.register(Counter('sg_blocker_failures_total', 'Number of failed calls of the blocker',
+                                             ('action',)))
+BLOCK_QUEUE_DEPTH = REGISTRY.register(Gauge('sg_block_queue_depth', 'Number of offenders waiting to be blocked'))
+PERSIST_QUEUE_DEPTH = REGISTRY.register(Gauge('sg_persist_queue_depth',
+                                              'Number of batches of attacks waiting to be saved into the database'))
+HSOCKET_POLL_DURATION = REGISTRY.register(Histogram('sg_hsocket_poll_duration_seconds',
+                                                    'Duration of the requests polling the server for new messages'))
@@ -0,0 +1,218 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+from threading import Thread, Lock, Event, get_ident
+from typing import Callable, Dict, List, Set
+
+
+class StageTimer:
+    """
+    Measures how long the named stages of one scan cycle took
+    """
+
+    def __init__(self):
+        self.durations = {}  # type: Dict[str, float]  # name of the stage: duration in seconds
+        self._lock = Lock()
+
+    def stage(self, name):  # type: (str) -> _Stage
+        """
+        Measures the duration of the with block and adds it to the duration of the stage
+        :param name: name of the stage
+        :return: context manager measuring the time
+        """
+        return _Stage(self, name)
+
+    def add(self, name, duration):  # type: (str, float) -> None
+        """
+        Adds the duration to the stage
+        :param name: name of the stage
+        :param duration: duration in seconds
+        :return: None
+        """
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + duration
+
+
+class _Stage:
+    """
+    Context manager measuring the duration of one stage
+    """
+
+    def __init__(self, timer, name):  # type: (StageTimer, str) -> None
+        self.timer = timer
+        self.name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.timer.add(self.name, time.perf_counter() - self._start)
+
+
+class SamplingProfiler(Thread):
+    """
+    This thread periodically samples the stacks of the watched threads. The samples are cheap enough to be taken
+    during every scan cycle, so they are at hand when some cycle turns out to be slow
+    """
+
+    def __init__(self, interval=0.01, running=None):  # type: (float, Callable[[], bool]) -> None
+        """
+        Initializes the profiler. The sampling itself must be then started by using .start()
+        :param interval: time in seconds between two samples
+        :param running: optional function. When it returns False, the sampling is stopped
+        """
+        Thread.__init__(self, daemon=True)
+        self.interval = interval
+        self.running = running if running is not None else lambda: True
+        self._watched_threads = set()  # type: Set[int]
+        self._stacks = {}  # type: Dict[str, int]  # collapsed stack: number of samples
+        self._sampling = Event()
+        self._lock = Lock()
+
+    def watch_current_thread(self):  # type: () -> None
+        """
+        Adds the calling thread to the sampled threads
+        :return: None
+        """
+        with self._lock:
+            self._watched_threads.add(get_ident())
+
+    def begin(self):  # type: () -> None
+        """
+        Forgets the previous samples and starts sampling
+        :return: None
+        """
+        with self._lock:
+            self._stacks = {}
+        self._sampling.set()
+
+    def end(self):  # type: () -> Dict[str, int]
+        """
+        Stops sampling
+        :return: dictionary of the collapsed stacks (frames from the outermost separated by ";") and their number of
+        samples
+        """
+        self._sampling.clear()
+        with self._lock:
+            return dict(self._stacks)
+
+    def run(self):
+        while self.running():
+            if not self._sampling.wait(1):
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id in self._watched_threads:
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = []  # type: List[str]
+                    while frame is not None:
+                        stack.append('%s (%s:%d)' % (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename),
+                                                     frame.f_code.co_firstlineno))
+                        frame = frame.f_back
+                    collapsed = ';'.join(reversed(stack))
+                    self._stacks[collapsed] = self._stacks.get(collapsed, 0) + 1
+            time.sleep(self.interval)
+
+
+class CycleProfiler:
+    """
+    Profiles the functions called during the scan cycles by cProfile. Every call is profiled separately, so it can be
+    used from many threads at once, and the profiles are merged when dumped
+    """
+
+    def __init__(self):
+        self._profiles = []  # type: List[cProfile.Profile]
+        self._lock = Lock()
+
+    def begin(self):  # type: () -> cProfile.Profile or None
+        """
+        Starts profiling the calling thread
+        :return: the running profile that must be passed to self.end, or None if the thread cannot be profiled
+        because another profiler is already active
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None
+        return profile
+
+    def end(self, profile):  # type: (cProfile.Profile or None) -> None
+        """
+        Stops profiling the calling thread and keeps the profile until the next self.dump
+        :param profile: the profile returned by self.begin
+        :return: None
+        """
+        if profile is None:
+            return
+        profile.disable()
+        with self._lock:
+            self._profiles.append(profile)
+
+    def call(self, function, *args):  # type: (Callable, any) -> any
+        """
+        Calls the function while profiling it
+        :param function: the function to call
+        :param args: arguments passed to the function
+        :return: the value returned by the function
+        """
+        profile = self.begin()
+        try:
+            return function(*args)
+        finally:
+            self.end(profile)
+
+    def dump(self, file_path):  # type: (str) -> bool
+        """
+        Saves the merged profiles in the pstats format, readable by python3 -m pstats or snakeviz, and forgets them
+        :param file_path: path to the saved file
+        :return: True if something was saved, False if nothing was profiled
+        """
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        if len(profiles) == 0:
+            return False
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(file_path)
+        return True
+
+
+def dump_slow_cycle(directory, duration, stages, stacks, keep=20):
+    # type: (str, float, Dict[str, float], Dict[str, int], int) -> str
+    """
+    Saves the data about the slow scan cycle: timings of its stages as JSON and the sampled stacks in the collapsed
+    format used by flamegraph.pl and speedscope. Only the newest dumps are kept, the older ones are deleted
+    :param directory: directory where the files are saved
+    :param duration: duration of the whole cycle in seconds
+    :param stages: dictionary where key is the name of the stage and value its duration in seconds
+    :param stacks: dictionary where key is the collapsed stack and value its number of samples
+    :param keep: how many dumps of slow cycles are kept in the directory, including this one
+    :return: path to the saved files without the extension
+    """
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, 'slow-cycle-%s' % time.strftime('%Y%m%d-%H%M%S'))
+    with open(file_path + '.json', 'w') as f:
+        json.dump({'time': time.time(), 'duration': duration, 'stages': stages,
+                   'hottest_stacks': sorted(stacks.items(), key=lambda stack: -stack[1])[:20]}, f, indent=2)
+    with open(file_path + '.folded', 'w') as f:
+        for stack, samples in stacks.items():
+            f.write('%s %d\n' % (stack, samples))
+    # the names contain the time of the dump, so they are sorted from the oldest
+    dumps = sorted(file_name[:-len('.json')] for file_name in os.listdir(directory)
+                   if file_name.startswith('slow-cycle-') and file_name.endswith('.json'))
+    for dump in dumps[:max(len(dumps) - keep, 0)]:
+        for extension in ('.json', '.folded'):
+            try:
+                os.remove(os.path.join(directory, dump + extension))
+            except FileNotFoundError:
+                pass
+    return file_path
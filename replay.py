@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+from tempfile import NamedTemporaryFile
+from typing import Dict, List, Tuple
+
+import log_manipulator
+
+
+class ReplayReport:
+    """
+    Results of replaying the profiles over a log
+    """
+
+    def __init__(self):
+        self.lines = 0  # number of lines of the log
+        self.bytes = 0  # size of the log in bytes
+        self.seconds = 0.0  # time spent by parsing and finding the offenders
+        self.rule_hits = {}  # type: Dict[str, List[Tuple[str, int]]]  # profile: list of (filter, matched lines)
+        self.bans = []  # type: List[Tuple[float, str, str, int]]  # (time of the ban, IP, profile, attacks of the IP)
+        self.skipped_ips = []  # type: List[str]  # offenders that would not be banned because they are in skipIPs
+
+    def as_dict(self):  # type: () -> dict
+        """
+        Converts the report into a dictionary that can be saved as JSON
+        :return: the dictionary
+        """
+        return {'lines': self.lines, 'bytes': self.bytes, 'seconds': self.seconds,
+                'lines_per_second': self.lines / self.seconds if self.seconds > 0 else None,
+                'rule_hits': {profile: [{'filter': log_filter, 'hits': hits} for log_filter, hits in rule_hits]
+                              for profile, rule_hits in self.rule_hits.items()},
+                'bans': [{'time': ban_time, 'ip': ip, 'profile': profile, 'attacks': attacks}
+                         for ban_time, ip, profile, attacks in self.bans],
+                'skipped_ips': self.skipped_ips}
+
+    def format(self):  # type: () -> str
+        """
+        Formats the report as a human readable text
+        :return: the formatted report
+        """
+        lines = ['replayed %d lines (%.1f MB) in %.2f seconds, %.0f lines/s' %
+                 (self.lines, self.bytes / 1024 / 1024, self.seconds,
+                  self.lines / self.seconds if self.seconds > 0 else 0)]
+        for profile, rule_hits in self.rule_hits.items():
+            lines.append('')
+            lines.append('profile %s:' % profile)
+            for log_filter, hits in rule_hits:
+                lines.append('%10d  %s' % (hits, log_filter))
+        lines.append('')
+        lines.append('%d IPs would be banned:' % len(self.bans))
+        for ban_time, ip, profile, attacks in self.bans:
+            lines.append('%s  %-39s %-12s %d attacks' % (datetime.fromtimestamp(ban_time).strftime('%Y-%m-%d %H:%M:%S'),
+                                                        ip, profile, attacks))
+        if len(self.skipped_ips) > 0:
+            lines.append('')
+            lines.append('not banned because of skipIPs: %s' % ', '.join(self.skipped_ips))
+        return '\n'.join(lines)
+
+
+def find_ban_time(timestamps, max_attempts, scan_range):  # type: (List[float], int, int) -> float or None
+    """
+    Finds the time when the attacker reached the allowed number of attacks in the time range for the first time
+    :param timestamps: times of the attacks of one IP
+    :param max_attempts: number of attacks in the time range that gets the IP banned
+    :param scan_range: the time range in seconds
+    :return: the time of the attack that would get the IP banned or None if the IP would not be banned
+    """
+    timestamps = sorted(timestamps)
+    for i in range(max_attempts - 1, len(timestamps)):
+        if timestamps[i] - timestamps[i - max_attempts + 1] <= scan_range:
+            return timestamps[i]
+    return None
+
+
+def replay_profiles(log_file, profiles):  # type: (str, Dict[str, dict]) -> ReplayReport
+    """
+    Runs the profiles over the log file by the same parser and offender logic the scanner uses, but nothing is
+    blocked or saved
+    :param log_file: path to the log file
+    :param profiles: dictionary. Key is the name of the profile and value are its data
+    :return: the report
+    """
+    report = ReplayReport()
+    report.bytes = os.path.getsize(log_file)
+    banned = {}  # type: Dict[str, Tuple[float, str, int]]  # IP: (time of the ban, profile, attacks of the IP)
+    skipped_ips = set()
+    for profile, profile_data in profiles.items():
+        parser = log_manipulator.LogParser(log_file, profile_data['filters'], reorder_interval=None)
+        start = time.perf_counter()
+        attacks = parser.parse_attacks()
+        offenders = parser.get_habitual_offenders(profile_data['maxAttempts'], profile_data['scanRange'],
+                                                  attacks=attacks)
+        report.seconds += time.perf_counter() - start
+        parser.close()
+        report.lines = max(report.lines, parser.lines_read)
+        report.rule_hits[profile] = [(rule.filter_string, parser.rule_hits.get(rule, 0)) for rule in parser.rules]
+
+        for ip, ip_attacks in offenders.items():
+            if ip == 'NO VALID IP FOUND':
+                continue
+            if ip.strip() in profile_data.get('skipIPs', []):
+                skipped_ips.add(ip)
+                continue
+            ban_time = find_ban_time([attack.timestamp for attack in ip_attacks], profile_data['maxAttempts'],
+                                     profile_data['scanRange'])
+            if ban_time is None:  # offender found by the window of the scan, ban at its last attack
+                ban_time = max(attack.timestamp for attack in ip_attacks)
+            if ip not in banned or banned[ip][0] > ban_time:
+                banned[ip] = (ban_time, profile, len(ip_attacks))
+    report.bans = sorted((ban_time, ip, profile, attacks) for ip, (ban_time, profile, attacks) in banned.items())
+    report.skipped_ips = sorted(skipped_ips)
+    return report
+
+
+def main(argv, profiles, defaults):  # type: (List[str], Dict[str, dict], dict) -> int
+    """
+    Command line interface of the replay
+    :param argv: arguments after the replay command
+    :param profiles: loaded profiles, used when no profiles file is given
+    :param defaults: default values of the profiles loaded from the profiles file
+    :return: exit code
+    """
+    parser = argparse.ArgumentParser(prog='simple-guardian-client replay',
+                                     description='Replays the profiles over the log without blocking anything')
+    parser.add_argument('log', help='log file to replay, - for the standard input')
+    parser.add_argument('--profiles', help='JSON file with profiles to replay instead of the installed profiles')
+    parser.add_argument('--profile', action='append', help='replay only this profile, can be repeated')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    if args.profiles is not None:
+        with open(args.profiles, 'r') as f:
+            profiles = {profile: dict(defaults, **profile_data) for profile, profile_data in json.load(f).items()}
+    if args.profile is not None:
+        profiles = {profile: profile_data for profile, profile_data in profiles.items() if profile in args.profile}
+    if len(profiles) == 0:
+        print('there are no profiles to replay', file=sys.stderr)
+        return 1
+
+    spooled_file = None
+    log_file = args.log
+    if log_file == '-':  # every profile reads the log by its own parser, so the input is saved first
+        spooled_file = NamedTemporaryFile(prefix='sg-replay-', delete=False)
+        shutil.copyfileobj(sys.stdin.buffer, spooled_file)
+        spooled_file.close()
+        log_file = spooled_file.name
+    try:
+        report = replay_profiles(log_file, profiles)
+    finally:
+        if spooled_file is not None:
+            os.remove(spooled_file.name)
+
+    print(json.dumps(report.as_dict(), indent=2) if args.json else report.format())
+    return 0
@@ -4,38 +4,71 @@ try:
     import logging
     import os
     import sqlite3
-    import subprocess
     import sys
     import time
+    from concurrent.futures import ThreadPoolExecutor
     from datetime import date
-    from queue import Queue
-    from threading import Thread, Lock
+    from hashlib import md5
+    from queue import Queue, Empty
+    from threading import Thread, Lock, Event
     from threading import enumerate as threading_enumerate
-    from typing import List, Dict, Set
+    from typing import Iterable, List, Dict, Set, Tuple
 
     import requests
 
+    import database
+    import firewall
     import github_updater
     import log_manipulator
+    import metrics
+    import profiling
+    import replay
     from http_socket_client import HSocket
     from the_runner.the_runner import RESTART_EXIT_CODE, runtime_restart
 finally:
     from the_runner.requirements_updater import RequirementsUpdater, enable_restart_on_runtime
     import os.path
 
-    curr_dir = os.path.dirname(os.path.realpath(__file__))
-    RequirementsUpdater(requirements_file=os.path.join(curr_dir, 'requirements.txt'),
-                        hashes_file=os.path.join(curr_dir, '.requirements.md5')).auto()
-    del curr_dir
-    enable_restart_on_runtime()
+    # the processes parsing the log files in parallel import this file too, but they must not run the program
+    if __name__ == '__main__':
+        curr_dir = os.path.dirname(os.path.realpath(__file__))
+        RequirementsUpdater(requirements_file=os.path.join(curr_dir, 'requirements.txt'),
+                            hashes_file=os.path.join(curr_dir, '.requirements.md5')).auto()
+        del curr_dir
+        enable_restart_on_runtime()
 
 # directory with configuration files
 CONFIG_DIR = os.path.abspath(os.path.join(os.path.abspath(__file__), os.path.pardir, 'data'))
 
 LOGGER_NAME = "SG"  # the name of the logger to use
 PROFILES_DIR = os.path.join(CONFIG_DIR, 'profiles')  # directory with profiles
+PROFILING_DIR = os.path.join(CONFIG_DIR, 'profiling')  # directory with dumped profiles of the scan cycles
+PROFILING_REQUEST_FILE = os.path.join(PROFILING_DIR, 'request')  # number of cycles to profile asked by the client
 CONFIG = {
     "scanTime": 60,
+    "scanWorkers": 4,  # how many log files can be scanned in parallel
+    "backfillWorkers": None,  # how many processes parse a big log file read from the beginning, None means all CPUs
+    "readBufferSize": 1048576,  # size in bytes of the blocks in which are the log files read
+    "maxOpenLogFiles": 256,  # how many files matched by a glob or directory logFile are kept open by one profile
+    "profilesWatchTime": 10,  # how often in seconds are the profile files checked for changes, None disables it
+    "blockerCommand": "./blocker",  # path to the executable that blocks the IPs
+    "blockerDaemon": True,  # if True, the blocker runs as one helper taking the commands over a Unix socket
+    "firewall": {
+        "backend": "blocker",  # "blocker" blocks by ipset and iptables through the blocker executable, or "nftables"
+        "nftCommand": "nft",  # command line executing nft, it needs CAP_NET_ADMIN, eg. "sudo -n nft"
+        "nftTable": "simpleguardian"  # nftables table with the sets of the blocked IPs and the chain dropping them
+    },
+    "metrics": {
+        "listen": None,  # "host:port" where the metrics are served over HTTP, None disables the endpoint
+        "textfile": None,  # path to the file the metrics are periodically written into, None disables it
+        "textfileInterval": 15  # how often in seconds is the textfile written
+    },
+    "profiling": {
+        "cycles": 0,  # how many scan cycles after the start are profiled by cProfile
+        "slowCycleSeconds": None,  # scan cycles taking longer are dumped with their sampled stacks, None disables it
+        "sampleInterval": 0.01,  # time in seconds between two samples of the stacks of the scanning threads
+        "slowCycleDumps": 20  # how many dumps of the slow cycles are kept, the older ones are deleted
+    },
     "updater": {
         "githubOwner": "esoadamo",
         "githubRepo": "simple-guardian",
@@ -48,7 +81,9 @@ CONFIG = {
             '127.0.0.1',
             '::1'
         ],
-        "unblockMinutes": None  # setting to None makes the IP to never be unblocked, number is in minutes
+        "unblockMinutes": None,  # setting to None makes the IP to never be unblocked, number is in minutes
+        "backfillRotated": False,  # if True, attacks from rotated (and compressed) logs are loaded in background
+        "keepVariables": []  # variables kept with the attacks besides their time and user, eg. HOSTNAME or PORT
     }
 }  # dictionary with loaded config in main()
 ONLINE_DATA = {'loggedIn': False,
@@ -56,6 +91,8 @@ ONLINE_DATA = {'loggedIn': False,
                }  # type: Dict[str, any] # data about the online server,
 PROFILES = {}  # type: {str: dict}
 PROFILES_LOCK = Lock()  # lock used when manipulating with profiles in async
+PROFILES_FILES_HASH = None  # type: str or None  # hash of the profile files the PROFILES were loaded from
+DISCARDED_PARSERS = []  # type: List[log_manipulator.LogParser]  # parsers of changed profiles, closed by the scanner
 VERSION_TAG = "2.1"  # tag of current version
 
 
@@ -66,51 +103,53 @@ class Database:
     queue_in = Queue()  # operations to perform
     queue_out = Queue()  # data to return
     db_lock = Lock()
+    readers = None  # type: database.ReaderPool  # read-only connections for queries that do not modify anything
+    ready = Event()  # set when the database schema is ready and readers can be used
+    ready_timeout = 60  # seconds to wait for the database to become ready before a read fails
+    writers = []  # type: List[Thread]  # threads finishing their writes after the program stops, they are waited for
 
     @staticmethod
-    def init(file_path):  # type: (str) -> None
+    def init(file_path, readers_count=4):  # type: (str, int) -> None
         """
         Initialize the static database
         :param file_path: path to the saved file with database
+        :param readers_count: maximum number of read-only connections serving the queries in parallel with the writer
         :return: None
         """
+        Database.readers = database.ReaderPool(file_path, readers_count)
+        metrics.DB_QUEUE_DEPTH.function = Database.queue_in.qsize
 
         class ThreadDatabase(Thread):
             """
-            This thread runs in background and performs all operations with the database if needed
+            This thread runs in background and performs all write operations with the database
             Creates new database if not exists yet
             """
 
             def run(self):
                 connection = sqlite3.connect(file_path)
-
-                # create the database schema if not exists yet
-                connection.execute('CREATE TABLE IF NOT EXISTS "bans" ('
-                                   '`id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,'
-                                   '`time` INTEGER NOT NULL,'
-                                   '`ip` TEXT NOT NULL);')
-                connection.execute('CREATE TABLE IF NOT EXISTS "attacks" ('
-                                   '`id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,'
-                                   '`time` INTEGER NOT NULL,'
-                                   '`ip` TEXT NOT NULL,'
-                                   '`profile` TEXT NOT NULL,'
-                                   '`user` TEXT,'
-                                   '`data` INTEGER NOT NULL);')
-
-                while AppRunning.is_running():
-                    if not Database.queue_in.empty():
-                        data = Database.queue_in.get()  # type: dict
-                        # the present key determines what time of data this is
-                        if 'sql' in data:  # perform SQL query
-                            db_respond = list(connection.execute(data['sql'], data['param']))
-                        elif 'commit' in data:  # commit the saved data
-                            connection.commit()
-                            db_respond = True
-                        else:  # not sure what to do, just respond None
-                            db_respond = None
-                        # return responded object
-                        Database.queue_out.put(db_respond)
-                    AppRunning.sleep_while_running(0.1)
+                # in the WAL mode the readers do not block the writer and the writer does not block the readers
+                connection.execute('PRAGMA journal_mode = WAL')
+                connection.execute('PRAGMA synchronous = NORMAL')
+                storage = database.AttackStorage(connection)  # creates the database schema if not exists yet
+                Database.ready.set()
+
+                while AppRunning.is_running() or any(writer.is_alive() for writer in Database.writers):
+                    try:
+                        data = Database.queue_in.get(timeout=0.1)  # type: dict
+                    except Empty:
+                        continue
+                    # the present key determines what time of data this is
+                    if 'sql' in data:  # perform SQL query
+                        db_respond = list(connection.execute(data['sql'], data['param']))
+                    elif 'storage' in data:  # call a method of the attack storage
+                        db_respond = getattr(storage, data['storage'])(*data['param'])
+                    elif 'commit' in data:  # commit the saved data
+                        connection.commit()
+                        db_respond = True
+                    else:  # not sure what to do, just respond None
+                        db_respond = None
+                    # return responded object
+                    Database.queue_out.put(db_respond)
 
         # start the background thread with database connection
         ThreadDatabase().start()
@@ -123,10 +162,41 @@ class Database:
         :param data: tuple of data that are safely entered into the SQL command to prevent SQL injection
         :return: list of returned rows
         """
-        Database.db_lock.acquire()
-        Database.queue_in.put({'sql': command, 'param': data})
-        respond = Database.queue_out.get()  # type: list
-        Database.db_lock.release()
+        with metrics.DB_QUERY_DURATION.time(kind='execute'):
+            Database.db_lock.acquire()
+            Database.queue_in.put({'sql': command, 'param': data})
+            respond = Database.queue_out.get()  # type: list
+            Database.db_lock.release()
+        return respond
+
+    @staticmethod
+    def read(command, data=()):  # type: (str, tuple) -> list
+        """
+        Executes the read-only command on database using one of the reader connections, so it does not have to wait
+        for the writes in progress. Uncommitted changes made by Database.execute are not visible to this command
+        :param command: SQL command to be executed
+        :param data: tuple of data that are safely entered into the SQL command to prevent SQL injection
+        :return: list of returned rows
+        :raise TimeoutError: if the database does not become ready in Database.ready_timeout seconds
+        """
+        if not Database.ready.wait(Database.ready_timeout):
+            raise TimeoutError('the database is not ready after %d seconds' % Database.ready_timeout)
+        with metrics.DB_QUERY_DURATION.time(kind='read'):
+            return Database.readers.execute(command, data)
+
+    @staticmethod
+    def storage(method, *args):  # type: (str, any) -> any
+        """
+        Calls the method of the database.AttackStorage that manages the attacks saved in the database
+        :param method: name of the method to call
+        :param args: arguments passed to the method
+        :return: the value returned by the method
+        """
+        with metrics.DB_QUERY_DURATION.time(kind=method):
+            Database.db_lock.acquire()
+            Database.queue_in.put({'storage': method, 'param': args})
+            respond = Database.queue_out.get()
+            Database.db_lock.release()
         return respond
 
     @staticmethod
@@ -138,8 +208,8 @@ class Database:
         :param data: tuple of data that are safely entered into the SQL command to prevent SQL injection
         :return: list of rows, rows are dictionaries where keys are names of columns
         """
-        columns = [column_data[1] for column_data in Database.execute("PRAGMA table_info(%s)" % table)]
-        records = Database.execute(command, data)
+        columns = [column_data[1] for column_data in Database.read("PRAGMA table_info(%s)" % table)]
+        records = Database.read(command, data)
         return [{columns[i]: value for i, value in enumerate(record)} for record in records]
 
     @staticmethod
@@ -148,10 +218,11 @@ class Database:
         Commits the databse to the disc
         :return: None
         """
-        Database.db_lock.acquire()
-        Database.queue_in.put({'commit': True})
-        respond = Database.queue_out.get()
-        Database.db_lock.release()
+        with metrics.DB_QUERY_DURATION.time(kind='commit'):
+            Database.db_lock.acquire()
+            Database.queue_in.put({'commit': True})
+            respond = Database.queue_out.get()
+            Database.db_lock.release()
         return respond
 
 
@@ -210,20 +281,58 @@ class IPBlocker:
     """
     Blocks/unblocks IPs
     """
-    block_command_path = './blocker'  # path to the executable that blocks the IPs
+    banned_ips = set()  # type: Set[str]  # IPs banned in the database, their log lines are dropped by the parsers
+    backend = None  # type: firewall.FirewallBackend or None  # backend changing the firewall
+
+    @classmethod
+    def create_backend(cls, use_daemon=False):  # type: (bool) -> firewall.FirewallBackend
+        """
+        Creates the firewall backend selected in the config
+        :param use_daemon: if set to True, the blocker backend starts the blocker as a helper if enabled
+        :return: the backend
+        """
+        logger = logging.getLogger(LOGGER_NAME)
+        if CONFIG['firewall']['backend'] == 'nftables':
+            return firewall.NftablesBackend(CONFIG['firewall']['nftCommand'], CONFIG['firewall']['nftTable'], logger)
+        socket_path = os.path.join(CONFIG_DIR, 'blocker.sock') if use_daemon and CONFIG['blockerDaemon'] else None
+        return firewall.BlockerBackend(CONFIG['blockerCommand'], socket_path, logger)
 
     @classmethod
     def init(cls):  # type: () -> bool
         """
-        Initializes blocker for blocking IPs
+        Initializes the firewall backend for blocking IPs
         :return: True if init was successful, else otherwise
         """
-        return subprocess.run([cls.block_command_path, 'init']).returncode == 0
+        cls.backend = cls.create_backend(use_daemon=True)
+        return cls.backend.init()
+
+    @classmethod
+    def call_blocker(cls, action, ips, timeouts=None):
+        # type: (str, List[str], Dict[str, float] or None) -> Set[str]
+        """
+        Blocks or unblocks the IPs by the firewall backend, all at once
+        :param action: block or unblock
+        :param ips: the IPs to block or unblock
+        :param timeouts: optional dictionary where key is the blocked IP and value is the time in seconds after which
+        the firewall unblocks it itself
+        :return: set of the IPs that were blocked or unblocked successfully
+        """
+        if cls.backend is None:  # eg. the client command, the firewall was already initialized by the service
+            cls.backend = cls.create_backend()
+        with metrics.BLOCKER_DURATION.time(action=action):
+            blocked, unblocked = cls.backend.apply(ips if action == 'block' else [], ips if action == 'unblock' else [],
+                                                   timeouts)
+        done = blocked if action == 'block' else unblocked
+        for ip in ips:
+            if ip not in done:
+                metrics.BLOCKER_FAILURES.inc(action=action)
+                logging.getLogger(LOGGER_NAME).error('%sing "%s" failed' % (action, ip))
+        return done
 
     @staticmethod
     def list_blocked_ips():  # type: () -> Set[str]
         """
-        Lists the blocked IPs from database
+        Lists the blocked IPs from database. The writer connection is used, so the bans not committed yet are listed
         :return: set of the blocked IPs
         """
         return {record[0] for record in Database.execute('SELECT ip FROM bans')}
@@ -233,7 +342,7 @@ class IPBlocker:
         """
         Tests if the IP is blocked
         :param ip: the IP to test
-        :return: True if the IP is stated as blocked in the database, False otherwise
+        :return: True if the IP is stated as blocked in the database, including the bans not committed yet
         """
         return Database.execute('SELECT COUNT(*) FROM bans WHERE ip = ?', (ip,))[0][0] != 0
 
@@ -244,7 +353,12 @@ class IPBlocker:
         Useful during the startup of this program
         :return: None
         """
-        [cls.block(ip, commit_db=False, use_db=False) for ip in cls.list_blocked_ips()]
+        bans = Database.read('SELECT ip, time FROM bans')
+        cls.banned_ips = {ip for ip, _ in bans}
+        timeouts = None  # type: Dict[str, float] or None
+        if CONFIG["defaults"]["unblockMinutes"] is not None:  # the firewall unblocks them when their time is up
+            timeouts = {ip: ban_time + CONFIG["defaults"]["unblockMinutes"] * 60 - time.time() for ip, ban_time in bans}
+        cls.block_many(cls.banned_ips, commit_db=False, use_db=False, timeouts=timeouts)
 
     @classmethod
     def block(cls, ip, commit_db=True, use_db=True):  # type: (str, bool, bool) -> bool
@@ -255,19 +369,42 @@ class IPBlocker:
         :param use_db:  if set to True, the IP will be marked as blocked id database
         :return: True if blocking was successful, False if already blocked
         """
-        if use_db and cls.ip_is_blocked(ip):
-            return False
-        if ip.strip() in CONFIG["defaults"]["skipIPs"]:
-            logging.getLogger(LOGGER_NAME).warning('blocking "%s" is not allowed' % ip)
-            return False
-        if subprocess.run([cls.block_command_path, 'block', ip]).returncode != 0:
-            logging.getLogger(LOGGER_NAME).error('blocking "%s" failed' % ip)
-            return False
-        if use_db:
-            Database.execute('INSERT INTO `bans`(`time`,`ip`) VALUES (?,?);', (time.time(), ip))
+        return ip in cls.block_many([ip], commit_db, use_db)
+
+    @classmethod
+    def block_many(cls, ips, commit_db=True, use_db=True, timeouts=None):
+        # type: (Iterable[str], bool, bool, Dict[str, float] or None) -> Set[str]
+        """
+        States the IPs as blocked in database if enabled and blocks their access to this server, all by one call of
+        the firewall backend
+        :param ips: IPs to block
+        :param commit_db: if set to True, the database will be saved to disc after query
+        :param use_db:  if set to True, the IPs will be marked as blocked id database
+        :param timeouts: optional dictionary where key is the IP and value is the time in seconds after which the
+        firewall unblocks it itself. Default is unblockMinutes for the IPs stored in database, IPs not stored in
+        database are never unblocked by the firewall, as nothing would block them again
+        :return: set of the IPs that were blocked, without the failed and already blocked IPs
+        """
+        blocked_ips = []  # type: List[str]
+        for ip in ips:
+            if use_db and (ip in cls.banned_ips or cls.ip_is_blocked(ip)):
+                continue
+            if ip.strip() in CONFIG["defaults"]["skipIPs"]:
+                logging.getLogger(LOGGER_NAME).warning('blocking "%s" is not allowed' % ip)
+                continue
+            blocked_ips.append(ip)
+        if len(blocked_ips) == 0:
+            return set()
+        if timeouts is None and use_db and CONFIG["defaults"]["unblockMinutes"] is not None:
+            timeouts = {ip: CONFIG["defaults"]["unblockMinutes"] * 60 for ip in blocked_ips}
+        blocked = cls.call_blocker('block', blocked_ips, timeouts)
+        if use_db and len(blocked) > 0:
+            for ip in blocked:
+                Database.execute('INSERT INTO `bans`(`time`,`ip`) VALUES (?,?);', (time.time(), ip))
+            cls.banned_ips = cls.banned_ips | blocked  # replaced, not changed, as the parsers may be iterating it
             if commit_db:
                 Database.commit()
-        return True
+        return blocked
 
     @classmethod
     def unblock(cls, ip, commit_db=True, use_db=True):  # type: (str, bool, bool) -> bool
@@ -278,16 +415,28 @@ class IPBlocker:
         :param use_db:  if set to True, the IP will be marked as unblocked in database
         :return: True if unblock was successful, False if the IP is not blocked
         """
-        if use_db and not cls.ip_is_blocked(ip):
-            return False
-        if subprocess.run([cls.block_command_path, 'unblock', ip]).returncode != 0:
-            logging.getLogger().error('unblocking "%s" failed' % ip)
-            return False
-        if use_db:
-            Database.execute('DELETE FROM bans WHERE ip = ?', (ip,))
+        return ip in cls.unblock_many([ip], commit_db, use_db)
+
+    @classmethod
+    def unblock_many(cls, ips, commit_db=True, use_db=True):  # type: (Iterable[str], bool, bool) -> Set[str]
+        """
+        Unblocks already blocked IPs, all by one call of the firewall backend
+        :param ips: blocked IPs to unblock
+        :param commit_db: if set to True, the database will be saved to disc after query
+        :param use_db:  if set to True, the IPs will be marked as unblocked in database
+        :return: set of the IPs that were unblocked, without the failed and not blocked IPs
+        """
+        unblocked_ips = [ip for ip in ips if not use_db or cls.ip_is_blocked(ip)]
+        if len(unblocked_ips) == 0:
+            return set()
+        unblocked = cls.call_blocker('unblock', unblocked_ips)
+        if use_db and len(unblocked) > 0:
+            for ip in unblocked:
+                Database.execute('DELETE FROM bans WHERE ip = ?', (ip,))
+            cls.banned_ips = cls.banned_ips - unblocked
             if commit_db:
                 Database.commit()
-        return True
+        return unblocked
 
 
 class FederationBlocklist:
@@ -304,8 +453,8 @@ class FederationBlocklist:
         :param ips: set of IP addresses
         :return: None
         """
-        [IPBlocker.unblock(ip, False, False) for ip in cls.blocked_ips.difference(ips)]
-        [IPBlocker.block(ip, False, False) for ip in ips.difference(cls.blocked_ips)]
+        IPBlocker.unblock_many(cls.blocked_ips.difference(ips), False, False)
+        IPBlocker.block_many(ips.difference(cls.blocked_ips), False, False)
         cls.blocked_ips = ips
 
 
@@ -314,84 +463,394 @@ class ThreadScanner(Thread):
     This thread performs the scanning of the logs, looking for attacks and blocking
     """
 
+    @staticmethod
+    def scan_log_file(profiles, new_parsers=frozenset(), sampler=None, profiler=None):
+        # type: (Dict[str, dict], set, profiling.SamplingProfiler, profiling.CycleProfiler) -> Dict[str, tuple]
+        """
+        Parses attacks of all profiles that read the same log file. Runs inside the worker pool. New parsers read only
+        the tail of the log file within twice the scan range of the profile, the older lines cannot make an offender
+        :param profiles: dictionary. Key is the name of the profile and value are its data with a linked parser
+        :param new_parsers: parsers created for this scan. Most of a big log file they read from the beginning is left
+        for ThreadBackfill, so the scan is not delayed by it
+        :param sampler: optional sampling profiler that samples the stacks of the worker
+        :param profiler: optional profiler that profiles the parsing
+        :return: dictionary. Key is the name of the profile, value is tuple (all attacks cached by its parser, attacks
+        that were not returned by the parser before)
+        """
+        if sampler is not None:
+            sampler.watch_current_thread()
+        attacks = {}
+        banned_ips = IPBlocker.banned_ips  # lines of already banned IPs are not turned into attacks
+        for profile, profile_data in profiles.items():
+            # offenders are blocked as soon as they are found, the rest of the new lines is not waited for
+            profile_data['parser'].watch_offenders(profile_data['maxAttempts'], profile_data['scanRange'],
+                                                   ThreadBlocker.submit)
+            parse_attacks = profile_data['parser'].parse_attacks
+            new_attacks = {}  # type: Dict[str, List[log_manipulator.Attack]]
+            defer_backfill = profile_data['parser'] in new_parsers
+            try:
+                if profiler is not None:
+                    profile_attacks = profiler.call(parse_attacks, profile_data['scanRange'] * 2, False, banned_ips,
+                                                    new_attacks, defer_backfill)
+                else:
+                    profile_attacks = parse_attacks(max_age=profile_data['scanRange'] * 2, banned_ips=banned_ips,
+                                                    new_attacks=new_attacks, defer_backfill=defer_backfill)
+            except FileNotFoundError:
+                continue
+            attacks[profile] = (profile_attacks, new_attacks)
+        return attacks
+
     def run(self):
         logger = logging.getLogger(LOGGER_NAME)
-        first_load = True
+        # the log files are scanned in parallel, profiles reading the same file are scanned by the same worker
+        executor = ThreadPoolExecutor(max_workers=CONFIG['scanWorkers'])
+        # slow cycles can be explained only if their stacks were sampled while they were running
+        sampler = None  # type: profiling.SamplingProfiler or None
+        if CONFIG['profiling']['slowCycleSeconds'] is not None:
+            sampler = profiling.SamplingProfiler(CONFIG['profiling']['sampleInterval'], AppRunning.is_running)
+            sampler.watch_current_thread()
+            sampler.start()
+        cycle_profiler = profiling.CycleProfiler()
+        profiled_cycles = CONFIG['profiling']['cycles']
         while AppRunning.is_running():
             time_scan_start = time.time()
-            commit_db = False
-            
+            stages = profiling.StageTimer()
+            profiled_cycles += take_profiling_request()
+            profiler = cycle_profiler if profiled_cycles > 0 else None
+            scanner_profile = profiler.begin() if profiler is not None else None
+            if sampler is not None:
+                sampler.begin()
+
             logger.info('scanning for attacks')
             if CONFIG["defaults"]["unblockMinutes"] is not None:
-                unblock_time = int(time.time() - (CONFIG["defaults"]["unblockMinutes"] * 60))
-                for record in Database.execute('SELECT ip FROM bans WHERE time < ?', (unblock_time,)):
-                    ip = record[0]
-                    logger.info('removing %s from jail' % ip)
-                    IPBlocker.unblock(ip)
-                    commit_db = True
+                with stages.stage('unblock'):
+                    unblock_time = int(time.time() - (CONFIG["defaults"]["unblockMinutes"] * 60))
+                    expired_ips = [record[0] for record in
+                                   Database.execute('SELECT ip FROM bans WHERE time < ?', (unblock_time,))]
+                    for ip in expired_ips:
+                        logger.info('removing %s from jail' % ip)
+                    IPBlocker.unblock_many(expired_ips)
+            # the IPs can be unblocked also by the client command running in another process
+            IPBlocker.banned_ips = IPBlocker.list_blocked_ips()
 
             PROFILES_LOCK.acquire()
             profiles_copy = dict(PROFILES)
+            discarded_parsers = list(DISCARDED_PARSERS)
+            DISCARDED_PARSERS.clear()
             PROFILES_LOCK.release()
+            for parser in discarded_parsers:  # profiles were reloaded and these parsers are not needed anymore
+                parser.close()
 
+            profiles_by_log_file = {}  # type: Dict[str, Dict[str, dict]]
+            backfilled_parsers = []  # type: List[(log_manipulator.LogParser, float, bool)]  # the new parsers
             for profile, profile_data in profiles_copy.items():
+                if 'journal' in profile_data:  # entries of the systemd journal are read instead of the log file
+                    source_key = 'journal:' + json.dumps(profile_data['journal'], sort_keys=True)
+                else:
+                    source_key = profile_data['logFile']
                 if 'parser' not in profile_data:  # link the parser with the profile
-                    profile_data['parser'] = log_manipulator.LogParser(profile_data['logFile'], profile_data['filters'],
-                                                                       logger=logger)
+                    if 'journal' in profile_data:
+                        source = log_manipulator.JournalSource(profile_data['journal'],
+                                                               os.path.join(CONFIG_DIR, 'checkpoints',
+                                                                            profile + '.cursor'),
+                                                               logger)
+                    else:
+                        source = profile_data['logFile']
+                    profile_data['parser'] = log_manipulator.LogParser(source, profile_data['filters'],
+                                                                       logger=logger,
+                                                                       backfill_workers=CONFIG['backfillWorkers'],
+                                                                       buffer_size=CONFIG['readBufferSize'],
+                                                                       max_open_files=CONFIG['maxOpenLogFiles'],
+                                                                       keep_variables=profile_data['keepVariables'])
                     PROFILES_LOCK.acquire()
-                    if profile in PROFILES:  # propagate the change into upcoming scans
-                        PROFILES[profile]['parser'] = profile_data['parser']
+                    current_data = PROFILES.get(profile)
+                    if current_data is not None and 'parser' not in current_data and \
+                            profile_parser_key(current_data) == profile_parser_key(profile_data):
+                        current_data['parser'] = profile_data['parser']  # propagate the change into upcoming scans
+                    elif current_data is None or current_data.get('parser') is not profile_data['parser']:
+                        # profiles were reloaded meanwhile and the profile has changed
+                        DISCARDED_PARSERS.append(profile_data['parser'])
                     PROFILES_LOCK.release()
-
-                try:
-                    attacks = profile_data['parser'].parse_attacks(max_age=profile_data['scanRange'] * 2,
-                                                                   skip_scanning=first_load)
-                except FileNotFoundError:
-                    continue
-
-                # times of parsed attacks. Every time is unique identification key, if two attacks were made at the same
-                # timestamp, then a millisecond is added to one of them to ensure the uniqueness
-                known_attack_timestamps = []  # type: List[int]
-
-                for ip, ip_attacks in attacks.items():  # IP and list of IP's attacks
-                    for i, attack_data in enumerate(ip_attacks):
+                    backfilled_parsers.append((profile_data['parser'], profile_data['scanRange'] * 2,
+                                               profile_data['backfillRotated']))
+                profiles_by_log_file.setdefault(source_key, {})[profile] = profile_data
+
+            # merge attacks parsed by all workers before saving them and blocking the offenders
+            scanned_attacks = {}  # type: Dict[str, tuple]
+            new_parsers = {parser for parser, _, _ in backfilled_parsers}
+            with stages.stage('parse'):
+                for file_attacks in executor.map(lambda profiles: self.scan_log_file(profiles, new_parsers, sampler,
+                                                                                     profiler),
+                                                 profiles_by_log_file.values()):
+                    scanned_attacks.update(file_attacks)
+
+            if len(backfilled_parsers) > 0:
+                # the content left by the first scan of new parsers is parsed after it, so the scan is not delayed
+                ThreadBackfill(backfilled_parsers).start()
+
+            # the offenders are blocked and the attacks saved by their own threads, so the scanner does not wait for
+            # the blocker nor for the database and the offenders of every profile are blocked right after detection
+            for profile, (attacks, new_attacks) in scanned_attacks.items():
+                profile_data = profiles_copy[profile]
+                time_store_start = time.perf_counter()
+
+                # only the attacks parsed since the last scan are saved, their timestamps were already made unique by the
+                # parser, as every timestamp is unique identification key of the attack
+                records = []  # type: List[Tuple[str, dict, str]]
+
+                for ip, ip_attacks in new_attacks.items():  # IP and list of IP's attacks
+                    for attack in ip_attacks:
                         if ip == 'NO VALID IP FOUND':
-                            logger.warning('No valid IP could be found inside "%s"' % attack_data['IP-RAW'])
+                            logger.warning('No valid IP could be found inside "%s"' % attack.extra['IP-RAW'])
                             continue
+                        records.append((ip, attack.as_dict(), profile))
 
-                        # TIMESTAMP must be unique
-                        while attack_data['TIMESTAMP'] in known_attack_timestamps:
-                            attack_data['TIMESTAMP'] += 1
-                        known_attack_timestamps.append(attack_data['TIMESTAMP'])
-                        attacks[ip][i].update(attack_data)
-
-                        # Check if this attack already exists in our database and if not add it and set the db to
-                        # save to disc after everything is added
-                        if Database.execute('SELECT COUNT(*) FROM attacks WHERE ip = ? AND time = ? AND profile = ?',
-                                            (ip, attack_data['TIMESTAMP'], profile))[0][0] == 0:
-                            Database.execute('INSERT INTO `attacks`(`time`,`ip`,`data`,`profile`,`user`) '
-                                             'VALUES (?,?,?,?,?);',
-                                             (attack_data['TIMESTAMP'], ip, json.dumps(attack_data), profile,
-                                              attack_data['USER'] if 'USER' in attack_data else None))
-                            commit_db = True
+                stages.add('store', time.perf_counter() - time_store_start)
 
                 # get the offenders who shall be blocked
-                offenders = profile_data['parser'].get_habitual_offenders(profile_data['maxAttempts'],
-                                                                          profile_data['scanRange'],
-                                                                          attacks=attacks,
-                                                                          first_load=first_load)
-                for offender_ip in offenders.keys():  # block their IPs
-                    if offender_ip == 'NO VALID IP FOUND':
-                        logger.warning('Cannot block IP because the IP is invalid')
-                        continue
-                    if IPBlocker.block(offender_ip, commit_db=False):
-                        # do not commit the DB now, commit only after everyone is blocked
-                        commit_db = True
-            if commit_db:
-                Database.commit()
-            logger.info('scanning for attacks completed, took %.1f seconds' % (time.time() - time_scan_start))
-            first_load = False
+                with stages.stage('offenders'):
+                    offenders = profile_data['parser'].get_habitual_offenders(profile_data['maxAttempts'],
+                                                                              profile_data['scanRange'],
+                                                                              attacks=attacks)
+                with stages.stage('block'):
+                    for offender_ip in offenders.keys():
+                        if offender_ip == 'NO VALID IP FOUND':
+                            logger.warning('Cannot block IP because the IP is invalid')
+                            continue
+                        ThreadBlocker.submit(offender_ip)
+                if len(records) > 0:
+                    with stages.stage('store'):
+                        ThreadPersister.submit(records)
+            scan_duration = time.time() - time_scan_start
+            logger.info('scanning for attacks completed, took %.1f seconds' % scan_duration)
+            logger.debug('scan stages took ' + ', '.join('%s %.3fs' % stage for stage in stages.durations.items()))
+            metrics.SCAN_DURATION.observe(scan_duration)
+
+            if profiler is not None:
+                profiler.end(scanner_profile)
+                profiled_cycles -= 1
+                if profiled_cycles == 0:  # all requested cycles were profiled, save the profile
+                    os.makedirs(PROFILING_DIR, exist_ok=True)
+                    profile_file = os.path.join(PROFILING_DIR, 'cycles-%s.pstats' % time.strftime('%Y%m%d-%H%M%S'))
+                    if cycle_profiler.dump(profile_file):
+                        logger.info('profile of the scan cycles saved to %s' % profile_file)
+            if sampler is not None:
+                stacks = sampler.end()
+                if scan_duration >= CONFIG['profiling']['slowCycleSeconds']:
+                    dump_file = profiling.dump_slow_cycle(PROFILING_DIR, scan_duration, stages.durations, stacks,
+                                                          CONFIG['profiling']['slowCycleDumps'])
+                    logger.warning('scan cycle was slow, its stages and stacks were saved to %s' % dump_file)
             AppRunning.sleep_while_running(CONFIG['scanTime'])
+        executor.shutdown()
+        PROFILES_LOCK.acquire()
+        for profile_data in PROFILES.values():  # close the followed log files
+            if 'parser' in profile_data:
+                profile_data['parser'].close()
+        for parser in DISCARDED_PARSERS:
+            parser.close()
+        DISCARDED_PARSERS.clear()
+        PROFILES_LOCK.release()
+
+
+class ThreadBlocker(Thread):
+    """
+    This thread blocks the offenders found by the scanner, so slow calls of the blocker do not delay the scanning
+    """
+    queue = Queue(maxsize=10000)  # IPs to block
+    pending = set()  # type: Set[str]  # IPs in the queue or being blocked
+    pending_lock = Lock()
+
+    def __init__(self, producers=()):  # type: (Iterable[Thread]) -> None
+        """
+        Initializes the thread. The blocking itself must be then started by using .start()
+        :param producers: threads submitting the IPs. After the program stops, the blocking continues until they end
+        and then all waiting IPs are blocked
+        """
+        Thread.__init__(self, daemon=True)
+        self.producers = list(producers)
+        metrics.BLOCK_QUEUE_DEPTH.function = self.queue.qsize
+
+    @classmethod
+    def submit(cls, ip):  # type: (str) -> None
+        """
+        Adds the IP to the queue of blocked IPs unless it is already banned or waiting. Waits if the queue is full
+        :param ip: the IP to block
+        :return: None
+        """
+        with cls.pending_lock:
+            if ip in cls.pending or ip in IPBlocker.banned_ips:
+                return
+            cls.pending.add(ip)
+        cls.queue.put(ip)
+
+    def run(self):
+        while AppRunning.is_running() or any(producer.is_alive() for producer in self.producers):
+            try:
+                ips = [self.queue.get(timeout=0.1)]
+            except Empty:
+                continue
+            self.block(ips)
+        self.block([])  # the offenders found by the last scan are not lost
+
+    def block(self, ips):  # type: (List[str]) -> None
+        """
+        Blocks the IPs together with all IPs waiting in the queue
+        :param ips: IPs already taken from the queue
+        :return: None
+        """
+        while True:
+            try:
+                ips.append(self.queue.get_nowait())
+            except Empty:
+                break
+        if len(ips) == 0:
+            return
+        # everyone waiting is blocked by one call of the blocker and the DB is committed once for all of them
+        if len(IPBlocker.block_many(ips, commit_db=False)) > 0:
+            Database.commit()
+        with self.pending_lock:
+            self.pending.difference_update(ips)
+
+
+class ThreadPersister(Thread):
+    """
+    This thread saves the attacks found by the scanner into the database in batches, each batch in one transaction
+    """
+    queue = Queue(maxsize=64)  # lists of (IP, attack data, profile) to save
+
+    def __init__(self, batch_size=5000, producers=()):  # type: (int, Iterable[Thread]) -> None
+        """
+        Initializes the thread. The saving itself must be then started by using .start()
+        :param batch_size: the waiting lists are merged into one transaction until it has at least this many attacks
+        :param producers: threads submitting the attacks. After the program stops, the saving continues until they end
+        and then all waiting attacks are saved
+        """
+        Thread.__init__(self, daemon=True)
+        self.batch_size = batch_size
+        self.producers = list(producers)
+        metrics.PERSIST_QUEUE_DEPTH.function = self.queue.qsize
+
+    @classmethod
+    def submit(cls, records):  # type: (List[Tuple[str, dict, str]]) -> None
+        """
+        Adds the attacks to the queue of saved attacks. Waits if the queue is full
+        :param records: list of tuples (IP of the attacker, attack data, name of the profile)
+        :return: None
+        """
+        cls.queue.put(records)
+
+    def run(self):
+        while AppRunning.is_running() or any(producer.is_alive() for producer in self.producers):
+            try:
+                records = list(self.queue.get(timeout=0.1))
+            except Empty:
+                continue
+            self.save(records)
+        while not self.queue.empty():  # the attacks found by the last scan are not lost
+            self.save([])
+
+    def save(self, records):  # type: (List[Tuple[str, dict, str]]) -> None
+        """
+        Saves the attacks together with the attacks waiting in the queue, up to the batch size, in one transaction
+        :param records: attacks already taken from the queue
+        :return: None
+        """
+        while len(records) < self.batch_size:
+            try:
+                records += self.queue.get_nowait()
+            except Empty:
+                break
+        if len(records) > 0 and Database.storage('insert_new', records) > 0:
+            Database.commit()
+
+
+class ThreadBackfill(Thread):
+    """
+    This thread loads the attacks from the beginning of big log files read by new parsers (in a pool of processes) and
+    from the history of the log files (rotated and compressed logs) in background, so the live scanning is never
+    delayed by it
+    """
+
+    def __init__(self, parsers):  # type: (List[(log_manipulator.LogParser, float, bool)]) -> None
+        """
+        Initializes the thread. The backfill itself must be then started by using .start()
+        :param parsers: list of tuples (parser, max age of the loaded attacks in seconds, True if also the history
+        shall be loaded)
+        """
+        Thread.__init__(self)
+        self.parsers = parsers
+
+    def run(self):
+        for parser, max_age, _ in self.parsers:  # the recent content first
+            if not AppRunning.is_running():
+                return
+            parser.backfill_chunks(max_age, IPBlocker.banned_ips)
+        for parser, max_age, load_history in self.parsers:
+            if not AppRunning.is_running():
+                return
+            if load_history:
+                parser.backfill_history(max_age, IPBlocker.banned_ips, AppRunning.is_running)
+
+
+def collect_parser_metrics():  # type: () -> List[metrics.Metric]
+    """
+    Creates the metrics from the counters held by the parsers of the profiles
+    :return: list of the metrics
+    """
+    lines_read = metrics.Counter('sg_log_lines_read_total', 'Number of log lines tested against the filters',
+                                 ('profile',))
+    lines_matched = metrics.Counter('sg_log_lines_matched_total', 'Number of log lines matched by the filter',
+                                    ('profile', 'rule'))
+    bytes_read = metrics.Counter('sg_log_bytes_read_total', 'Number of bytes of the read log lines', ('profile',))
+    lines_banned = metrics.Counter('sg_log_lines_banned_total',
+                                   'Number of matched log lines dropped because their IP was already banned',
+                                   ('profile',))
+    PROFILES_LOCK.acquire()
+    parsers = [(profile, profile_data['parser']) for profile, profile_data in PROFILES.items()
+               if 'parser' in profile_data]
+    PROFILES_LOCK.release()
+    for profile, parser in parsers:
+        lines_read.inc(parser.lines_read, profile=profile)
+        bytes_read.inc(parser.source.bytes_read, profile=profile)
+        lines_banned.inc(parser.banned_lines, profile=profile)
+        for rule in parser.rules:
+            lines_matched.inc(parser.rule_hits.get(rule, 0), profile=profile, rule=rule.filter_string)
+    return [lines_read, lines_matched, bytes_read, lines_banned]
+
+
+def start_metrics():  # type: () -> None
+    """
+    Starts exporting the metrics over HTTP and into the textfile if enabled in the config
+    :return: None
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    metrics.REGISTRY.add_collector(collect_parser_metrics)
+    if CONFIG['metrics']['listen'] is not None:
+        host, port = CONFIG['metrics']['listen'].rsplit(':', 1)
+        try:
+            metrics.MetricsServer(metrics.REGISTRY, host, int(port), AppRunning.is_running).start()
+            logger.info('serving metrics on %s' % CONFIG['metrics']['listen'])
+        except OSError as e:
+            logger.error('cannot serve metrics on %s: %s' % (CONFIG['metrics']['listen'], e))
+    if CONFIG['metrics']['textfile'] is not None:
+        metrics.TextfileExporter(metrics.REGISTRY, CONFIG['metrics']['textfile'],
+                                 CONFIG['metrics']['textfileInterval'], AppRunning.is_running, logger).start()
+
+
+class ThreadProfilesWatcher(Thread):
+    """
+    This thread watches the profile files and reloads the profiles when some of them changes
+    """
+
+    def run(self):
+        logger = logging.getLogger(LOGGER_NAME)
+        while AppRunning.is_running():
+            AppRunning.sleep_while_running(CONFIG['profilesWatchTime'])
+            if not AppRunning.is_running():
+                break
+            if hash_profile_files() != PROFILES_FILES_HASH:
+                logger.info('profile files have changed, reloading them')
+                load_profiles()
 
 
 class Updater:
@@ -491,14 +950,45 @@ def list_bans(before=None, max_limit=None):  # type: (int, int) -> List[dict]
         sql += ' LIMIT ' + str(max_limit)
     bans = Database.json(sql, 'bans', (before,) if before is not None else ())
     for i, record in enumerate(bans):
-        ip_attacks_count = Database.execute('SELECT COUNT(*) FROM attacks WHERE ip = ?', (record['ip'],))[0][0]
+        ip_attacks_count = Database.read('SELECT COUNT(*) FROM attack_records WHERE ip = ?', (record['ip'],))[0][0]
         bans[i]['attacksCount'] = ip_attacks_count
     return bans
 
 
+def profile_parser_key(profile_data):  # type: (dict) -> str
+    """
+    Gets the key of the values the parser of the profile is built from
+    :param profile_data: data of the profile
+    :return: key. Profiles with the same key can share the state of their parser
+    """
+    return json.dumps([profile_data.get('logFile'), profile_data.get('journal'), profile_data.get('filters'),
+                       profile_data.get('keepVariables')], sort_keys=True)
+
+
+def hash_profile_files():  # type: () -> str
+    """
+    Computes the hash of names and contents of all profile files, so the changes of profiles can be detected
+    :return: hex digest of the hash
+    """
+    profiles_hash = md5()
+    if os.path.isdir(PROFILES_DIR):
+        for file_profile in sorted(os.listdir(PROFILES_DIR)):
+            if not file_profile.endswith('.json'):
+                continue
+            profiles_hash.update(file_profile.encode('utf8'))
+            try:
+                with open(os.path.join(PROFILES_DIR, file_profile), 'rb') as f:
+                    profiles_hash.update(f.read())
+            except OSError:
+                continue
+    return profiles_hash.hexdigest()
+
+
 def load_profiles():  # type: () -> None
     """
     Loads profiles from disc
+    Parsers of the profiles whose log source and filters did not change are kept, so the logs are not read again
+    from the beginning
     :return: None
     """
 
@@ -511,14 +1001,16 @@ def load_profiles():  # type: () -> None
                 logger.info('Invalid profile - not loading (%s)' % filename)
                 return
             for profile, profile_data in loaded_profiles.items():
-                if profile not in PROFILES:
-                    PROFILES[profile] = dict(CONFIG['defaults'])
-                PROFILES[profile].update(profile_data)
+                if profile not in new_profiles:
+                    new_profiles[profile] = dict(CONFIG['defaults'])
+                new_profiles[profile].update(profile_data)
 
+    global PROFILES_FILES_HASH
     logger = logging.getLogger(LOGGER_NAME)
     logger.info('Loading profiles')
     PROFILES_LOCK.acquire()
-    PROFILES.clear()
+    PROFILES_FILES_HASH = hash_profile_files()
+    new_profiles = {}  # type: Dict[str, dict]
     if not os.path.exists(PROFILES_DIR):
         os.makedirs(PROFILES_DIR)
     else:
@@ -534,6 +1026,17 @@ def load_profiles():  # type: () -> None
         # Override all duplicate local profiles with online ones
         if load_online:
             load_profile_file('online.json')
+
+    for profile, profile_data in PROFILES.items():
+        if 'parser' not in profile_data:
+            continue
+        if profile in new_profiles and profile_parser_key(new_profiles[profile]) == profile_parser_key(profile_data):
+            new_profiles[profile]['parser'] = profile_data['parser']
+        else:
+            logger.debug('log source or filters of profile %s changed, its logs will be read again' % profile)
+            DISCARDED_PARSERS.append(profile_data['parser'])
+    PROFILES.clear()
+    PROFILES.update(new_profiles)
     PROFILES_LOCK.release()
 
 
@@ -565,6 +1068,7 @@ def init_online():  # type: () -> None
     :return: None
     """
     socket = HSocket(ONLINE_DATA['server_url'], auto_connect=False)
+    socket.on_poll_finished = metrics.HSOCKET_POLL_DURATION.observe
     logger = logging.getLogger(LOGGER_NAME)
 
     class ThreadDisconnectOnProgramEnd(Thread):
@@ -630,12 +1134,13 @@ def init_online():  # type: () -> None
         :param sid: socket's id of the user on the SG's web interface
         :return: None
         """
-        attacks_total = Database.execute('SELECT COUNT(*) FROM attacks')[0]
-        bans_total = Database.execute('SELECT COUNT(*) FROM bans')[0]
+        attacks_total = Database.read('SELECT COUNT(*) FROM attack_records')[0]
+        bans_total = Database.read('SELECT COUNT(*) FROM bans')[0]
 
         last_midnight_time = int(time.mktime(date.today().timetuple()))
-        attacks_today = Database.execute('SELECT COUNT(*) FROM attacks WHERE time > ?', (last_midnight_time,))[0]
-        bans_today = Database.execute('SELECT COUNT(*) FROM bans WHERE time > ?', (last_midnight_time,))[0]
+        attacks_today = Database.read('SELECT COUNT(*) FROM attack_records WHERE time > ?',
+                                      (last_midnight_time,))[0]
+        bans_today = Database.read('SELECT COUNT(*) FROM bans WHERE time > ?', (last_midnight_time,))[0]
 
         socket.emit('statistic_data', json.dumps(
             {'userSid': sid, 'data': {
@@ -733,6 +1238,25 @@ def load_config(dict_src=None, dict_target=None):  # type: (dict, dict) -> None
         dict_target[k] = v
 
 
+def take_profiling_request():  # type: () -> int
+    """
+    Takes the number of scan cycles to profile asked by simple-guardian-client profile
+    :return: number of the cycles, 0 if nothing was asked
+    """
+    if not os.path.isfile(PROFILING_REQUEST_FILE):
+        return 0
+    logger = logging.getLogger(LOGGER_NAME)
+    try:
+        with open(PROFILING_REQUEST_FILE, 'r') as f:
+            cycles = int(f.read().strip() or 1)
+        os.remove(PROFILING_REQUEST_FILE)
+    except (OSError, ValueError) as e:
+        logger.error('cannot take the profiling request: %s' % e)
+        return 0
+    logger.info('profiling next %d scan cycles' % cycles)
+    return cycles
+
+
 def cli():
     """
     Run CLI
@@ -756,8 +1280,13 @@ def cli():
         print('update             ...........   updates s-g to the latest version from GitHub releases')
         print('update-master      ...........   updates s-g to the latest version from GitHub master branch')
         print('unblock            ...........   unblocks IP blocked by s-g')
+        print('profile [cycles]   ...........   profiles next scan cycles of the running s-g, default 1')
+        print('replay log         ...........   replays profiles over the log (- for stdin) without blocking anything')
         print('-V/version         ...........   prints version and exits')
         exit()
+    if 'replay' in sys.argv:
+        load_profiles()
+        exit(replay.main(sys.argv[sys.argv.index('replay') + 1:], PROFILES, CONFIG['defaults']))
 
     # commands below require root privileges
     if os.geteuid() != 0:
@@ -791,6 +1320,25 @@ def cli():
             AppRunning.exit(0)
         print('%s was unblocked' % blocked_ip)
         AppRunning.exit(0)
+    if 'profile' in sys.argv:
+        cycles = 1
+        try:
+            cycles = int(sys.argv[sys.argv.index('profile') + 1])
+        except IndexError:
+            pass
+        except ValueError:
+            print('the number of cycles must be a number')
+            exit(1)
+        os.makedirs(PROFILING_DIR, exist_ok=True)
+        with open(PROFILING_REQUEST_FILE, 'w') as f:
+            f.write(str(cycles))
+        if os.geteuid() == 0:
+            # the client runs as root, but the service must be able to remove the request and to save the profiles
+            data_stat = os.stat(CONFIG_DIR)
+            for file_path in (PROFILING_DIR, PROFILING_REQUEST_FILE):
+                os.chown(file_path, data_stat.st_uid, data_stat.st_gid)
+        print('next %d scan cycles will be profiled, the profile will be saved into %s' % (cycles, PROFILING_DIR))
+        exit()
     print('for help enter simple-guardian-client help')
 
 
@@ -856,8 +1404,19 @@ def main():
         if ONLINE_DATA['loggedIn']:
             init_online()
 
-    # Start scanning of the logs
-    ThreadScanner().start()
+    start_metrics()
+
+    # Start scanning of the logs. After the program stops, the database waits for the scanner to finish its cycle and
+    # for the blocker and the persister to write everything it has found
+    scanner = ThreadScanner()
+    blocker = ThreadBlocker([scanner])
+    persister = ThreadPersister(producers=[scanner])
+    Database.writers.extend([scanner, blocker, persister])
+    blocker.start()
+    persister.start()
+    scanner.start()
+    if CONFIG['profilesWatchTime'] is not None:
+        ThreadProfilesWatcher().start()
 
     # Terminate the program when CTRL+C is pressed
     while AppRunning.is_running():
@@ -0,0 +1,86 @@
+"""
+Tests of the normalised storage of the attacks and of the migration of the legacy table
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+import json
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+# the table of the attacks as created by the releases before the normalised storage
+LEGACY_SCHEMA = ('CREATE TABLE "attacks" ('
+                 '`id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,'
+                 '`time` INTEGER NOT NULL,'
+                 '`ip` TEXT NOT NULL,'
+                 '`profile` TEXT NOT NULL,'
+                 '`user` TEXT,'
+                 '`data` INTEGER NOT NULL);')
+
+
+class AttackStorageTest(unittest.TestCase):
+    def setUp(self):  # type: () -> None
+        self.connection = sqlite3.connect(':memory:')
+
+    def tearDown(self):  # type: () -> None
+        self.connection.close()
+
+    def attacks(self):  # type: () -> list
+        """
+        Reads the attacks the same way as the API consumers do
+        :return: list of tuples (id, time, ip, profile, user, parsed data) ordered by the id
+        """
+        return [row[:5] + (json.loads(row[5]),) for row in self.connection.execute(
+            'SELECT `id`, `time`, `ip`, `profile`, `user`, `data` FROM attacks ORDER BY `id`')]
+
+    def test_migrate_legacy_table(self):
+        self.connection.execute(LEGACY_SCHEMA)
+        legacy_attacks = [
+            (3, 1600000000, '192.0.2.1', 'SSH', 'root',
+             {'TIMESTAMP': 1600000000, 'USER': 'root', 'IP': '192.0.2.1', 'HOSTNAME': 'server', 'PID': '123'}),
+            (7, 1600000005, '192.0.2.2', 'Dovecot', None, {'TIMESTAMP': 1600000005, 'IP': '192.0.2.2'}),
+        ]
+        for attack_id, attack_time, ip, profile, user, data in legacy_attacks:
+            self.connection.execute('INSERT INTO `attacks`(`id`,`time`,`ip`,`data`,`profile`,`user`) '
+                                    'VALUES (?,?,?,?,?,?);', (attack_id, attack_time, ip, json.dumps(data), profile,
+                                                              user))
+        self.connection.execute('INSERT INTO `attacks`(`id`,`time`,`ip`,`data`,`profile`,`user`) '
+                                'VALUES (?,?,?,?,?,?);', (8, 1600000009, '192.0.2.3', 'not a JSON', 'SSH', 'admin'))
+        self.connection.commit()
+
+        storage = database.AttackStorage(self.connection)
+        tables = {name for name, in self.connection.execute('SELECT name FROM sqlite_master WHERE type = ?',
+                                                            ('table',))}
+        self.assertNotIn('attacks', tables)
+        self.assertEqual(self.connection.execute('SELECT COUNT(*) FROM attack_records').fetchone()[0], 3)
+        # the IP is read from its column, the variables without a value are left out of the data
+        self.assertEqual(self.attacks(), [
+            (3, 1600000000, '192.0.2.1', 'SSH', 'root',
+             {'TIMESTAMP': 1600000000, 'USER': 'root', 'HOSTNAME': 'server', 'PID': '123'}),
+            (7, 1600000005, '192.0.2.2', 'Dovecot', None, {'TIMESTAMP': 1600000005}),
+            (8, 1600000009, '192.0.2.3', 'SSH', 'admin', {'TIMESTAMP': 1600000009, 'USER': 'admin'}),
+        ])
+        # the ids of the migrated attacks are kept, the new ones continue after them
+        self.assertTrue(storage.contains('192.0.2.1', 1600000000, 'SSH'))
+        storage.insert('192.0.2.4', {'TIMESTAMP': 1600000010, 'USER': 'git'}, 'SSH')
+        self.assertEqual(self.attacks()[-1][:5], (9, 1600000010, '192.0.2.4', 'SSH', 'git'))
+
+        # opening the migrated database again changes nothing
+        database.AttackStorage(self.connection)
+        self.assertEqual(len(self.attacks()), 4)
+
+    def test_insert_new(self):
+        storage = database.AttackStorage(self.connection)
+        records = [('192.0.2.1', {'TIMESTAMP': 1600000000, 'USER': 'root', 'SERVICE': 'ssh'}, 'SSH'),
+                   ('192.0.2.1', {'TIMESTAMP': 1600000001}, 'SSH')]
+        self.assertEqual(storage.insert_new(records), 2)
+        self.assertEqual(storage.insert_new(records + [('192.0.2.1', {'TIMESTAMP': 1600000000}, 'Dovecot')]), 1)
+        self.assertEqual(len(self.attacks()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+Tests of the sources reading the log files
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+import os
+import sys
+import time
+import unittest
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_manipulator  # noqa: E402
+
+
+def iso_line(timestamp, text):  # type: (float, str) -> str
+    return '%s %s\n' % (datetime.fromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S'), text)
+
+
+class FileSourceTest(unittest.TestCase):
+    def setUp(self):  # type: () -> None
+        self.temp_dir = TemporaryDirectory()
+        self.log_file = os.path.join(self.temp_dir.name, 'auth.log')
+
+    def tearDown(self):  # type: () -> None
+        self.temp_dir.cleanup()
+
+    def write(self, lines, mode='a'):  # type: (List[str], str) -> None
+        with open(self.log_file, mode) as f:
+            f.write(''.join(lines))
+
+    def open_source(self):  # type: () -> log_manipulator.FileSource
+        source = log_manipulator.FileSource(self.log_file, buffer_size=256)
+        self.addCleanup(source.close)
+        return source
+
+    def read(self, source):  # type: (log_manipulator.FileSource) -> List[str]
+        """
+        Reads the new lines of the source like a scan does
+        :param source: the source
+        :return: the new lines, empty if the source did not change
+        """
+        return list(source.read_lines()) if source.poll() else []
+
+    def test_follow(self):
+        self.write(['a1\n', 'a2\n', 'a3'])
+        source = self.open_source()
+        self.assertEqual(self.read(source), ['a1', 'a2'])  # the unterminated line is left for the next scan
+        self.assertEqual(self.read(source), [])
+        self.write(['\n', 'a4\n'])
+        self.assertEqual(self.read(source), ['a3', 'a4'])
+
+    def test_rotation(self):
+        self.write(['a1\n'])
+        source = self.open_source()
+        self.assertEqual(self.read(source), ['a1'])
+        self.write(['a2\n'])  # written after the last scan, just before the rotation
+        os.rename(self.log_file, self.log_file + '.1')
+        self.write(['b1\n', 'b2\n'])
+        self.assertEqual(self.read(source), ['a2', 'b1', 'b2'])
+        self.write(['b3\n'])
+        self.assertEqual(self.read(source), ['b3'])
+
+    def test_rotation_without_new_file(self):
+        self.write(['a1\n'])
+        source = self.open_source()
+        self.assertEqual(self.read(source), ['a1'])
+        self.write(['a2\n'])
+        os.rename(self.log_file, self.log_file + '.1')
+        self.assertEqual(self.read(source), ['a2'])
+        self.assertRaises(FileNotFoundError, source.poll)
+        self.write(['b1\n'])
+        self.assertEqual(self.read(source), ['b1'])
+
+    def test_truncation(self):
+        self.write(['a%d\n' % i for i in range(100)])
+        source = self.open_source()
+        self.assertEqual(len(self.read(source)), 100)
+        self.write(['b1\n', 'b2\n'], 'w')  # eg. copytruncate of logrotate, the file keeps its inode
+        self.assertEqual(self.read(source), ['b1', 'b2'])
+
+    def test_rewritten_content(self):
+        self.write(['a1\n', 'a2\n'])
+        source = self.open_source()
+        self.assertEqual(self.read(source), ['a1', 'a2'])
+        self.write(['b1\n', 'b2\n', 'b3\n'], 'w')  # longer than before, but the already read content changed
+        self.assertEqual(self.read(source), ['b1', 'b2', 'b3'])
+        self.assertTrue(source.rescanned)
+
+    def test_skip_older(self):
+        now = time.time()
+        old_lines = [iso_line(now - 7200, 'old %d' % i) for i in range(100)]
+        self.write(old_lines + [iso_line(now - 60, 'new %d' % i) for i in range(10)])
+        source = self.open_source()
+        self.assertTrue(source.poll())
+        self.assertEqual(source.skip_older(3600), len(''.join(old_lines)))
+        self.assertEqual(list(source.read_lines()), [line.rstrip('\n') for line in
+                                                     [iso_line(now - 60, 'new %d' % i) for i in range(10)]])
+
+    def test_skip_older_without_times(self):
+        self.write(['line without any time %d\n' % i for i in range(10 * log_manipulator.FileSource.MAX_UNTIMED_LINES)])
+        source = self.open_source()
+        self.assertTrue(source.poll())
+        with mock.patch.object(log_manipulator, 'parse_log_time', wraps=log_manipulator.parse_log_time) as parse:
+            self.assertEqual(source.skip_older(3600), 0)
+        # the search gives up instead of reading the whole file backwards and the file is read whole as before
+        self.assertEqual(parse.call_count, log_manipulator.FileSource.MAX_UNTIMED_LINES)
+        self.assertEqual(len(list(source.read_lines())), 10 * log_manipulator.FileSource.MAX_UNTIMED_LINES)
+
+
+class MultiFileSourceTest(unittest.TestCase):
+    def setUp(self):  # type: () -> None
+        self.temp_dir = TemporaryDirectory()
+        self.handle_pool = log_manipulator.FileHandlePool(max_open_files=2)
+        self.source = log_manipulator.MultiFileSource(os.path.join(self.temp_dir.name, '*.log'),
+                                                      handle_pool=self.handle_pool)
+
+    def tearDown(self):  # type: () -> None
+        self.source.close()
+        self.temp_dir.cleanup()
+
+    def write(self, name, lines):  # type: (str, List[str]) -> None
+        with open(os.path.join(self.temp_dir.name, name), 'a') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    def read(self):  # type: () -> List[str]
+        return sorted(self.source.read_lines()) if self.source.poll() else []
+
+    def open_files(self):  # type: () -> int
+        return sum(source._file is not None for source in self.source._sources.values())
+
+    def test_new_and_removed_files(self):
+        self.write('a.log', ['a1'])
+        self.write('a.log.1', ['rotated'])
+        self.write('a.txt', ['other'])
+        self.assertEqual(self.read(), ['a1'])
+        self.write('b.log', ['b1'])
+        self.write('a.log', ['a2'])
+        self.assertEqual(self.read(), ['a2', 'b1'])
+        self.assertEqual(self.read(), [])
+        os.remove(os.path.join(self.temp_dir.name, 'a.log'))
+        self.assertEqual(self.read(), [])  # the rest of the removed file is read first, like of a rotated one
+        self.assertEqual(self.read(), [])
+        self.assertEqual(list(self.source._sources), [os.path.join(self.temp_dir.name, 'b.log')])
+
+    def test_handle_pool_eviction(self):
+        for name in 'abcd':
+            self.write('%s.log' % name, [name + '1'])
+        self.assertEqual(self.read(), ['a1', 'b1', 'c1', 'd1'])
+        self.assertEqual(self.open_files(), 2)
+        # the files closed by the pool are reopened and read from the offset where their reading ended
+        for name in 'abcd':
+            self.write('%s.log' % name, [name + '2'])
+        self.assertEqual(self.read(), ['a2', 'b2', 'c2', 'd2'])
+        self.assertEqual(self.open_files(), 2)
+        self.write('a.log', ['a3'])
+        self.assertEqual(self.read(), ['a3'])
+        self.assertIsNotNone(self.source._sources[os.path.join(self.temp_dir.name, 'a.log')]._file)
+
+    def test_rotation_while_closed(self):
+        for name in 'abc':
+            self.write('%s.log' % name, [name + '1'])
+        self.assertEqual(self.read(), ['a1', 'b1', 'c1'])
+        closed = [path for path, source in self.source._sources.items() if source._file is None][0]
+        os.rename(closed, closed + '.1')
+        with open(closed, 'w') as f:
+            f.write('new\n')
+        self.assertEqual(self.read(), ['new'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Tests of the nftables backend, nft is replaced by a script saving the transactions it gets
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+import os
+import shlex
+import stat
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import firewall  # noqa: E402
+
+FAILING_IP = '192.0.2.66'  # transactions containing this IP are rejected by the fake nft
+
+FAKE_NFT = '''#!/bin/sh
+script=$(cat)
+printf '%%s\\n%s\\n' "$script" >> "$1"
+case "$script" in
+  *%s*) echo "Error: Could not process rule" >&2; exit 1;;
+esac
+'''
+
+
+class NftablesBackendTest(unittest.TestCase):
+    SEPARATOR = '-- end of transaction --'
+
+    def setUp(self):  # type: () -> None
+        self.temp_dir = TemporaryDirectory()
+        self.transactions_file = os.path.join(self.temp_dir.name, 'transactions')
+        nft = os.path.join(self.temp_dir.name, 'nft')
+        with open(nft, 'w') as f:
+            f.write(FAKE_NFT % (self.SEPARATOR, FAILING_IP))
+        os.chmod(nft, os.stat(nft).st_mode | stat.S_IXUSR)
+        self.backend = firewall.NftablesBackend('%s %s' % (shlex.quote(nft), shlex.quote(self.transactions_file)),
+                                                'test')
+
+    def tearDown(self):  # type: () -> None
+        self.temp_dir.cleanup()
+
+    def transactions(self):  # type: () -> List[str]
+        """
+        Reads the transactions the fake nft got
+        :return: list of the transactions in the order of the calls
+        """
+        if not os.path.exists(self.transactions_file):
+            return []
+        with open(self.transactions_file) as f:
+            return [transaction.strip() for transaction in f.read().split(self.SEPARATOR + '\n')[:-1]]
+
+    def test_init(self):
+        self.assertTrue(self.backend.init())
+        transactions = self.transactions()
+        self.assertEqual(len(transactions), 1)
+        self.assertIn('add table inet test', transactions[0])
+        self.assertIn('add set inet test blocked4 { type ipv4_addr; flags interval, timeout; }', transactions[0])
+        self.assertIn('add rule inet test input ip6 saddr @blocked6 drop', transactions[0])
+        self.assertIn('flush set inet test blocked4', transactions[0])
+
+    def test_init_without_nft(self):
+        self.backend.command = [os.path.join(self.temp_dir.name, 'missing')]
+        self.assertFalse(self.backend.init())
+
+    def test_apply_batch(self):
+        blocked, unblocked = self.backend.apply(['192.0.2.1', '2001:db8::1', '198.51.100.0/24', 'not an IP'],
+                                                ['192.0.2.9'], {'192.0.2.1': 600})
+        self.assertEqual(blocked, {'192.0.2.1', '2001:db8::1', '198.51.100.0/24'})
+        self.assertEqual(unblocked, {'192.0.2.9'})
+        transactions = self.transactions()
+        self.assertEqual(len(transactions), 1)  # all changes are applied as one transaction
+        lines = transactions[0].splitlines()
+        self.assertEqual(lines, ['add element inet test blocked4 { 192.0.2.9 }',
+                                 'delete element inet test blocked4 { 192.0.2.9 }',
+                                 'add element inet test blocked4 { 192.0.2.1 timeout 600s }',
+                                 'add element inet test blocked6 { 2001:db8::1 }',
+                                 'add element inet test blocked4 { 198.51.100.0/24 }'])
+
+    def test_apply_without_timeouts(self):
+        # eg. the IPs of the federation, they have no ban in the database that would block them again
+        blocked, _ = self.backend.apply(['192.0.2.1', '192.0.2.2'], [])
+        self.assertEqual(blocked, {'192.0.2.1', '192.0.2.2'})
+        self.assertNotIn('timeout', self.transactions()[0])
+
+    def test_apply_fallback(self):
+        blocked, unblocked = self.backend.apply(['192.0.2.1', FAILING_IP], ['192.0.2.9'])
+        self.assertEqual(blocked, {'192.0.2.1'})
+        self.assertEqual(unblocked, {'192.0.2.9'})
+        transactions = self.transactions()
+        # the rejected transaction is followed by every change alone
+        self.assertEqual(len(transactions), 4)
+        self.assertIn(FAILING_IP, transactions[0])
+        self.assertEqual(transactions[1:], ['add element inet test blocked4 { 192.0.2.9 }\n'
+                                            'delete element inet test blocked4 { 192.0.2.9 }',
+                                            'add element inet test blocked4 { 192.0.2.1 }',
+                                            'add element inet test blocked4 { %s }' % FAILING_IP])
+
+    def test_apply_nothing(self):
+        self.assertEqual(self.backend.apply([], ['not an IP']), (set(), set()))
+        self.assertEqual(self.transactions(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Tests of reading the systemd journal, journalctl is replaced by a script printing the entries after the given cursor
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+import json
+import os
+import stat
+import sys
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_manipulator  # noqa: E402
+
+# prints the entries saved in the JSON file in the export format, like journalctl does
+FAKE_JOURNALCTL = '''#!%s
+import json
+import sys
+
+entries_file, arguments = %r, sys.argv[1:]
+with open(entries_file + '.calls', 'a') as f:
+    f.write(' '.join(arguments) + '\\n')
+with open(entries_file) as f:
+    entries = json.load(f)
+cursors = [entry['__CURSOR'] for entry in entries]
+after = [argument.split('=', 1)[1] for argument in arguments if argument.startswith('--after-cursor=')]
+# without the cursor only the entries written later would be printed, but they never come
+for entry in entries[cursors.index(after[0]) + 1:] if after else []:
+    sys.stdout.write(''.join('%%s=%%s\\n' %% field for field in entry.items()) + '\\n')
+'''
+
+
+def entry(number):  # type: (int) -> dict
+    return {'__CURSOR': 's=1;i=%d' % number, '__REALTIME_TIMESTAMP': str(1596293528000000 + number * 1000000),
+            '_HOSTNAME': 'server', 'SYSLOG_IDENTIFIER': 'sshd', '_PID': '123',
+            'MESSAGE': 'Failed password for root from 192.0.2.%d port 22 ssh2' % number}
+
+
+class JournalSourceTest(unittest.TestCase):
+    def setUp(self):  # type: () -> None
+        self.temp_dir = TemporaryDirectory()
+        self.entries_file = os.path.join(self.temp_dir.name, 'entries.json')
+        self.checkpoint_file = os.path.join(self.temp_dir.name, 'checkpoints', 'journal')
+        self.journalctl = os.path.join(self.temp_dir.name, 'journalctl')
+        with open(self.journalctl, 'w') as f:
+            f.write(FAKE_JOURNALCTL % (sys.executable, self.entries_file))
+        os.chmod(self.journalctl, os.stat(self.journalctl).st_mode | stat.S_IXUSR)
+        self.write_entries(1)
+        patcher = mock.patch.object(log_manipulator, 'systemd_journal', None)  # always read by journalctl
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):  # type: () -> None
+        self.temp_dir.cleanup()
+
+    def write_entries(self, count):  # type: (int) -> None
+        with open(self.entries_file, 'w') as f:
+            json.dump([entry(number) for number in range(1, count + 1)], f)
+
+    def calls(self):  # type: () -> List[str]
+        """
+        Reads the arguments of the calls of the fake journalctl
+        :return: list of the arguments of every call
+        """
+        with open(self.entries_file + '.calls') as f:
+            return f.read().splitlines()
+
+    def open_source(self):  # type: () -> log_manipulator.JournalSource
+        source = log_manipulator.JournalSource({'_SYSTEMD_UNIT': 'ssh.service'}, self.checkpoint_file,
+                                               journalctl=self.journalctl)
+        self.addCleanup(source.close)
+        return source
+
+    def read(self, source, expected, skip_scanning=False):
+        # type: (log_manipulator.JournalSource, int, bool) -> List[str]
+        """
+        Reads the lines of the source once the fake journalctl has ended and its entries were parsed
+        :param source: the source
+        :param expected: number of the entries printed by the fake journalctl
+        :param skip_scanning: passed to source.read_lines
+        :return: the read lines
+        """
+        source.poll()
+        deadline = time.monotonic() + 10
+        while (source._process.poll() is None or source._entries.qsize() < expected) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return list(source.read_lines(skip_scanning))
+
+    def test_checkpoints(self):
+        source = self.open_source()
+        self.assertEqual(self.read(source, 0), [])
+        self.assertFalse(os.path.exists(self.checkpoint_file))  # nothing was read, so there is nothing to save
+        source.close()
+
+        os.makedirs(os.path.dirname(self.checkpoint_file))
+        with open(self.checkpoint_file, 'w') as f:
+            f.write('s=1;i=1\n')
+        self.write_entries(3)
+        source = self.open_source()
+        # the entries written while the program was not running are scanned even by the first scan
+        lines = self.read(source, 2, skip_scanning=True)
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith(' server sshd[123]: Failed password for root from 192.0.2.2 port 22 ssh2'))
+        with open(self.checkpoint_file) as f:
+            self.assertEqual(f.read(), 's=1;i=3')
+        source.close()
+
+        self.write_entries(4)
+        source = self.open_source()
+        self.assertEqual(len(self.read(source, 1)), 1)
+        with open(self.checkpoint_file) as f:
+            self.assertEqual(f.read(), 's=1;i=4')
+        self.assertEqual(self.calls(), [
+            '-o export --follow --no-pager --lines=0 _SYSTEMD_UNIT=ssh.service',
+            '-o export --follow --no-pager --after-cursor=s=1;i=1 _SYSTEMD_UNIT=ssh.service',
+            '-o export --follow --no-pager --after-cursor=s=1;i=3 _SYSTEMD_UNIT=ssh.service',
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Tests of the parser finding the attacks in the log files
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+import os
+import sys
+import time
+import unittest
+from datetime import datetime
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_manipulator  # noqa: E402
+
+RULES = ['%TIME% sshd[%PID%]: Failed password for %USER% from %IP%', '%TIME% sudo: %USER% : from %IP%']
+
+
+def attack_line(timestamp, ip):  # type: (float, str) -> str
+    return '%s sshd[1]: Failed password for root from %s\n' % (datetime.fromtimestamp(timestamp).strftime('%H:%M:%S'),
+                                                              ip)
+
+
+class LogParserTest(unittest.TestCase):
+    def setUp(self):  # type: () -> None
+        self.temp_dir = TemporaryDirectory()
+        self.log_file = os.path.join(self.temp_dir.name, 'auth.log')
+        with open(self.log_file, 'w'):
+            pass
+        self.parser = log_manipulator.LogParser(self.log_file, RULES, backfill_workers=1, reorder_interval=None)
+
+    def tearDown(self):  # type: () -> None
+        self.parser.close()
+        self.temp_dir.cleanup()
+
+    def test_backfill_history_banned_ips(self):
+        now = time.time()
+        with open(self.log_file + '.1', 'w') as f:
+            f.write(''.join(attack_line(now - i, '192.0.2.1') for i in range(3)))
+            f.write(''.join(attack_line(now - i, '192.0.2.2') for i in range(2)))
+        self.parser.parse_attacks(3600)
+        self.parser.backfill_history(3600, {'192.0.2.1'})
+        self.assertEqual(list(self.parser.parse_attacks(3600)), ['192.0.2.2'])
+        self.assertEqual(self.parser.lines_read, 5)
+        self.assertEqual(self.parser.banned_lines, 3)
+
+    def test_unique_timestamps(self):
+        now = int(time.time())
+        with open(self.log_file, 'w') as f:
+            f.write(''.join(attack_line(now - 10, '192.0.2.%d' % (i % 3)) for i in range(50)))
+            f.write(attack_line(now + 5, '192.0.2.9'))  # its time is already taken by the attacks made 10 s ago
+        attacks = self.parser.parse_attacks(3600)
+        timestamps = [attack.timestamp for ip_attacks in attacks.values() for attack in ip_attacks]
+        self.assertEqual(sorted(timestamps), list(range(now - 10, now + 41)))
+        self.assertEqual(attacks['192.0.2.9'][0].timestamp, now + 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
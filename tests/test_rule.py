@@ -0,0 +1,134 @@
+"""
+Tests of the rules matching the log lines and of their order in the parser
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+import json
+import os
+import random
+import re
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_manipulator  # noqa: E402
+
+DEFAULT_PROFILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'profiles',
+                                'default.json')
+
+
+def regex_match(filter_string, log_line):  # type: (str, str) -> Tuple[str, ...] or None
+    """
+    Matches the line by the regex the rules were matched with before they were split by their literals
+    :param filter_string: the filter with all variables stated as %VAR_NAME%
+    :param log_line: line from a log file
+    :return: the values of the variables or None if the filter does not fit
+    """
+    rule_regex = filter_string
+    for reserved_char in list("\\+*?^$.[]{}()|/"):
+        rule_regex = rule_regex.replace(reserved_char, '\\' + reserved_char)
+    for variable in re.findall('%.*?%', filter_string):
+        rule_regex = rule_regex.replace(variable, '(.+?)')
+    if rule_regex.endswith('?)'):
+        rule_regex = rule_regex[:-2] + ')'
+    match = re.match(rule_regex, log_line)
+    return match.groups() if match else None
+
+
+class RuleMatchTest(unittest.TestCase):
+    FILTERS = ['%IP% attacked on user %USER%', 'sshd[%PID%]: Failed password for %USER% from %IP% port %PORT% ssh2',
+               'auth: ruser=%USER% rhost=%IP%', '%USER%%IP% from', 'user %USER%%IP%', 'from %IP%%PORT%',
+               '%USER% from %IP% from %IP%', '%USER%.%IP%', 'prefix']
+
+    def lines(self, filter_string, generator):  # type: (str, random.Random) -> List[str]
+        """
+        Generates the lines that fit or almost fit the filter, including the values containing its literals
+        :param filter_string: the filter with all variables stated as %VAR_NAME%
+        :param generator: random generator
+        :return: list of the lines
+        """
+        literals = re.split('%.*?%', filter_string)
+        fragments = [literal for literal in literals if literal] + ['', ' ', 'x', 'root', '192.0.2.1', '2001:db8::1',
+                                                                   '[', ')', '.', '%', '\\', '\n']
+        lines = []
+        for _ in range(50):
+            values = [''.join(generator.choice(fragments) for _ in range(generator.randint(0, 3)))
+                      for _ in literals[1:]]
+            line = literals[0] + ''.join(value + literal for value, literal in zip(values, literals[1:]))
+            lines += [line, line[:generator.randint(0, len(line))], line + generator.choice(fragments),
+                      line.replace(' ', '  ', 1)]
+        return lines
+
+    def test_same_as_regex(self):
+        with open(DEFAULT_PROFILES) as f:
+            filters = [log_filter for profile in json.load(f).values() for log_filter in profile['filters']]
+        generator = random.Random(0)
+        for filter_string in filters + self.FILTERS:
+            rule = log_manipulator.Rule(filter_string)
+            for log_line in self.lines(filter_string, generator):
+                expected = regex_match(filter_string, log_line)
+                self.assertEqual(rule.match(log_line), expected, (filter_string, log_line))
+                self.assertEqual(rule.test(log_line), expected is not None)
+
+
+class CompileRuleTest(unittest.TestCase):
+    def test_shared_rules(self):
+        rule = log_manipulator.compile_rule('sshd[%PID%]: Failed password for %USER% from %IP%', 'ssh', ['HOSTNAME'])
+        self.assertIs(log_manipulator.compile_rule('sshd[%PID%]: Failed password for %USER% from %IP%', 'ssh',
+                                                   ('HOSTNAME',)), rule)
+        self.assertIsNot(log_manipulator.compile_rule('sshd[%PID%]: Failed password for %USER% from %IP%'), rule)
+
+    def test_bounded_cache(self):
+        for i in range(2 * log_manipulator._compile_rule.cache_info().maxsize):
+            log_manipulator.compile_rule('rule %d from %%IP%%' % i)
+        cache_info = log_manipulator._compile_rule.cache_info()
+        self.assertEqual(cache_info.currsize, cache_info.maxsize)
+
+
+class RuleOrderTest(unittest.TestCase):
+    def test_overlaps(self):  # type: () -> None
+        failed = log_manipulator.Rule('%D:M% %D:D% %TIME% %HOSTNAME% sshd[%PID%]: Failed password for %USER% from %IP%')
+        invalid = log_manipulator.Rule('%D:M% %D:D% %TIME% %HOSTNAME% sshd[%PID%]: Invalid user %USER% from %IP%')
+        sshd = log_manipulator.Rule('sshd[%PID%]: Failed password for %USER% from %IP%')
+        sshd_one = log_manipulator.Rule('sshd[1]: Failed password for %USER% from %IP%')
+        sudo = log_manipulator.Rule('sudo: %USER% : %IP%')
+        # neither filter fits the other one, but the line "Oct 1 10:00:00 h sshd[1]: Invalid user Failed password for
+        # x from 1.2.3.4 from 1.2.3.4" fits both
+        self.assertTrue(failed.overlaps(invalid))
+        self.assertTrue(sshd.overlaps(sshd_one))
+        self.assertTrue(sshd_one.overlaps(sshd))
+        self.assertFalse(sshd.overlaps(sudo))
+        self.assertFalse(sudo.overlaps(sshd_one))
+
+    def reordered_filters(self, filters, lines):  # type: (List[str], List[str]) -> List[str]
+        """
+        Parses the lines by the filters and reorders the rules by their hits
+        :param filters: the filters in the order of the profile
+        :param lines: the log lines
+        :return: the filters in the order after the reorder
+        """
+        with TemporaryDirectory() as directory:
+            log_file = os.path.join(directory, 'auth.log')
+            with open(log_file, 'w') as f:
+                f.write(''.join(line + '\n' for line in lines))
+            parser = log_manipulator.LogParser(log_file, filters, backfill_workers=1, reorder_interval=None)
+            parser.parse_attacks()
+            parser.reorder_rules()
+            parser.close()
+        return [rule.filter_string for rule in parser._rule_order]
+
+    def test_reorder_disjoint_rules(self):
+        filters = ['sudo: %USER% : from %IP%', 'sshd[%PID%]: Failed password for %USER% from %IP%']
+        lines = ['sshd[1]: Failed password for root from 192.0.2.1'] * 3 + ['sudo: admin : from 192.0.2.2']
+        self.assertEqual(self.reordered_filters(filters, lines), filters[::-1])
+
+    def test_keep_order_of_overlapping_rules(self):
+        filters = ['sshd[%PID%]: Invalid user %USER% from %IP%', 'sshd[%PID%]: Failed password for %USER% from %IP%']
+        lines = ['sshd[1]: Failed password for root from 192.0.2.1'] * 3 + ['sshd[1]: Invalid user a from 192.0.2.2']
+        self.assertEqual(self.reordered_filters(filters, lines), filters)
+
+
+if __name__ == '__main__':
+    unittest.main()